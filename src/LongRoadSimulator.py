@@ -0,0 +1,406 @@
+import bisect
+from array import array
+import numpy as np
+from lane_index import LaneIndex
+from placement import drawRingConfiguration
+from renderer import makeRenderer
+
+class LaneFrames(object):
+	# Cars away from the ego car on a LongRoadSimulator road. They all cruise at the same speed
+	# and never interact, so each lane keeps them as sorted offsets (and ids) in a frame moving
+	# with them: a car's row is (offset + shift) mod roadRows, and moving all of them is a single
+	# update of shift. Offsets and ids are compact arrays, 12 bytes per car whatever the road
+	# length, and queries are bisections.
+	def __init__(self, numLanes, roadRows, carHeight):
+		self.roadRows = roadRows
+		self.carHeight = carHeight
+		self.shift = 0.0
+		self._offsets = [array('d') for _ in range(numLanes)]
+		self._ids = [array('i') for _ in range(numLanes)]
+
+	def __len__(self):
+		return sum(len(ids) for ids in self._ids)
+
+	def advance(self, rows):
+		self.shift = (self.shift + rows) % self.roadRows
+
+	# Replace all cars with the ones at the given [numCars, 2] (row, lane) positions, car i with id i
+	def load(self, carsPos):
+		for lane in range(len(self._ids)):
+			ids = np.flatnonzero(carsPos[:, 1] == lane)
+			offsets = (carsPos[ids, 0] - self.shift) % self.roadRows
+			order = np.argsort(offsets, kind='stable')
+			self._offsets[lane] = array('d', offsets[order].tolist())
+			self._ids[lane] = array('i', ids[order].tolist())
+
+	def insert(self, carID, lane, row):
+		offset = (row - self.shift) % self.roadRows
+		i = bisect.bisect_right(self._offsets[lane], offset)
+		self._offsets[lane].insert(i, offset)
+		self._ids[lane].insert(i, carID)
+
+	# Index ranges of the cars with rows in [start, stop), two of them when the rows wrap around
+	# the end of the frame. The higher range comes first, so they can be deleted in order
+	def _ranges(self, lane, start, stop):
+		offsets = self._offsets[lane]
+		low = (start - self.shift) % self.roadRows
+		high = low + (stop - start)
+		i = bisect.bisect_left(offsets, low)
+		if high <= self.roadRows:
+			return [(i, bisect.bisect_left(offsets, high))]
+		return [(i, len(offsets)), (0, bisect.bisect_left(offsets, high - self.roadRows))]
+
+	# Remove the cars with rows in [start, stop), returned as (carID, row) with rows in [start, stop)
+	def take(self, lane, start, stop):
+		offsets, ids = self._offsets[lane], self._ids[lane]
+		cars = []
+		for i, j in self._ranges(lane, start, stop):
+			for k in range(i, j):
+				cars.append((ids[k], start + (offsets[k] + self.shift - start) % self.roadRows))
+			del offsets[i:j]
+			del ids[i:j]
+		return cars
+
+	# Whether a car has cells in rows [start, stop), a car at row covering rows [row, row + carHeight)
+	def occupied(self, lane, start, stop):
+		return any(i < j for i, j in self._ranges(lane, start - self.carHeight + 1, stop))
+
+	# Copy of the frames, to be passed to restore(). Restoring copies again, so one snapshot can
+	# be restored any number of times
+	def snapshot(self):
+		return (self.shift, [array('d', offsets) for offsets in self._offsets], [array('i', ids) for ids in self._ids])
+
+	def restore(self, state):
+		shift, offsets, ids = state
+		self.shift = shift
+		self._offsets = [array('d', lane) for lane in offsets]
+		self._ids = [array('i', lane) for lane in ids]
+
+class ActiveCar(object):
+	# A car near the ego car, simulated one by one
+	__slots__ = ('row', 'lane', 'speedFrac', 'action', 'turned')
+
+	def __init__(self, row, lane, speedFrac, action):
+		self.row = row
+		self.lane = lane
+		self.speedFrac = speedFrac
+		self.action = action
+		self.turned = False
+
+	def copy(self):
+		car = ActiveCar(self.row, self.lane, self.speedFrac, self.action)
+		car.turned = self.turned
+		return car
+
+class LongRoadSnapshot(object):
+	# Dynamic state of a LongRoadSimulator, see LongRoadSimulator.snapshot
+	__slots__ = ('index', 'frames', 'active', 'EgoCarPos', 'EgoCarSpeedFrac',
+		'actionHistory', 'speedHistory', 'actionHead', 'speedHead', 'rngState')
+
+class LongRoadSimulator(object):
+	"""
+	The ego car on a ring road of longRoadRows grid rows with longRoadCars other cars, for roads
+	far longer than the canvas. Cars within longRoadMargin rows of the canvas are simulated with
+	the rules of TrafficSimulator, on a LaneIndex covering only that window. All other cars
+	cruise at longRoadCruiseFrac of their top speed in LaneFrames, joining the window when it
+	reaches them and leaving it when they fall behind or pull ahead. Memory and step time grow
+	with the number of cars near the ego car, not with the road length, and the dense grid is
+	only built for the canvas, as uint8 occupancy and float16 speeds (see window()).
+
+	It has the interface of TrafficSimulator (reset, progress, state, grid, snapshot, restore,
+	reward, close) and the same ego car rules. Rows are relative to the ego car as in
+	TrafficSimulator, counted from the bottom of the window: canvas row 0 is row
+	longRoadMargin. state() supports the 'grid' and 'lidar' observation features of
+	observation.py, with the same layout. 'vector' lists every car of the road and is not
+	supported, and neither are adaptive substeps.
+	"""
+	def __init__(self, config, rng=None):
+		for feature in config.observationFeatures:
+			if feature not in ('grid', 'lidar'):
+				raise ValueError('LongRoadSimulator only supports the grid and lidar observations, got {}'.format(config.observationFeatures))
+		self.canvasSize = [config.canvasHeight, config.canvasWidth]
+		self.gridHeight = config.gridHeight
+		self.numLanes = config.numLanes
+		self.carHeightGrid = config.carHeightGrid
+		self.decisionFreq = config.decisionFreq
+		self.numCars = config.longRoadCars
+		self.speedScaling = config.speedScaling
+		self.state_length = config.state_length
+		self.actionSpeedHistory = config.actionSpeedHistory
+		self.minSpeedFrac = config.minSpeedFrac
+		self.acc = config.acc
+		self.features = list(config.observationFeatures)
+
+		self.gridRows = self.canvasSize[0] // self.gridHeight
+		self.roadRows = config.longRoadRows
+		self.margin = config.longRoadMargin
+		self.windowRows = self.gridRows + 2 * self.margin
+		if self.roadRows < self.windowRows + 4 * self.carHeightGrid:
+			raise ValueError('A road of {} rows is shorter than the simulated window of {} rows'.format(self.roadRows, self.windowRows))
+		self.egoCarPos = config.egoCarPos + self.margin
+		self.egoID = self.numCars # ego car's slot in the lane index
+
+		self.EgoCarTopSpeed = config.egoTopSpeed
+		self.carTopSpeed = config.carTopSpeed
+		self.cruiseFrac = config.longRoadCruiseFrac
+		self.renderer = makeRenderer(config) # None unless a render mode is selected
+		self.rng = np.random if rng is None else rng # as TrafficSimulator.rng
+
+		# Canvas grids and pooling of the 'grid' feature, see observation.py
+		self._occupied = np.zeros((self.gridRows, self.numLanes), dtype=np.uint8)
+		self._speeds = np.zeros((self.gridRows, self.numLanes), dtype=np.float16)
+		self.poolRows = config.observationGridRows
+		poolOf = np.arange(self.gridRows) * self.poolRows // self.gridRows
+		self._poolStarts = np.searchsorted(poolOf, np.arange(self.poolRows))
+		self._invPoolSize = 1.0 / np.bincount(poolOf, minlength=self.poolRows)[:, None]
+		self.reset()
+
+	def reset(self):
+		self.index = LaneIndex(self.numLanes, self.windowRows, self.carHeightGrid)
+		self.frames = LaneFrames(self.numLanes, self.roadRows, self.carHeightGrid)
+		self.active = {} # carID -> ActiveCar of the cars in the window
+		self.initEgoCar()
+		# every car starts in the frames, at cruise speed, and the window takes its own
+		carsPos = drawRingConfiguration(self.numCars, self.numLanes, self.roadRows, self.carHeightGrid,
+			self.EgoCarPos[0], self.EgoCarPos[1], self.rng)
+		self.frames.load(carsPos)
+		self.exchangeCars()
+
+	def initEgoCar(self):
+		self.EgoCarSpeedFrac = 1.0
+		self.EgoCarPos = [int(self.egoCarPos), self.numLanes // 2]
+		self.index.insert(self.egoID, self.EgoCarPos[1], self.EgoCarPos[0])
+		self.index.fill(self.EgoCarPos[1], self.EgoCarPos[0], self.EgoCarPos[0] + self.carHeightGrid, self.EgoCarTopSpeed * self.EgoCarSpeedFrac)
+		# same ring histories as TrafficSimulator
+		self.actionHistory = np.zeros(self.actionSpeedHistory)
+		self.speedHistory = np.full(self.actionSpeedHistory, self.EgoCarTopSpeed)
+		self.actionHead = 0
+		self.speedHead = 0
+
+	# Copy of everything progress() reads and writes: the window's lane index, the frames, the
+	# cars of the window and the ego car. As TrafficSimulator.snapshot, with rng the state of
+	# self.rng is copied too so that restoring makes the following progress() calls repeat
+	# exactly. Copies every car of the road, O(longRoadCars)
+	def snapshot(self, rng=False):
+		snap = LongRoadSnapshot()
+		snap.index = self.index.snapshot()
+		snap.frames = self.frames.snapshot()
+		snap.active = dict((carID, car.copy()) for carID, car in self.active.items())
+		snap.EgoCarPos = list(self.EgoCarPos)
+		snap.EgoCarSpeedFrac = self.EgoCarSpeedFrac
+		snap.actionHistory = self.actionHistory.copy()
+		snap.speedHistory = self.speedHistory.copy()
+		snap.actionHead = self.actionHead
+		snap.speedHead = self.speedHead
+		snap.rngState = self.rng.get_state(legacy=False) if rng else None
+		return snap
+
+	def restore(self, snap):
+		self.index.restore(snap.index)
+		self.frames.restore(snap.frames)
+		self.active = dict((carID, car.copy()) for carID, car in snap.active.items())
+		self.EgoCarPos = list(snap.EgoCarPos)
+		self.EgoCarSpeedFrac = snap.EgoCarSpeedFrac
+		self.actionHistory[:] = snap.actionHistory
+		self.speedHistory[:] = snap.speedHistory
+		self.actionHead = snap.actionHead
+		self.speedHead = snap.speedHead
+		if snap.rngState is not None:
+			self.rng.set_state(snap.rngState)
+
+	# Canvas speed grid, built from the window's lane index
+	@property
+	def grid(self):
+		return self.window()[1]
+
+	# uint8 occupancy and float16 speed [gridRows, numLanes] grids of the canvas. Both are
+	# reused buffers, overwritten by the next call
+	def window(self):
+		self.index.toGrid(self._speeds, self.margin)
+		np.not_equal(self._speeds, 0, out=self._occupied)
+		return self._occupied, self._speeds
+
+	# Take an action for ego car, and simulate {{self.decisionFreq}} steps
+	def progress(self, action):
+		self.actionHistory[self.actionHead] = action
+		self.actionHead = (self.actionHead + 1) % self.actionSpeedHistory
+
+		# Cars in the window follow a random action, cars joining it later draw theirs when they join
+		for car, carAction in zip(self.active.values(), self.rng.randint(0, 5, len(self.active))):
+			car.action = carAction
+			car.turned = False
+
+		egoTurned = False
+		for t in range(self.decisionFreq):
+			egoTurned = self.substep(action, egoTurned)
+		return self.reward()
+
+	# Simulate one step as TrafficSimulator.substep does, then swap cars between the window and the frames
+	def substep(self, action, egoTurned):
+		order = sorted(self.active.items(), key=lambda item: item[1].row, reverse=True)
+		egoToMove = True
+		for carID, car in order:
+			if car.row < self.EgoCarPos[0] and egoToMove:
+				egoTurned = self.egoAction(action, egoTurned)
+				egoToMove = False
+			if car.action == 1 and not car.turned:
+				car.turned = self.carTurn(-1, carID, car)
+			elif car.action == 2 and not car.turned:
+				car.turned = self.carTurn(1, carID, car)
+			elif car.action == 3:
+				car.speedFrac = min(1.00, car.speedFrac + self.acc)
+			elif car.action == 4:
+				car.speedFrac = max(self.minSpeedFrac, car.speedFrac - self.acc)
+			self.checkCollisionCar(car)
+		# the ego car acts even when no car is below it
+		if egoToMove:
+			egoTurned = self.egoAction(action, egoTurned)
+
+		egoSpeed = self.EgoCarTopSpeed * self.EgoCarSpeedFrac
+		self.index.fill(self.EgoCarPos[1], self.EgoCarPos[0], self.EgoCarPos[0] + self.carHeightGrid, egoSpeed)
+		for carID, car in order:
+			self.moveCar(carID, car, egoSpeed)
+		self.frames.advance((self.carTopSpeed * self.cruiseFrac - egoSpeed) / self.speedScaling)
+		self.exchangeCars()
+
+		self.speedHistory[self.speedHead] = egoSpeed
+		self.speedHead = (self.speedHead + 1) % self.actionSpeedHistory
+		if self.renderer is not None:
+			self.renderer.render(self.grid)
+		return egoTurned
+
+	# Move the cars of the frames that are now in the window into it, at cruise speed. Cars of the
+	# frames do not brake, so one reaching a car of the window queues up behind it instead, and
+	# stays in the frames if that leaves it below the window
+	def exchangeCars(self):
+		h = self.carHeightGrid
+		for lane in range(self.numLanes):
+			for carID, row in sorted(self.frames.take(lane, 0, self.windowRows), key=lambda item: item[1], reverse=True):
+				row = int(row)
+				front = self.index.leader(lane, row - h)
+				if front is not None and front[1] < row + h:
+					row = front[1] - h
+					if row < 0:
+						self.frames.insert(carID, lane, row)
+						continue
+				car = ActiveCar(row, lane, self.cruiseFrac, self.rng.randint(5))
+				self.active[carID] = car
+				self.index.insert(carID, lane, car.row)
+				self.index.fill(lane, car.row, car.row + h, self.carTopSpeed * car.speedFrac)
+
+	# The ego car's rules of TrafficSimulator, which only look at the window
+	def egoAction(self, action, egoTurned):
+		if action == 1 and not egoTurned:
+			egoTurned = self.egoTurn(-1)
+		elif action == 2 and not egoTurned:
+			egoTurned = self.egoTurn(1)
+		if action == 3:
+			self.EgoCarSpeedFrac = min(1.00, self.EgoCarSpeedFrac + self.acc)
+		elif action == 4:
+			self.EgoCarSpeedFrac = max(self.minSpeedFrac, self.EgoCarSpeedFrac - self.acc)
+		self.checkCollisionEgo()
+		return egoTurned
+
+	def checkCollisionEgo(self):
+		h, (row, lane) = self.carHeightGrid, self.EgoCarPos
+		frontCarSpeed = self.index.maxSpeed(lane, row + h, row + 2 * h)
+		if frontCarSpeed > 0:
+			self.EgoCarSpeedFrac = frontCarSpeed / 2.0 / self.EgoCarTopSpeed
+		elif self.index.occupied(lane, row + 2 * h, row + 2 * h + 1):
+			self.EgoCarSpeedFrac = self.index.maxSpeed(lane, row + 2 * h, row + 2 * h + 1) / self.EgoCarTopSpeed
+
+	def egoTurn(self, direction):
+		h, (row, lane) = self.carHeightGrid, self.EgoCarPos
+		if lane + direction < 0 or lane + direction >= self.numLanes or \
+					self.index.occupied(lane + direction, row - h, row + 2 * h):
+			return False
+		self.index.fill(lane + direction, row, row + h, self.EgoCarTopSpeed * self.EgoCarSpeedFrac)
+		self.index.fill(lane, row, row + h, 0.0)
+		self.index.move(self.egoID, lane, row, lane + direction, row)
+		self.EgoCarPos[1] += direction
+		return True
+
+	# Max speed of the cells in rows [start, stop) of a lane, counting the cars of the frames
+	# beyond the window
+	def maxSpeed(self, lane, start, stop):
+		speed = self.index.maxSpeed(lane, max(start, 0), stop)
+		if (start < self.carHeightGrid or stop > self.windowRows) and self.frames.occupied(lane, start, stop):
+			speed = max(speed, self.carTopSpeed * self.cruiseFrac)
+		return speed
+
+	def checkCollisionCar(self, car):
+		h = self.carHeightGrid
+		frontCarSpeed = self.maxSpeed(car.lane, car.row + h, car.row + 2 * h)
+		if frontCarSpeed > 0:
+			car.speedFrac = frontCarSpeed / 2.0 / self.carTopSpeed
+		else:
+			followSpeed = self.maxSpeed(car.lane, car.row + 2 * h, car.row + 2 * h + 1)
+			if followSpeed > 0:
+				car.speedFrac = followSpeed / self.carTopSpeed
+
+	# Move a car by its speed relative to the ego car, into the frames if it leaves the window
+	def moveCar(self, carID, car, egoSpeed):
+		h = self.carHeightGrid
+		self.index.fill(car.lane, car.row, car.row + h, 0.0)
+		newRow = int(car.row + (self.carTopSpeed * car.speedFrac - egoSpeed) / self.speedScaling)
+		if newRow < 0 or newRow >= self.windowRows:
+			self.index.remove(carID, car.lane, car.row)
+			del self.active[carID]
+			self.frames.insert(carID, car.lane, newRow)
+			return
+		self.index.move(carID, car.lane, car.row, car.lane, newRow)
+		car.row = newRow
+		self.index.fill(car.lane, newRow, newRow + h, self.carTopSpeed * car.speedFrac)
+
+	def carTurn(self, direction, carID, car):
+		h, row, lane = self.carHeightGrid, car.row, car.lane
+		if lane + direction < 0 or lane + direction >= self.numLanes or \
+					self.maxSpeed(lane + direction, row - h, row + 2 * h) > 0:
+			return False
+		self.index.fill(lane + direction, row, row + h, self.carTopSpeed * car.speedFrac)
+		self.index.fill(lane, row, row + h, 0.0)
+		self.index.move(carID, lane, row, lane + direction, row)
+		car.lane += direction
+		return True
+
+	def reward(self):
+		return np.mean(self.speedHistory)
+
+	def close(self):
+		if self.renderer is not None:
+			self.renderer.close()
+
+	# Return state of the simulator, written into out if given (see observation.py for the layout)
+	def state(self, out=None):
+		if out is None:
+			out = np.empty(self.state_length)
+		offset = 0
+		for feature in self.features:
+			if feature == 'grid':
+				offset = self.writeGrid(out, offset)
+			else:
+				offset = self.writeLidar(out, offset)
+		return out
+
+	def writeGrid(self, out, offset):
+		size = self.poolRows * self.numLanes
+		occupied, speeds = self.window()
+		counts = np.add.reduceat(occupied, self._poolStarts, axis=0, dtype=np.float32)
+		speedSums = np.add.reduceat(speeds, self._poolStarts, axis=0, dtype=np.float32)
+		out[offset:offset + size] = (counts * self._invPoolSize).ravel()
+		out[offset + size:offset + 2 * size] = (speedSums / np.maximum(counts, 1)).ravel()
+		return offset + 2 * size
+
+	# Same as ObservationBuilder.writeLidar, which sees the cars of the margins too
+	def writeLidar(self, out, offset):
+		L, row = self.numLanes, self.EgoCarPos[0]
+		values = [0.0] * (4 * L)
+		for lane in range(L):
+			for car, block in ((self.index.leader(lane, row - 1, self.egoID), 0), (self.index.follower(lane, row, self.egoID), 2 * L)):
+				if car is None:
+					values[block + lane] = self.gridRows
+				else:
+					values[block + lane] = abs(car[1] - row) - self.carHeightGrid
+					values[block + L + lane] = self.carTopSpeed * self.active[car[0]].speedFrac
+		out[offset:offset + 4 * L] = values
+		return offset + 4 * L
@@ -1,9 +1,17 @@
 import numpy as np
-import time
 from config import Config
+from renderer import makeRenderer
+from lane_index import LaneIndex
+from observation import ObservationBuilder
+from placement import PLACEMENT_TRIES, RoadJammed, drawFreeSlot, drawConfiguration, ScenarioBank
+
+class SimulatorSnapshot(object):
+	# Dynamic state of a TrafficSimulator, see TrafficSimulator.snapshot
+	__slots__ = ('index', 'carsPos', 'carsSpeedFrac', 'EgoCarPos', 'EgoCarSpeedFrac',
+		'actionHistory', 'speedHistory', 'actionHead', 'speedHead', 'rngState')
 
 class TrafficSimulator(object):
-	def __init__(self, config):
+	def __init__(self, config, rng=None):
 		self.canvasSize = [config.canvasHeight, config.canvasWidth]
 		self.gridHeight = config.gridHeight
 		self.numLanes = config.numLanes
@@ -16,16 +24,41 @@ class TrafficSimulator(object):
 		self.minSpeedFrac = config.minSpeedFrac # Require a min speed for each car
 		self.egoCarPos = config.egoCarPos # Fix ego car vertical axis
 		self.acc = config.acc # Acceleration per second
+		self.adaptiveSubsteps = config.adaptiveSubsteps # advance isolated cars with scalar updates, see isolateCars
+		self.rng = np.random if rng is None else rng # random source of placements and of the other cars' actions
+
+		self.gridRows = self.canvasSize[0] // self.gridHeight
+		self.egoID = self.numCars # ego car's slot in the lane index
 
 		self.EgoCarTopSpeed = config.egoTopSpeed
 		self.carsTopSpeed = np.full((config.numCars), config.carTopSpeed)
+		# Bounds for adaptive substeps: speeds never exceed topSpeed, so a car moves less than
+		# maxRows rows per step relative to the ego car
+		self.topSpeed = max(config.carTopSpeed, config.egoTopSpeed)
+		self.maxRows = self.topSpeed / self.speedScaling + 1
+		self.horizon = np.zeros(self.numCars, dtype=int) # steps isolated cars are known to stay isolated
+		self.carAction = np.zeros(self.numCars, dtype=int) # other cars' random actions of the last progress() call, see traces.py
+		self.renderer = makeRenderer(config) # None unless a render mode is selected
+		self.observation = ObservationBuilder(config) # features returned by state()
+		self.scenarios = ScenarioBank(config) if config.scenarioBankSize > 0 else None # initial car positions
 		self.reset()
 
 	# Reset Simulator
 	def reset(self):
-		self.grid = np.zeros((self.canvasSize[0] // self.gridHeight, self.numLanes)) # grid consists of the speed of occupied car
+		# Cars are tracked by a per-lane sorted index, the dense grid is only built on demand
+		self.index = LaneIndex(self.numLanes, self.gridRows, self.carHeightGrid)
 		self.initEgoCar()
-		self.initCars()
+		if self.scenarios is not None:
+			self.initCarsFrom(self.scenarios[self.rng.randint(len(self.scenarios))])
+			return
+		try:
+			self.initCars()
+		except RoadJammed:
+			# the cars placed so far leave no room for the next one, redraw the whole road
+			self.index = LaneIndex(self.numLanes, self.gridRows, self.carHeightGrid)
+			self.initEgoCar()
+			self.initCarsFrom(drawConfiguration(self.numCars, self.numLanes, self.gridRows, self.carHeightGrid,
+				self.EgoCarPos[0], self.EgoCarPos[1], self.rng))
 
 	# Initialize Ego Car parameters
 	def initEgoCar(self):
@@ -33,11 +66,14 @@ class TrafficSimulator(object):
 		self.EgoCarSpeedFrac = 1.0
 		# Position of ego car. vertical axis always fixed so that we only worry about relative movements of other cars
 		self.EgoCarPos = [int(self.egoCarPos), self.numLanes // 2] 
-		# Fill ego car speed into the grid (need to round vertical axis value)
-		self.grid[self.EgoCarPos[0] : (self.EgoCarPos[0] + self.carHeightGrid), self.EgoCarPos[1]] = self.EgoCarTopSpeed * self.EgoCarSpeedFrac
-		# Tracking history for potential reward function calculation
-		self.actionHistory = [0] * self.actionSpeedHistory
-		self.speedHistory = [self.EgoCarTopSpeed] * self.actionSpeedHistory
+		self.index.insert(self.egoID, self.EgoCarPos[1], self.EgoCarPos[0])
+		self.index.fill(self.EgoCarPos[1], self.EgoCarPos[0], self.EgoCarPos[0] + self.carHeightGrid, self.EgoCarTopSpeed * self.EgoCarSpeedFrac)
+		# Tracking history for potential reward function calculation. Fixed-size ring arrays,
+		# the oldest entry is at actionHead / speedHead
+		self.actionHistory = np.zeros(self.actionSpeedHistory)
+		self.speedHistory = np.full(self.actionSpeedHistory, self.EgoCarTopSpeed)
+		self.actionHead = 0
+		self.speedHead = 0
 
 	# Initialize other 20 cars parameters
 	def initCars(self):
@@ -47,161 +83,385 @@ class TrafficSimulator(object):
 		# Randomly initialize all car positions
 		self.carsPos = np.zeros((self.numCars, 2), dtype=int)
 		for i in range(self.numCars):
-			gridHeight = np.random.randint(self.grid.shape[0] - self.carHeightGrid)
-			lane = np.random.randint(self.grid.shape[1])
+			gridHeight = self.rng.randint(self.gridRows - self.carHeightGrid)
+			lane = self.rng.randint(self.numLanes)
 			# Need to ensure that cars on the same lane are apart by at least 4 grids to avoid collision
-			while (np.sum(self.grid[max(0, gridHeight - self.carHeightGrid):min(gridHeight + 2 * self.carHeightGrid, self.grid.shape[0]), lane]) != 0):
-				gridHeight = np.random.randint(self.grid.shape[0] - self.carHeightGrid)
-				lane = np.random.randint(self.grid.shape[1])
+			tries = 1
+			while self.index.occupied(lane, max(0, gridHeight - self.carHeightGrid), min(gridHeight + 2 * self.carHeightGrid, self.gridRows)):
+				if tries == PLACEMENT_TRIES:
+					# dense road, draw among the free slots directly
+					gridHeight, lane = drawFreeSlot(self.index.toGrid() != 0, self.carHeightGrid, self.rng)
+					break
+				gridHeight = self.rng.randint(self.gridRows - self.carHeightGrid)
+				lane = self.rng.randint(self.numLanes)
+				tries += 1
 			self.carsPos[i, 0] = gridHeight
 			self.carsPos[i, 1] = lane
-			self.grid[self.carsPos[i, 0] : (self.carsPos[i, 0] + self.carHeightGrid), self.carsPos[i, 1]] = self.carsTopSpeed[i] * self.carsSpeedFrac[i]
+			self.index.insert(i, lane, gridHeight)
+			self.index.fill(lane, gridHeight, gridHeight + self.carHeightGrid, self.carsTopSpeed[i] * self.carsSpeedFrac[i])
+
+	# Copy of everything progress() reads and writes: the lane index (which the grid is built
+	# from), car and ego state and histories, about 10 us. Restores fork differently randomized
+	# continuations from the same prefix. With rng, the state of self.rng is copied too (left
+	# untouched, so taking a snapshot never changes the episode), and restoring the snapshot
+	# makes the following progress() calls repeat exactly. That takes about 80 us more for
+	# np.random's Mersenne Twister, 3 us for a simulator given
+	# rng=np.random.RandomState(np.random.PCG64(seed)).
+	def snapshot(self, rng=False):
+		snap = SimulatorSnapshot()
+		snap.index = self.index.snapshot()
+		snap.carsPos = self.carsPos.copy()
+		snap.carsSpeedFrac = self.carsSpeedFrac.copy()
+		snap.EgoCarPos = list(self.EgoCarPos)
+		snap.EgoCarSpeedFrac = self.EgoCarSpeedFrac
+		snap.actionHistory = self.actionHistory.copy()
+		snap.speedHistory = self.speedHistory.copy()
+		snap.actionHead = self.actionHead
+		snap.speedHead = self.speedHead
+		snap.rngState = self.rng.get_state(legacy=False) if rng else None
+		return snap
+
+	def restore(self, snap):
+		self.index.restore(snap.index)
+		self.carsPos[:] = snap.carsPos
+		self.carsSpeedFrac[:] = snap.carsSpeedFrac
+		self.EgoCarPos = list(snap.EgoCarPos)
+		self.EgoCarSpeedFrac = snap.EgoCarSpeedFrac
+		self.actionHistory[:] = snap.actionHistory
+		self.speedHistory[:] = snap.speedHistory
+		self.actionHead = snap.actionHead
+		self.speedHead = snap.speedHead
+		if snap.rngState is not None:
+			self.rng.set_state(snap.rngState)
+
+	# Place the cars at the given [numCars, 2] (row, lane) positions, at full speed
+	def initCarsFrom(self, carsPos):
+		self.carsSpeedFrac = np.full((self.numCars), 1.0)
+		self.carsPos = np.array(carsPos, dtype=int)
+		for i in range(self.numCars):
+			gridHeight, lane = self.carsPos[i]
+			self.index.insert(i, lane, gridHeight)
+			self.index.fill(lane, gridHeight, gridHeight + self.carHeightGrid, self.carsTopSpeed[i] * self.carsSpeedFrac[i])
+
+	# Dense [rows, lanes] grid of car speeds, materialized from the lane index
+	@property
+	def grid(self):
+		return self.index.toGrid()
 
 
 	# Take an action for ego car, and simulate {{self.decisionFreq}} steps
 	def progress(self, action):
 		# Valid actions: [0: stay the same; 1: left; 2: right; 3: accelerate; 4: decelerate]
-		self.actionHistory.append(action)
-		if len(self.actionHistory) > self.actionSpeedHistory: self.actionHistory.pop(0) # Potentially only keep a short history
+		self.actionHistory[self.actionHead] = action # Potentially only keep a short history
+		self.actionHead = (self.actionHead + 1) % self.actionSpeedHistory
 
 		# Assume all other cars follow a random action
-		carAction = np.random.randint(0, 5, self.numCars)
+		carAction = self.carAction = self.rng.randint(0, 5, self.numCars)
 		
 		# If action is to turn, retry in the next t if failed to turn
 		egoTurned = False
 		carTurned = [False] * self.numCars
 
+		# Cars that cannot interact with anything during this decision are taken out of the per-car
+		# loops and advanced with scalar updates, see isolateCars
+		isolated = None
+		if self.adaptiveSubsteps and self.renderer is None and self.decisionFreq > 1:
+			isolated = self.isolateCars(action, carAction)
+
 		#Simulate t steps
 		for t in range(self.decisionFreq):
-			# Simulate in the order of car positions: top cars move first. This order is easier to track
-			# and avoid collisions
-			order = np.flip(np.argsort(self.carsPos[:,0], axis = 0), axis = 0)
-			print("==> ", order)
-			print("++> ", self.carsPos)
-			egoToMove = True #Need to move ego car in one of the loop
-
-			# Note that in the first loop we only change lane and set up the speeds. Once we have the speed
-			# for all cars (including ego), we can then easily move according to relative speed diff
-			for i in range(self.numCars):
-				carID = order[i]
-
-				# Ego car's turn to move
-				if self.carsPos[carID, 0] < self.EgoCarPos[0] and egoToMove:
-					if action == 1 and not egoTurned:
-						egoTurned = self.egoTurn(-1)
-					elif action == 2 and not egoTurned:
-						egoTurned = self.egoTurn(1)
-					if action == 3:
-						self.EgoCarSpeedFrac = min(1.00, self.EgoCarSpeedFrac + self.acc)
-					elif action == 4:
-						self.EgoCarSpeedFrac = max(self.minSpeedFrac, self.EgoCarSpeedFrac - self.acc)
-					egoToMove = False
-					
-					self.checkCollisionEgo() #Check for collision. If dangerous, will change speed
-
-				# other car take actions
-				if carAction[carID] == 1 and not carTurned[carID]:
-					carTurned[carID] = self.carTurn(-1, carID)
-				elif carAction[carID] == 2 and not carTurned[carID]:
-					carTurned[carID] = self.carTurn(1, carID)
-				elif carAction[carID] == 3:
+			egoTurned = self.substep(action, carAction, carTurned, egoTurned, isolated)
+
+		if isolated is not None:
+			for carID in np.flatnonzero(isolated):
+				self.rejoinCar(carID, self.carsSpeedFrac[carID])
+		return self.reward()
+
+	# Simulate one step. Returns the updated egoTurned, carTurned is updated in place
+	def substep(self, action, carAction, carTurned, egoTurned, isolated=None):
+		# Simulate in the order of car positions: top cars move first. This order is easier to track
+		# and avoid collisions
+		order = np.flip(np.argsort(self.carsPos[:,0], axis = 0), axis = 0)
+		if isolated is not None:
+			self.checkIsolated(isolated, action, carAction, carTurned, egoTurned)
+			order = order[~isolated[order]]
+		egoToMove = True #Need to move ego car in one of the loop
+
+		# Note that in the first loop we only change lane and set up the speeds. Once we have the speed
+		# for all cars (including ego), we can then easily move according to relative speed diff
+		for carID in order:
+			# Ego car's turn to move
+			if self.carsPos[carID, 0] < self.EgoCarPos[0] and egoToMove:
+				egoTurned = self.egoAction(action, egoTurned)
+				egoToMove = False
+
+			# other car take actions
+			if carAction[carID] == 1 and not carTurned[carID]:
+				carTurned[carID] = self.carTurn(-1, carID)
+			elif carAction[carID] == 2 and not carTurned[carID]:
+				carTurned[carID] = self.carTurn(1, carID)
+			elif carAction[carID] == 3:
+				self.carsSpeedFrac[carID] = min(1.00, self.carsSpeedFrac[carID] + self.acc)
+			elif carAction[carID] == 4:
+				self.carsSpeedFrac[carID] = max(self.minSpeedFrac, self.carsSpeedFrac[carID] - self.acc)
+			self.checkCollisionCar(carID) #Check for collision. If dangerous, will change speed
+
+		if isolated is not None:
+			ids = np.flatnonzero(isolated)
+			# The ego car moves before the first car below it, which may be an isolated one
+			if egoToMove and (self.carsPos[ids, 0] < self.EgoCarPos[0]).any():
+				egoTurned = self.egoAction(action, egoTurned)
+			# Same speed updates as above, isolated cars never turn and their checks find nothing
+			speedFrac = self.carsSpeedFrac[ids]
+			for carID in ids:
+				if carAction[carID] == 3:
 					self.carsSpeedFrac[carID] = min(1.00, self.carsSpeedFrac[carID] + self.acc)
 				elif carAction[carID] == 4:
 					self.carsSpeedFrac[carID] = max(self.minSpeedFrac, self.carsSpeedFrac[carID] - self.acc)
-				self.checkCollisionCar(carID) #Check for collision. If dangerous, will change speed
+			if len(ids) and self.landingMayClip():
+				# back to plain stepping for the rest of the decision, with the speeds the cars'
+				# grid cells were written with
+				for carID, frac in zip(ids, speedFrac):
+					isolated[carID] = False
+					self.rejoinCar(carID, frac)
+				order = np.flip(np.argsort(self.carsPos[:,0], axis = 0), axis = 0)
 
-			# Now update the grid and location of all cars
-			self.grid[int(np.around(self.EgoCarPos[0])) : (int(np.around(self.EgoCarPos[0])) + self.carHeightGrid), \
-				int(np.around(self.EgoCarPos[1]))] = self.EgoCarTopSpeed * self.EgoCarSpeedFrac
-			for i in range(self.numCars):
-				carID = order[i]
-				self.moveCar(carID)
+		# Now update the grid and location of all cars
+		self.index.fill(self.EgoCarPos[1], self.EgoCarPos[0], self.EgoCarPos[0] + self.carHeightGrid, self.EgoCarTopSpeed * self.EgoCarSpeedFrac)
+		for carID in order:
+			self.moveCar(carID)
+		if isolated is not None:
+			# Same move as moveCar, isolated cars stay on the grid and off the lane index
+			for carID in np.flatnonzero(isolated):
+				diff = ((self.carsTopSpeed[carID] * self.carsSpeedFrac[carID]) -
+											(self.EgoCarTopSpeed * self.EgoCarSpeedFrac)) / self.speedScaling
+				self.carsPos[carID, 0] += diff
+				self.horizon[carID] -= 1
 
-			# Append speed history for reward
-			self.speedHistory.append(self.EgoCarTopSpeed * self.EgoCarSpeedFrac)
-			if len(self.speedHistory) > self.actionSpeedHistory: self.speedHistory.pop(0)
+		# Append speed history for reward
+		self.speedHistory[self.speedHead] = self.EgoCarTopSpeed * self.EgoCarSpeedFrac
+		self.speedHead = (self.speedHead + 1) % self.actionSpeedHistory
 
-			self.print_grid()
+		if self.renderer is not None:
+			self.renderer.render(self.grid)
+		return egoTurned
 
-		return self.reward()
+	def egoAction(self, action, egoTurned):
+		if action == 1 and not egoTurned:
+			egoTurned = self.egoTurn(-1)
+		elif action == 2 and not egoTurned:
+			egoTurned = self.egoTurn(1)
+		if action == 3:
+			self.EgoCarSpeedFrac = min(1.00, self.EgoCarSpeedFrac + self.acc)
+		elif action == 4:
+			self.EgoCarSpeedFrac = max(self.minSpeedFrac, self.EgoCarSpeedFrac - self.acc)
+		self.checkCollisionEgo() #Check for collision. If dangerous, will change speed
+		return egoTurned
+
+	# Adaptive substeps. Most cars spend most of a decision far from every other car: their
+	# collision checks find nothing, no other car's checks or grid writes reach them, and they
+	# only accelerate, decelerate and drift. isolateCars takes such cars off the lane index at
+	# the start of a decision, substep advances them with a few scalar updates instead of the
+	# lane index queries and writes, and they rejoin the index when the decision ends.
+	#
+	# A car stays isolated while no other car can come within 2 * carHeightGrid rows of it on
+	# its lane, counting cars that may still turn into that lane and cars wrapping around,
+	# which land at either end of the grid. Whatever the other cars do, they close in at most
+	# at the speed difference to a stopped or a top speed car, plus truncation, so the gaps
+	# found by isolationHorizon guarantee that for a number of steps without looking at the
+	# road again. Isolated cars also keep clear of the rows where a lane's lowest or
+	# highest car decides where wrapped cars land. The one write that can reach an isolated car
+	# from anywhere is that of a car landing far below the grid, whose cells wrap around like
+	# negative slices, and landingMayClip returns everything to plain stepping before one can
+	# happen. Results, the lane index and the self.rng stream are exactly those of plain
+	# stepping.
+	def isolateCars(self, action, carAction):
+		h = self.carHeightGrid
+		if (self.carsPos[:, 0] < -h).any():
+			return None
+		isolated = np.zeros(self.numCars, dtype=bool)
+		carTurned = [False] * self.numCars
+		strays = {}
+		for carID in range(self.numCars):
+			row, lane = int(self.carsPos[carID, 0]), int(self.carsPos[carID, 1])
+			direction = self.turnDirection(carID, action, carAction, carTurned, False)
+			if direction != 0 and 0 <= lane + direction < self.numLanes:
+				continue
+			# taking a car off the index and back costs about as much as one plain step
+			horizon = self.isolationHorizon(carID, action, carAction, carTurned, False, isolated)
+			if horizon < 2:
+				continue
+			# the grid must hold exactly the cells of the cars in the lane
+			if lane not in strays:
+				strays[lane] = self.index.hasStrayCells(lane)
+			if strays[lane] or not self.index.holds(lane, row, row + h, self.carsTopSpeed[carID] * self.carsSpeedFrac[carID]):
+				continue
+			isolated[carID] = True
+			self.horizon[carID] = horizon
+		if not isolated.any():
+			return None
+		for carID in np.flatnonzero(isolated):
+			row, lane = int(self.carsPos[carID, 0]), int(self.carsPos[carID, 1])
+			self.index.fill(lane, row, row + h, 0.0)
+			self.index.remove(carID, lane, row)
+		return isolated
+
+	# Lane change a car (or the ego car) may still make in this decision: -1, 0 or +1
+	def turnDirection(self, carID, action, carAction, carTurned, egoTurned):
+		a, turned = (action, egoTurned) if carID == self.egoID else (carAction[carID], carTurned[carID])
+		if turned:
+			return 0
+		return -1 if a == 1 else (1 if a == 2 else 0)
+
+	# Number of steps, from this one, during which the car is guaranteed to stay isolated
+	def isolationHorizon(self, carID, action, carAction, carTurned, egoTurned, isolated):
+		h = self.carHeightGrid
+		row, lane = int(self.carsPos[carID, 0]), int(self.carsPos[carID, 1])
+		# the car's speed range over the decision
+		frac = self.carsSpeedFrac[carID]
+		if carAction[carID] == 3:
+			last = min(1.00, frac + self.decisionFreq * self.acc) if frac < 1.00 else 1.00
+		elif carAction[carID] == 4:
+			last = max(self.minSpeedFrac, frac - self.decisionFreq * self.acc) if frac > self.minSpeedFrac else self.minSpeedFrac
+		else:
+			last = frac
+		low, high = self.carsTopSpeed[carID] * min(frac, last), self.carsTopSpeed[carID] * max(frac, last)
+		# rows per step anything below / above can close in, truncation included
+		fromBelow = (self.topSpeed - low) / self.speedScaling + 2
+		fromAbove = high / self.speedScaling + 2
+
+		# wrapped cars land at either end of the grid
+		below, above = row - (1 - h), self.gridRows - 1 - row
+		for other in (lane - 1, lane, lane + 1):
+			if other == lane:
+				gaps = self.index.gaps(lane, row, exclude=carID)
+			elif 0 <= other < self.numLanes:
+				turning = lambda i: self.turnDirection(i, action, carAction, carTurned, egoTurned) == lane - other
+				gaps = self.index.gaps(other, row, exclude=carID, keep=turning)
+			else:
+				continue
+			below, above = min(below, gaps[0]), min(above, gaps[1])
+		for other in np.flatnonzero(isolated):
+			if other != carID and self.carsPos[other, 1] == lane:
+				gap = int(self.carsPos[other, 0]) - row
+				below, above = (min(below, -gap), above) if gap < 0 else (below, min(above, gap))
+
+		steps = min((below - 2 * h - 1) // fromBelow, (above - 2 * h - 1) // fromAbove,
+			# and the car itself stays clear of the rows where wrapped cars land
+			(row - 1 - h) // (fromBelow - 1), (self.gridRows - 1 - 2 * h - row) // (fromAbove - 1))
+		return max(int(steps), 0)
+
+	# Rejoin the isolated cars whose horizon ran out and cannot be extended
+	def checkIsolated(self, isolated, action, carAction, carTurned, egoTurned):
+		for carID in np.flatnonzero(isolated):
+			if self.horizon[carID] <= 0:
+				self.horizon[carID] = self.isolationHorizon(carID, action, carAction, carTurned, egoTurned, isolated)
+				if self.horizon[carID] == 0:
+					isolated[carID] = False
+					self.rejoinCar(carID, self.carsSpeedFrac[carID])
+
+	# Whether a car wrapping past the top in the coming move phase could land below the grid far
+	# enough for its writes to wrap around, i.e. below a car less than carHeightGrid rows high
+	def landingMayClip(self):
+		if self.carsPos[:, 0].max() < self.gridRows - self.maxRows:
+			return False
+		wraps, low = 0, False
+		egoSpeed = self.EgoCarTopSpeed * self.EgoCarSpeedFrac
+		for lane in range(self.numLanes):
+			lowest = self.index.lowest(lane, exclude=self.egoID)
+			low = low or (lowest is not None and lowest < self.carHeightGrid + self.maxRows)
+			for carID, row in self.index.carsFrom(lane, self.gridRows - self.maxRows):
+				if carID != self.egoID and int(self.carsPos[carID, 0] + (self.carsTopSpeed[carID] * self.carsSpeedFrac[carID] - egoSpeed) / self.speedScaling) >= self.gridRows:
+					wraps += 1
+		return wraps > 1 or (wraps == 1 and low)
+
+	def rejoinCar(self, carID, speedFrac):
+		row, lane = int(self.carsPos[carID, 0]), int(self.carsPos[carID, 1])
+		self.index.insert(carID, lane, row)
+		self.index.fill(lane, row, row + self.carHeightGrid, self.carsTopSpeed[carID] * speedFrac)
 
 	# Check collision for ego car
 	def checkCollisionEgo(self):
+		row, lane = self.EgoCarPos
 		# Car in front of us and if with distance < 3, too dangerous, we immediately step on brake
-		frontCarSpeed = np.max(self.grid[int(np.around(self.EgoCarPos[0])) + self.carHeightGrid : (int(np.around(self.EgoCarPos[0])) + 2 * self.carHeightGrid), 
-										int(np.around(self.EgoCarPos[1]))])
+		frontCarSpeed = self.index.maxSpeed(lane, row + self.carHeightGrid, row + 2 * self.carHeightGrid)
 		if frontCarSpeed > 0:
 			self.EgoCarSpeedFrac = frontCarSpeed / 2.0 / self.EgoCarTopSpeed #brake reduce our speed to half of front car
 		# If car is 4 grids from us, just take its speed and follow
-		elif self.grid[int(np.around(self.EgoCarPos[0])) + 2 * self.carHeightGrid, int(np.around(self.EgoCarPos[1]))] > 0:
-			self.EgoCarSpeedFrac = self.grid[int(np.around(self.EgoCarPos[0])) + 2 * self.carHeightGrid, int(np.around(self.EgoCarPos[1]))] / self.EgoCarTopSpeed
+		elif self.index.occupied(lane, row + 2 * self.carHeightGrid, row + 2 * self.carHeightGrid + 1):
+			self.EgoCarSpeedFrac = self.index.maxSpeed(lane, row + 2 * self.carHeightGrid, row + 2 * self.carHeightGrid + 1) / self.EgoCarTopSpeed
 
 	# Same check collision for other cars
 	def checkCollisionCar(self, carID):
-		if self.carsPos[carID, 0] + self.carHeightGrid >= self.grid.shape[0] or \
-			self.carsPos[carID, 0] + self.carHeightGrid < 0: return
-		frontCarSpeed = np.max(self.grid[int(np.around(self.carsPos[carID, 0])) + self.carHeightGrid : min((int(np.around(self.carsPos[carID, 0])) + 2 * self.carHeightGrid), self.grid.shape[0]), 
-										int(np.around(self.carsPos[carID, 1]))])
+		row, lane = int(self.carsPos[carID, 0]), int(self.carsPos[carID, 1])
+		if row + self.carHeightGrid >= self.gridRows or row + self.carHeightGrid < 0: return
+		frontCarSpeed = self.index.maxSpeed(lane, row + self.carHeightGrid, min(row + 2 * self.carHeightGrid, self.gridRows))
 		if frontCarSpeed > 0:
 			self.carsSpeedFrac[carID] = frontCarSpeed / 2.0 / self.carsTopSpeed[carID]
-		elif (int(np.around(self.carsPos[carID, 0])) + 2 * self.carHeightGrid) < self.grid.shape[0] and self.grid[int(np.around(self.carsPos[carID, 0])) + 2 * self.carHeightGrid, int(np.around(self.carsPos[carID, 1]))] > 0:
-			self.carsSpeedFrac[carID] = self.grid[int(np.around(self.carsPos[carID, 0])) + 2 * self.carHeightGrid, int(np.around(self.carsPos[carID, 1]))] / self.carsTopSpeed[carID]
+		elif row + 2 * self.carHeightGrid < self.gridRows and self.index.occupied(lane, row + 2 * self.carHeightGrid, row + 2 * self.carHeightGrid + 1):
+			self.carsSpeedFrac[carID] = self.index.maxSpeed(lane, row + 2 * self.carHeightGrid, row + 2 * self.carHeightGrid + 1) / self.carsTopSpeed[carID]
 
 	# Update the position and grid for all other cars according to relative speed diff
 	def moveCar(self, carID):
+		row, lane = int(self.carsPos[carID, 0]), int(self.carsPos[carID, 1])
 		# remove the grid of our old positions 
-		self.grid[max(0, int(np.around(self.carsPos[carID, 0]))): min(int(np.around(self.carsPos[carID, 0])) + self.carHeightGrid, self.grid.shape[0]), int(np.around(self.carsPos[carID, 1]))] = 0.0
+		self.index.fill(lane, max(0, row), min(row + self.carHeightGrid, self.gridRows), 0.0)
 
 		diff = ((self.carsTopSpeed[carID] * self.carsSpeedFrac[carID]) - 
 										(self.EgoCarTopSpeed * self.EgoCarSpeedFrac)) / self.speedScaling
 		self.carsPos[carID, 0] += diff
+		newRow = int(self.carsPos[carID, 0])
+		self.index.move(carID, lane, row, lane, newRow)
 
-		# Move out of bounds, top -> bottom and bottom -> top
-		if int(np.around(self.carsPos[carID, 0])) >= self.grid.shape[0]:
-			lane = np.random.randint(self.grid.shape[1])
-			if self.carsPos[self.carsPos[:,1] == lane, 0].shape[0] == 0:
-				gridHeight = (1 - self.carHeightGrid)
-			else:
-				gridHeight = min((1 - self.carHeightGrid), np.min(self.carsPos[self.carsPos[:,1] == lane, 0]) - 2 * self.carHeightGrid)
+		# Move out of bounds, top -> bottom and bottom -> top. The lane's lowest/highest car comes from the index
+		if newRow >= self.gridRows:
+			newLane = self.rng.randint(self.numLanes)
+			lowest = self.index.lowest(newLane, exclude=self.egoID)
+			gridHeight = (1 - self.carHeightGrid) if lowest is None else min((1 - self.carHeightGrid), lowest - 2 * self.carHeightGrid)
+			self.index.move(carID, lane, newRow, newLane, gridHeight)
 			self.carsPos[carID, 0] = gridHeight
-			self.carsPos[carID, 1] = lane
-		elif int(np.around(self.carsPos[carID, 0])) < (1 - self.carHeightGrid):
-			lane = np.random.randint(self.grid.shape[1])
-			if self.carsPos[self.carsPos[:,1] == lane, 0].shape[0] == 0:
-				gridHeight = self.grid.shape[0] - 1
-			else:
-				gridHeight = max(self.grid.shape[0] - 1, np.max(self.carsPos[self.carsPos[:,1] == lane, 0]) + 2 * self.carHeightGrid)
+			self.carsPos[carID, 1] = newLane
+			newRow, lane = gridHeight, newLane
+		elif newRow < (1 - self.carHeightGrid):
+			newLane = self.rng.randint(self.numLanes)
+			highest = self.index.highest(newLane, exclude=self.egoID)
+			gridHeight = self.gridRows - 1 if highest is None else max(self.gridRows - 1, highest + 2 * self.carHeightGrid)
+			self.index.move(carID, lane, newRow, newLane, gridHeight)
 			self.carsPos[carID, 0] = gridHeight
-			self.carsPos[carID, 1] = lane
+			self.carsPos[carID, 1] = newLane
+			newRow, lane = gridHeight, newLane
 
 		# Update grid
-		self.grid[max(0, int(np.around(self.carsPos[carID, 0]))): min(int(np.around(self.carsPos[carID, 0])) + self.carHeightGrid, self.grid.shape[0]), int(np.around(self.carsPos[carID, 1]))] = self.carsTopSpeed[carID] * self.carsSpeedFrac[carID]
-
+		self.index.fill(lane, max(0, newRow), min(newRow + self.carHeightGrid, self.gridRows), self.carsTopSpeed[carID] * self.carsSpeedFrac[carID])
 		return True
 
 	def egoTurn(self, direction):
 		# direction: [-1: left; +1: right]
+		row, lane = self.EgoCarPos
 		# Check if already at the leftmost/rightmost lane and if it is safe to change lane 
-		if self.EgoCarPos[1] + direction < 0 or \
-					self.EgoCarPos[1] + direction >= self.numLanes or \
-					np.sum(self.grid[(int(np.around(self.EgoCarPos[0])) - self.carHeightGrid):(int(np.around(self.EgoCarPos[0])) + 2 * self.carHeightGrid), int(np.around(self.EgoCarPos[1])) + direction]) != 0:
+		if lane + direction < 0 or \
+					lane + direction >= self.numLanes or \
+					self.index.occupied(lane + direction, row - self.carHeightGrid, row + 2 * self.carHeightGrid):
 			return False
 		else:
-			self.grid[int(np.around(self.EgoCarPos[0])) : (int(np.around(self.EgoCarPos[0])) + self.carHeightGrid), int(np.around(self.EgoCarPos[1])) + direction] = self.EgoCarTopSpeed * self.EgoCarSpeedFrac
-			self.grid[int(np.around(self.EgoCarPos[0])) : (int(np.around(self.EgoCarPos[0])) + self.carHeightGrid), int(np.around(self.EgoCarPos[1]))] = 0.0
+			self.index.fill(lane + direction, row, row + self.carHeightGrid, self.EgoCarTopSpeed * self.EgoCarSpeedFrac)
+			self.index.fill(lane, row, row + self.carHeightGrid, 0.0)
+			self.index.move(self.egoID, lane, row, lane + direction, row)
 			self.EgoCarPos[1] += direction
 			return True
 
 	def carTurn(self, direction, carID):
 		# direction: [-1: left; +1: right]
+		row, lane = int(self.carsPos[carID, 0]), int(self.carsPos[carID, 1])
 		# Check if already at the leftmost/rightmost lane and if it is safe to change lane 
-		if self.carsPos[carID, 1] + direction < 0 or \
-					self.carsPos[carID, 1] + direction >= self.numLanes or \
-					np.sum(self.grid[max(0, int(np.around(self.carsPos[carID, 0])) - self.carHeightGrid):min(int(np.around(self.carsPos[carID, 0])) + 2 * self.carHeightGrid, self.grid.shape[0]), int(np.around(self.carsPos[carID, 1])) + direction]) != 0:
+		if lane + direction < 0 or \
+					lane + direction >= self.numLanes or \
+					self.index.occupied(lane + direction, max(0, row - self.carHeightGrid), min(row + 2 * self.carHeightGrid, self.gridRows)):
 			return False
 		else:
-			self.grid[max(0, int(np.around(self.carsPos[carID, 0]))): min(int(np.around(self.carsPos[carID, 0])) + self.carHeightGrid, self.grid.shape[0]), int(np.around(self.carsPos[carID, 1])) + direction] = self.carsTopSpeed[carID] * self.carsSpeedFrac[carID]
-			self.grid[max(0, int(np.around(self.carsPos[carID, 0]))): min(int(np.around(self.carsPos[carID, 0])) + self.carHeightGrid, self.grid.shape[0]), int(np.around(self.carsPos[carID, 1]))] = 0.0
+			self.index.fill(lane + direction, max(0, row), min(row + self.carHeightGrid, self.gridRows), self.carsTopSpeed[carID] * self.carsSpeedFrac[carID])
+			self.index.fill(lane, max(0, row), min(row + self.carHeightGrid, self.gridRows), 0.0)
+			self.index.move(carID, lane, row, lane + direction, row)
 			self.carsPos[carID, 1] += direction
 			return True
 
@@ -213,18 +473,17 @@ class TrafficSimulator(object):
 	def print_grid(self):
 		print(np.round(np.flip(self.grid, axis=0)))
 		print("=======================================================================================")
-		time.sleep(1)
 
-	# Return state of the simulator
-	def state(self):
-		toReturn = self.EgoCarTopSpeed * self.EgoCarSpeedFrac
-		toReturn = np.append(toReturn, self.EgoCarPos)
-		toReturn = np.append(toReturn, self.actionHistory)
-		toReturn = np.append(toReturn, self.speedHistory)
-		#toReturn = np.append(toReturn, np.ndarray.flatten(self.grid))
-		toReturn = np.append(toReturn, self.carsTopSpeed * self.carsSpeedFrac)
-		toReturn = np.append(toReturn, np.ndarray.flatten(self.carsPos))
-		return toReturn
+	# Flush and stop the attached renderer, if any
+	def close(self):
+		if self.renderer is not None:
+			self.renderer.close()
+
+	# Return state of the simulator, written into out if given (see observation.py for the layout)
+	def state(self, out=None):
+		if out is None:
+			out = np.empty(self.observation.length)
+		return self.observation.write(self, out)
 
 
 
@@ -236,4 +495,4 @@ if __name__ == "__main__":
 	print(sim.EgoCarPos)
 	for i in range(0):
 		action = np.random.randint(0, 5)
-		sim.progress(action)
\ No newline at end of file
+		sim.progress(action)
\ No newline at end of file
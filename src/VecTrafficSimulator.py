@@ -0,0 +1,368 @@
+import copy
+import numpy as np
+from config import Config
+from renderer import makeRenderer
+from TrafficSimulator import TrafficSimulator
+from placement import PLACEMENT_TRIES, RoadJammed, drawFreeSlot, drawConfiguration, ScenarioBank
+
+class VecTrafficSimulator(object):
+	# K independent roads stepped together. State is kept as struct-of-arrays tensors
+	# (carsPos [K, numCars, 2], carsSpeedFrac [K, numCars], grid [K, H, numLanes]) and every
+	# per-car update of TrafficSimulator is applied to all K roads at once, in the same car order.
+	#
+	# A step issues a fixed sequence of NumPy calls per car and substep whatever K is, about 50 ms
+	# for the default road, so it only beats K calls of TrafficSimulator.progress (about 1.5 ms
+	# each) from K = EFFICIENT_ENVS roads on: per road-step, about 50 ms at K = 1, 3.5 ms at K = 16,
+	# 1.1 ms at K = 64 and 0.4 ms at K = 256. makeBatchSimulator returns a TrafficSimulatorBatch
+	# for fewer roads.
+	EFFICIENT_ENVS = 64
+
+	def __init__(self, config, numEnvs, seed=None):
+		self.canvasSize = [config.canvasHeight, config.canvasWidth]
+		self.gridHeight = config.gridHeight
+		self.numLanes = config.numLanes
+		self.carHeightGrid = config.carHeightGrid
+		self.decisionFreq = config.decisionFreq
+		self.numCars = config.numCars
+		self.speedScaling = config.speedScaling
+		self.state_length = config.state_length
+		self.actionSpeedHistory = config.actionSpeedHistory
+		self.minSpeedFrac = config.minSpeedFrac
+		self.egoCarPos = config.egoCarPos
+		self.acc = config.acc
+		if list(config.observationFeatures) != ['vector']:
+			raise ValueError('VecTrafficSimulator only supports the vector observation, got {}'.format(config.observationFeatures))
+
+		self.numEnvs = numEnvs
+		self.gridRows = self.canvasSize[0] // self.gridHeight
+		self.rng = np.random.RandomState(seed)
+
+		self.EgoCarTopSpeed = config.egoTopSpeed
+		self.carsTopSpeed = np.full((numEnvs, config.numCars), config.carTopSpeed)
+		self._envs = np.arange(numEnvs)
+		self.renderer = makeRenderer(config) # renders road 0 only
+		self.scenarios = ScenarioBank(config) if config.scenarioBankSize > 0 else None
+
+		self.grid = np.zeros((numEnvs, self.gridRows, self.numLanes))
+		self.EgoCarSpeedFrac = np.ones(numEnvs)
+		self.EgoCarPos = np.zeros((numEnvs, 2), dtype=int)
+		self.actionHistory = np.zeros((numEnvs, self.actionSpeedHistory), dtype=int)
+		self.speedHistory = np.zeros((numEnvs, self.actionSpeedHistory))
+		self.carsSpeedFrac = np.ones((numEnvs, self.numCars))
+		self.carsPos = np.zeros((numEnvs, self.numCars, 2), dtype=int)
+		self.reset()
+
+	# Reset all roads, or only the ones listed in envIds
+	def reset(self, envIds=None):
+		envs = self._envs if envIds is None else np.asarray(envIds, dtype=int)
+		self.grid[envs] = 0.0
+		self.initEgoCar(envs)
+		if self.scenarios is not None:
+			self.initCarsFrom(envs, self.scenarios[self.rng.randint(len(self.scenarios), size=len(envs))])
+		else:
+			self.initCars(envs)
+
+	def initEgoCar(self, envs):
+		self.EgoCarSpeedFrac[envs] = 1.0
+		self.EgoCarPos[envs, 0] = int(self.egoCarPos)
+		self.EgoCarPos[envs, 1] = self.numLanes // 2
+		row = int(self.egoCarPos)
+		self.grid[envs, row : (row + self.carHeightGrid), self.numLanes // 2] = self.EgoCarTopSpeed
+		self.actionHistory[envs] = 0
+		self.speedHistory[envs] = self.EgoCarTopSpeed
+
+	def initCars(self, envs):
+		self.carsSpeedFrac[envs] = 1.0
+		self.carsPos[envs] = 0
+		for i in range(self.numCars):
+			# Rejection sampling as in TrafficSimulator, but only the roads that failed are redrawn
+			pending = envs
+			gridHeight = np.zeros(len(envs), dtype=int)
+			lane = np.zeros(len(envs), dtype=int)
+			todo = np.arange(len(envs))
+			for tries in range(PLACEMENT_TRIES):
+				gridHeight[todo] = self.rng.randint(self.gridRows - self.carHeightGrid, size=len(todo))
+				lane[todo] = self.rng.randint(self.numLanes, size=len(todo))
+				h = gridHeight[todo]
+				occupied = self._gather(pending, np.maximum(0, h - self.carHeightGrid),
+					np.minimum(h + 2 * self.carHeightGrid, self.gridRows), lane[todo]).sum(axis=1) != 0
+				todo = todo[occupied]
+				pending = envs[todo]
+				if len(todo) == 0:
+					break
+			# dense roads, draw among the free slots directly
+			jammed = []
+			for k in todo:
+				try:
+					gridHeight[k], lane[k] = drawFreeSlot(self.grid[envs[k]] != 0, self.carHeightGrid, self.rng)
+				except RoadJammed:
+					# redraw the whole road, as in TrafficSimulator.reset, and leave it out of the next cars
+					jammed.append(k)
+					self.grid[envs[k]] = 0.0
+					self.initEgoCar(envs[k:k + 1])
+					self.initCarsFrom(envs[k:k + 1], drawConfiguration(self.numCars, self.numLanes, self.gridRows,
+						self.carHeightGrid, self.EgoCarPos[envs[k], 0], self.EgoCarPos[envs[k], 1], self.rng)[None])
+			if jammed:
+				placed = np.delete(np.arange(len(envs)), jammed)
+				envs, gridHeight, lane = envs[placed], gridHeight[placed], lane[placed]
+			self.carsPos[envs, i, 0] = gridHeight
+			self.carsPos[envs, i, 1] = lane
+			self._fill(envs, gridHeight, gridHeight + self.carHeightGrid, lane,
+				self.carsTopSpeed[envs, i] * self.carsSpeedFrac[envs, i])
+
+	# Place the cars of each road at the given [len(envs), numCars, 2] (row, lane) positions, at full speed
+	def initCarsFrom(self, envs, carsPos):
+		self.carsSpeedFrac[envs] = 1.0
+		self.carsPos[envs] = carsPos
+		for i in range(self.numCars):
+			gridHeight = self.carsPos[envs, i, 0]
+			self._fill(envs, gridHeight, gridHeight + self.carHeightGrid, self.carsPos[envs, i, 1],
+				self.carsTopSpeed[envs, i] * self.carsSpeedFrac[envs, i])
+
+	# Take one action per road and simulate {{self.decisionFreq}} steps on all roads, or only on the
+	# distinct roads listed in envIds (actions in the same order). Returns their rewards
+	def step(self, actions, envIds=None):
+		envs = self._envs if envIds is None else np.asarray(envIds, dtype=int)
+		# actions and car actions indexed by road
+		egoAction = np.zeros(self.numEnvs, dtype=int)
+		egoAction[envs] = actions
+		self.actionHistory[envs, :-1] = self.actionHistory[envs, 1:]
+		self.actionHistory[envs, -1] = egoAction[envs]
+
+		carAction = np.zeros((self.numEnvs, self.numCars), dtype=int)
+		carAction[envs] = self.rng.randint(0, 5, (len(envs), self.numCars))
+
+		egoTurned = np.zeros(self.numEnvs, dtype=bool)
+		carTurned = np.zeros((self.numEnvs, self.numCars), dtype=bool)
+
+		for t in range(self.decisionFreq):
+			order = np.flip(np.argsort(self.carsPos[envs, :, 0], axis=1), axis=1)
+			egoToMove = np.ones(len(envs), dtype=bool)
+
+			for i in range(self.numCars):
+				carID = order[:, i]
+
+				# Ego car moves right before the first car below it, as in TrafficSimulator
+				egoNow = (self.carsPos[envs, carID, 0] < self.EgoCarPos[envs, 0]) & egoToMove
+				if egoNow.any():
+					e = envs[egoNow]
+					a = egoAction[e]
+					left = e[(a == 1) & ~egoTurned[e]]
+					egoTurned[left] = self.egoTurn(-1, left)
+					right = e[(a == 2) & ~egoTurned[e]]
+					egoTurned[right] = self.egoTurn(1, right)
+					up = e[a == 3]
+					self.EgoCarSpeedFrac[up] = np.minimum(1.00, self.EgoCarSpeedFrac[up] + self.acc)
+					down = e[a == 4]
+					self.EgoCarSpeedFrac[down] = np.maximum(self.minSpeedFrac, self.EgoCarSpeedFrac[down] - self.acc)
+					egoToMove[egoNow] = False
+
+					self.checkCollisionEgo(e)
+
+				a = carAction[envs, carID]
+				turned = carTurned[envs, carID]
+				left = (a == 1) & ~turned
+				carTurned[envs[left], carID[left]] = self.carTurn(-1, envs[left], carID[left])
+				right = (a == 2) & ~turned
+				carTurned[envs[right], carID[right]] = self.carTurn(1, envs[right], carID[right])
+				up = a == 3
+				self.carsSpeedFrac[envs[up], carID[up]] = np.minimum(1.00, self.carsSpeedFrac[envs[up], carID[up]] + self.acc)
+				down = a == 4
+				self.carsSpeedFrac[envs[down], carID[down]] = np.maximum(self.minSpeedFrac, self.carsSpeedFrac[envs[down], carID[down]] - self.acc)
+				self.checkCollisionCar(envs, carID)
+
+			# Now update the grid and location of all cars
+			self._fill(envs, self.EgoCarPos[envs, 0], self.EgoCarPos[envs, 0] + self.carHeightGrid, self.EgoCarPos[envs, 1],
+				self.EgoCarTopSpeed * self.EgoCarSpeedFrac[envs])
+			for i in range(self.numCars):
+				self.moveCar(envs, order[:, i])
+
+			self.speedHistory[envs, :-1] = self.speedHistory[envs, 1:]
+			self.speedHistory[envs, -1] = self.EgoCarTopSpeed * self.EgoCarSpeedFrac[envs]
+
+			if self.renderer is not None and (envIds is None or 0 in envs):
+				self.renderer.render(self.grid[0])
+
+		return self.reward(envIds)
+
+	def checkCollisionEgo(self, envs):
+		row = self.EgoCarPos[envs, 0]
+		lane = self.EgoCarPos[envs, 1]
+		frontCarSpeed = self._gather(envs, row + self.carHeightGrid, row + 2 * self.carHeightGrid, lane).max(axis=1)
+		followSpeed = self.grid[envs, row + 2 * self.carHeightGrid, lane]
+		self.EgoCarSpeedFrac[envs] = np.where(frontCarSpeed > 0, frontCarSpeed / 2.0 / self.EgoCarTopSpeed,
+			np.where(followSpeed > 0, followSpeed / self.EgoCarTopSpeed, self.EgoCarSpeedFrac[envs]))
+
+	def checkCollisionCar(self, envs, carIDs):
+		row = self.carsPos[envs, carIDs, 0]
+		lane = self.carsPos[envs, carIDs, 1]
+		active = (row + self.carHeightGrid < self.gridRows) & (row + self.carHeightGrid >= 0)
+		frontCarSpeed = self._gather(envs, row + self.carHeightGrid,
+			np.minimum(row + 2 * self.carHeightGrid, self.gridRows), lane).max(axis=1)
+		followRow = row + 2 * self.carHeightGrid
+		followSpeed = np.where(followRow < self.gridRows,
+			self.grid[envs, np.clip(followRow, 0, self.gridRows - 1), lane], 0.0)
+		topSpeed = self.carsTopSpeed[envs, carIDs]
+		speedFrac = np.where(frontCarSpeed > 0, frontCarSpeed / 2.0 / topSpeed,
+			np.where(followSpeed > 0, followSpeed / topSpeed, self.carsSpeedFrac[envs, carIDs]))
+		self.carsSpeedFrac[envs, carIDs] = np.where(active, speedFrac, self.carsSpeedFrac[envs, carIDs])
+
+	def moveCar(self, envs, carIDs):
+		row = self.carsPos[envs, carIDs, 0]
+		lane = self.carsPos[envs, carIDs, 1]
+		self._fill(envs, np.maximum(0, row), np.minimum(row + self.carHeightGrid, self.gridRows), lane, 0.0)
+
+		diff = ((self.carsTopSpeed[envs, carIDs] * self.carsSpeedFrac[envs, carIDs]) -
+			(self.EgoCarTopSpeed * self.EgoCarSpeedFrac[envs])) / self.speedScaling
+		row = (row + diff).astype(int)
+		self.carsPos[envs, carIDs, 0] = row
+
+		# Move out of bounds, top -> bottom and bottom -> top
+		outTop = row >= self.gridRows
+		outBottom = ~outTop & (row < (1 - self.carHeightGrid))
+		wrapped = np.nonzero(outTop | outBottom)[0]
+		if len(wrapped) > 0:
+			e = envs[wrapped]
+			newLane = self.rng.randint(self.numLanes, size=len(wrapped))
+			inLane = self.carsPos[e, :, 1] == newLane[:, None]
+			hasCars = inLane.any(axis=1)
+			lanePos = self.carsPos[e, :, 0]
+			lowest = np.where(inLane, lanePos, np.iinfo(lanePos.dtype).max).min(axis=1)
+			highest = np.where(inLane, lanePos, np.iinfo(lanePos.dtype).min).max(axis=1)
+			toBottom = np.where(hasCars, np.minimum(1 - self.carHeightGrid, lowest - 2 * self.carHeightGrid), 1 - self.carHeightGrid)
+			toTop = np.where(hasCars, np.maximum(self.gridRows - 1, highest + 2 * self.carHeightGrid), self.gridRows - 1)
+			row[wrapped] = np.where(outTop[wrapped], toBottom, toTop)
+			lane[wrapped] = newLane
+			self.carsPos[envs, carIDs, 0] = row
+			self.carsPos[envs, carIDs, 1] = lane
+
+		self._fill(envs, np.maximum(0, row), np.minimum(row + self.carHeightGrid, self.gridRows), lane,
+			self.carsTopSpeed[envs, carIDs] * self.carsSpeedFrac[envs, carIDs])
+
+	def egoTurn(self, direction, envs):
+		# direction: [-1: left; +1: right]. Returns whether each road's ego car changed lane
+		row = self.EgoCarPos[envs, 0]
+		lane = self.EgoCarPos[envs, 1]
+		target = lane + direction
+		inRoad = (target >= 0) & (target < self.numLanes)
+		free = self._gather(envs, row - self.carHeightGrid, row + 2 * self.carHeightGrid,
+			np.clip(target, 0, self.numLanes - 1)).sum(axis=1) == 0
+		ok = inRoad & free
+		e = envs[ok]
+		self._fill(e, row[ok], row[ok] + self.carHeightGrid, target[ok], self.EgoCarTopSpeed * self.EgoCarSpeedFrac[e])
+		self._fill(e, row[ok], row[ok] + self.carHeightGrid, lane[ok], 0.0)
+		self.EgoCarPos[e, 1] += direction
+		return ok
+
+	def carTurn(self, direction, envs, carIDs):
+		row = self.carsPos[envs, carIDs, 0]
+		lane = self.carsPos[envs, carIDs, 1]
+		target = lane + direction
+		inRoad = (target >= 0) & (target < self.numLanes)
+		free = self._gather(envs, np.maximum(0, row - self.carHeightGrid),
+			np.minimum(row + 2 * self.carHeightGrid, self.gridRows), np.clip(target, 0, self.numLanes - 1)).sum(axis=1) == 0
+		ok = inRoad & free
+		e, c, r = envs[ok], carIDs[ok], row[ok]
+		start, stop = np.maximum(0, r), np.minimum(r + self.carHeightGrid, self.gridRows)
+		self._fill(e, start, stop, target[ok], self.carsTopSpeed[e, c] * self.carsSpeedFrac[e, c])
+		self._fill(e, start, stop, lane[ok], 0.0)
+		self.carsPos[e, c, 1] += direction
+		return ok
+
+	def reward(self, envIds=None):
+		envs = self._envs if envIds is None else np.asarray(envIds, dtype=int)
+		return np.mean(self.speedHistory[envs], axis=1)
+
+	def close(self):
+		if self.renderer is not None:
+			self.renderer.close()
+
+	# Return the states of all roads, or of the roads in envIds, [numEnvs, state_length], laid out
+	# as TrafficSimulator.state, written into out if given
+	def state(self, envIds=None, out=None):
+		envs = self._envs if envIds is None else np.asarray(envIds, dtype=int)
+		toReturn = np.empty((len(envs), self.state_length)) if out is None else out
+		h = self.actionSpeedHistory
+		toReturn[:, 0] = self.EgoCarTopSpeed * self.EgoCarSpeedFrac[envs]
+		toReturn[:, 1:3] = self.EgoCarPos[envs]
+		toReturn[:, 3:3 + h] = self.actionHistory[envs]
+		toReturn[:, 3 + h:3 + 2 * h] = self.speedHistory[envs]
+		toReturn[:, 3 + 2 * h:3 + 2 * h + self.numCars] = self.carsTopSpeed[envs] * self.carsSpeedFrac[envs]
+		toReturn[:, 3 + 2 * h + self.numCars:] = self.carsPos[envs].reshape(len(envs), -1)
+		return toReturn
+
+	# Clip [start, stop) the way a Python slice on a grid column would (negative bounds count from the end)
+	def _slice(self, start, stop):
+		start = np.where(start < 0, np.maximum(start + self.gridRows, 0), np.minimum(start, self.gridRows))
+		stop = np.where(stop < 0, np.maximum(stop + self.gridRows, 0), np.minimum(stop, self.gridRows))
+		return start, stop
+
+	# Grid values of grid[env, start:stop, lane] for each road, zero padded to a common width
+	def _gather(self, envs, start, stop, lanes):
+		start, stop = self._slice(start, stop)
+		width = max(int(np.max(stop - start, initial=0)), 1)
+		rows = start[:, None] + np.arange(width)
+		values = self.grid[envs[:, None], np.minimum(rows, self.gridRows - 1), lanes[:, None]]
+		return np.where(rows < stop[:, None], values, 0.0)
+
+	# grid[env, start:stop, lane] = value for each road
+	def _fill(self, envs, start, stop, lanes, values):
+		start, stop = self._slice(start, stop)
+		width = int(np.max(stop - start, initial=0))
+		if width <= 0: return
+		rows = start[:, None] + np.arange(width)
+		valid = rows < stop[:, None]
+		shape = rows.shape
+		self.grid[np.broadcast_to(envs[:, None], shape)[valid], rows[valid],
+			np.broadcast_to(lanes[:, None], shape)[valid]] = np.broadcast_to(np.reshape(values, (-1, 1)), shape)[valid]
+
+class TrafficSimulatorBatch(object):
+	# Interface of VecTrafficSimulator over numEnvs TrafficSimulators stepped one after the other,
+	# about 1.5 ms per road-step whatever numEnvs is. All roads draw from one RandomState, seeded
+	# with seed, and road 0 is the only one rendered
+	def __init__(self, config, numEnvs, seed=None):
+		self.numEnvs = numEnvs
+		self.state_length = config.state_length
+		self.rng = np.random.RandomState(seed)
+		quiet = copy.copy(config)
+		quiet.renderMode = 'none'
+		self.sims = [TrafficSimulator(config if env == 0 else quiet, self.rng) for env in range(numEnvs)]
+		self._envs = np.arange(numEnvs)
+
+	def _select(self, envIds):
+		return self._envs if envIds is None else np.asarray(envIds, dtype=int)
+
+	def reset(self, envIds=None):
+		for env in self._select(envIds):
+			self.sims[env].reset()
+
+	def step(self, actions, envIds=None):
+		envs = self._select(envIds)
+		return np.array([self.sims[env].progress(action) for env, action in zip(envs, actions)])
+
+	def reward(self, envIds=None):
+		return np.array([self.sims[env].reward() for env in self._select(envIds)])
+
+	def close(self):
+		for sim in self.sims:
+			sim.close()
+
+	def state(self, envIds=None, out=None):
+		envs = self._select(envIds)
+		toReturn = np.empty((len(envs), self.state_length)) if out is None else out
+		for i, env in enumerate(envs):
+			self.sims[env].state(out=toReturn[i])
+		return toReturn
+
+# numEnvs roads behind the VecTrafficSimulator interface, on whichever simulator steps them faster
+def makeBatchSimulator(config, numEnvs, seed=None):
+	if numEnvs < VecTrafficSimulator.EFFICIENT_ENVS or list(config.observationFeatures) != ['vector']:
+		return TrafficSimulatorBatch(config, numEnvs, seed)
+	return VecTrafficSimulator(config, numEnvs, seed)
+
+
+if __name__ == "__main__":
+	config = Config()
+	sim = VecTrafficSimulator(config, 8)
+	for i in range(10):
+		print(sim.step(sim.rng.randint(0, 5, sim.numEnvs)))
@@ -0,0 +1,134 @@
+import sys
+import time
+import threading
+
+from parallel_sampler import ParallelSampler
+
+class ActorLearner(object):
+	"""
+	Asynchronous training loop. A background thread keeps collecting episodes on a
+	ParallelSampler pool and storing them in the model's replay buffer, while the learner
+	runs train_step continuously on the calling thread.
+
+	The learner publishes a policy snapshot (model.get_policy()) every actor_refresh_freq
+	updates, so TensorFlow is only ever used from the calling thread. Backpressure keeps the
+	two sides near replay_ratio updates per environment step: the learner waits when it is
+	ahead, the actors wait when they are more than actor_max_ahead env steps ahead.
+	"""
+	def __init__(self, model):
+		self._model = model
+		self._config = model._config
+		self._cond = threading.Condition()
+		self._stop = False
+		self._error = None
+
+		self._policy = None
+		self._policy_version = 0
+		self.updates = 0
+		self.env_steps = 0
+		# policy versions behind the learner of the collected transitions, summed
+		self._staleness = 0.0
+		self._staleness_steps = 0
+		self.learner_wait = 0.0
+		self.actor_wait = 0.0
+
+	def _ahead(self):
+		# env steps collected beyond what the learner needs at the current replay ratio
+		return self.env_steps - self.updates / self._config.replay_ratio
+
+	def _collect(self, sampler):
+		T = self._config.T
+		try:
+			while True:
+				with self._cond:
+					start = time.time()
+					while not self._stop and self._ahead() >= self._config.actor_max_ahead:
+						self._cond.wait()
+					self.actor_wait += time.time() - start
+					if self._stop:
+						return
+					policy, version = self._policy, self._policy_version
+
+				profiler = self._model._profiler
+				with profiler.timer('collect'):
+					states, actions, rewards = sampler.sample(policy, self._config.actor_round)
+				profiler.count('env_steps', actions.size)
+				with profiler.timer('store'):
+					self._model._bf.store_episodes(states, actions, rewards)
+
+				with self._cond:
+					n = len(actions) * T
+					self.env_steps += n
+					self._staleness += (self._policy_version - version) * n
+					self._staleness_steps += n
+					self._cond.notify_all()
+		except Exception as e:
+			with self._cond:
+				self._error = e
+				self._cond.notify_all()
+
+	def _publish_policy(self):
+		policy = self._model.get_policy()
+		with self._cond:
+			self._policy = policy
+			self._policy_version += 1
+
+	def run(self, nsteps, start=0, callback=None):
+		# Train from step start + 1 to nsteps, start > 0 when resuming from a checkpoint. Stops
+		# early when callback(t, model), called every eval_freq steps, returns True, and returns
+		# whether it did
+		model, config = self._model, self._config
+		sampler = ParallelSampler(config, max(1, config.num_workers), config.actor_round, config.seed)
+		self._publish_policy()
+		collector = threading.Thread(target=self._collect, args=(sampler,))
+		collector.daemon = True
+		collector.start()
+
+		start_time = time.time()
+		stopped = False
+		try:
+			t = start
+			while t < nsteps and not stopped:
+				with self._cond:
+					wait_start = time.time()
+					while self._error is None and (model._bf.num_in_buffer <= config.batch_size
+							or self.updates >= config.replay_ratio * self.env_steps):
+						self._cond.wait()
+					self.learner_wait += time.time() - wait_start
+					if self._error is not None:
+						raise self._error
+
+				t += 1
+				model._lr_schedule.update(t)
+				model._eps_schedule.update(t)
+				model._beta_schedule.update(t)
+				model.train_step(t, config.batch_size, model._lr_schedule.get_epsilon())
+
+				with self._cond:
+					self.updates = t - start
+					self._cond.notify_all()
+				if t % config.actor_refresh_freq == 0:
+					with model._profiler.timer('publish_policy'):
+						self._publish_policy()
+				if t % config.profile_freq == 0:
+					model._profiler.flush(t)
+				if t % config.print_freq == 0:
+					self._print_metrics(t, model._total_loss / t, time.time() - start_time)
+				if callback is not None and t % config.eval_freq == 0:
+					stopped = bool(callback(t, model))
+		finally:
+			with self._cond:
+				self._stop = True
+				self._cond.notify_all()
+			collector.join()
+			sampler.close()
+		return stopped
+
+	def _print_metrics(self, t, loss, elapsed):
+		with self._cond:
+			staleness = self._staleness / max(1, self._staleness_steps)
+			sys.stdout.write('Iter {} \t Loss {} \t updates/s {:.1f} \t env steps/s {:.1f} \t replay ratio {:.3f} '
+				'\t staleness {:.2f} \t learner wait {:.1f}s \t actor wait {:.1f}s \n'.format(
+				t, loss, self.updates / elapsed, self.env_steps / elapsed,
+				self.updates / max(1, self.env_steps), staleness, self.learner_wait, self.actor_wait))
+		sys.stdout.flush()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+
+from config import Config
+from model_base import model
+from numpy_q import NumpyQNetwork
+from replay_buffer import ReplayBuffer
+from LongRoadSimulator import LongRoadSimulator
+from TrafficSimulator import TrafficSimulator
+
+# Throughput benchmarks. Every result is a rate (calls, steps or samples per second), so
+# higher is always better and two runs can be compared key by key:
+#
+#   python benchmark.py --out baseline.json
+#   python benchmark.py --compare baseline.json --threshold 0.1
+#
+# --compare exits with status 1 if any rate dropped by more than the threshold.
+
+SIM_SWEEP = {
+	'numCars': [10, 20, 40],
+	'numLanes': [5, 7, 9],
+	'canvasHeight': [500, 700, 1400],
+	'decisionFreq': [1, 5, 10],
+	'adaptiveSubsteps': [False, True],
+}
+LONG_ROAD_ROWS = [10000, 100000, 1000000]
+BUFFER_SIZES = [10000, 100000, 1000000]
+STORE_EPISODES = 50
+DQN_BATCH_SIZES = [1, 4, 16, 64, 256, 1024]
+
+def make_config(**overrides):
+	return Config().update(overrides)
+
+def measure(fn, min_time, units=1):
+	# units / second of fn, over as many calls as fit in min_time after one warmup call
+	fn()
+	calls = 0
+	start = time.perf_counter()
+	while True:
+		fn()
+		calls += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= min_time:
+			return units * calls / elapsed
+
+def bench_simulator(results, min_time):
+	for key, values in SIM_SWEEP.items():
+		for value in values:
+			np.random.seed(0)
+			sim = TrafficSimulator(make_config(**{key: value}))
+			sim.reset()
+			actions = np.random.randint(5, size=1000)
+			step = [0]
+			def progress():
+				sim.progress(actions[step[0] % len(actions)])
+				step[0] += 1
+			name = 'sim/{}={}'.format(key, value)
+			results[name + '/progress_steps_per_s'] = measure(progress, min_time)
+			results[name + '/reset_per_s'] = measure(sim.reset, min_time)
+
+def bench_long_road(results, min_time):
+	# Same car density on every road length, so rates should not depend on it
+	density = Config().longRoadCars / float(Config().longRoadRows)
+	for rows in LONG_ROAD_ROWS:
+		np.random.seed(0)
+		config = make_config(observationFeatures=['grid', 'lidar'], longRoadRows=rows, longRoadCars=int(rows * density))
+		sim = LongRoadSimulator(config)
+		actions = np.random.randint(5, size=1000)
+		step = [0]
+		def progress():
+			sim.progress(actions[step[0] % len(actions)])
+			step[0] += 1
+		name = 'longroad/rows={}'.format(rows)
+		results[name + '/progress_steps_per_s'] = measure(progress, min_time)
+		results[name + '/state_per_s'] = measure(sim.state, min_time)
+
+def bench_state(results, min_time):
+	config = make_config()
+	np.random.seed(0)
+	sim = TrafficSimulator(config)
+	sim.reset()
+	results['state/state_per_s'] = measure(sim.state, min_time)
+	# pad_state does not touch the model, so skip building one
+	bare = object.__new__(model)
+	states = [sim.state() for _ in range(config.state_history)]
+	results['state/pad_state_per_s'] = measure(lambda: bare.pad_state(states, config.state_history), min_time)
+
+def fill_buffer(buffer, config, n):
+	episode = np.random.random((config.T, config.state_length)).astype(np.float32)
+	actions = np.random.randint(config.numActions, size=config.T)
+	rewards = np.random.random(config.T).astype(np.float32)
+	for _ in range(0, n, config.T):
+		buffer.store(episode, actions, rewards)
+	return (episode, actions, rewards)
+
+def bench_buffer(results, min_time, sizes):
+	config = make_config()
+	for size in sizes:
+		np.random.seed(0)
+		buffer = ReplayBuffer(size, config)
+		episode = fill_buffer(buffer, config, size)
+		name = 'buffer/size={}'.format(size)
+		results[name + '/store_steps_per_s'] = measure(lambda: buffer.store(*episode), min_time, config.T)
+		episodes = [np.repeat(x[None], STORE_EPISODES, axis=0) for x in episode]
+		results[name + '/store_episodes_steps_per_s'] = measure(lambda: buffer.store_episodes(*episodes), min_time, STORE_EPISODES * config.T)
+		results[name + '/sample_per_s'] = measure(lambda: buffer.sample(config.batch_size), min_time)
+
+def bench_numpy_q(results, min_time, batch_sizes):
+	# Random weights of the DQN layer sizes, the forward pass does not depend on their values
+	config = make_config()
+	sizes = [config.state_length * config.state_history] + config.hidden_size + [config.numActions]
+	rng = np.random.RandomState(0)
+	network = NumpyQNetwork([rng.randn(a, b) for a, b in zip(sizes, sizes[1:])], [rng.randn(b) for b in sizes[1:]])
+	for batch_size in batch_sizes:
+		states = rng.random_sample((batch_size, config.state_length, config.state_history)).astype(np.float32)
+		results['numpy_q/batch={}/get_q_values_per_s'.format(batch_size)] = measure(lambda: network.get_q_values(states), min_time)
+	path = os.path.join(tempfile.mkdtemp(), 'policy.npz')
+	network.save(path)
+	results['numpy_q/load_per_s'] = measure(lambda: NumpyQNetwork.load(path), min_time)
+	os.remove(path)
+	os.rmdir(os.path.dirname(path))
+
+def bench_dqn(results, min_time, batch_sizes):
+	# TensorFlow is only needed here
+	from dqn_model import DQN
+	config = make_config(prefetch_batches=0)
+	np.random.seed(0)
+	dqn = DQN(config)
+	dqn.initialize()
+	fill_buffer(dqn._bf, config, config.buffer_size)
+	for batch_size in batch_sizes:
+		states = np.random.random((batch_size, config.state_length, config.state_history)).astype(np.float32)
+		name = 'dqn/batch={}'.format(batch_size)
+		# t = 1 never triggers target updates, saving or sampling
+		results[name + '/train_step_per_s'] = measure(lambda: dqn.train_step(1, batch_size, config.lr_begin), min_time)
+		results[name + '/get_q_values_per_s'] = measure(lambda: dqn.get_q_values(states), min_time)
+
+def run(suites, min_time, quick):
+	results = {}
+	skipped = {}
+	if 'sim' in suites:
+		bench_simulator(results, min_time)
+	if 'longroad' in suites:
+		bench_long_road(results, min_time)
+	if 'state' in suites:
+		bench_state(results, min_time)
+	if 'buffer' in suites:
+		bench_buffer(results, min_time, BUFFER_SIZES[:2] if quick else BUFFER_SIZES)
+	if 'numpy_q' in suites:
+		bench_numpy_q(results, min_time, DQN_BATCH_SIZES[:3] if quick else DQN_BATCH_SIZES)
+	if 'dqn' in suites:
+		try:
+			bench_dqn(results, min_time, DQN_BATCH_SIZES[:3] if quick else DQN_BATCH_SIZES)
+		except ImportError as e:
+			skipped['dqn'] = str(e)
+	meta = {
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'machine': platform.machine(),
+		'min_time': min_time,
+		'skipped': skipped,
+	}
+	return {'meta': meta, 'results': results}
+
+def compare(results, baseline, threshold):
+	# Returns the keys whose rate dropped by more than threshold, printing every common key
+	regressions = []
+	for key in sorted(results):
+		if key not in baseline:
+			continue
+		ratio = results[key] / baseline[key]
+		flag = ''
+		if ratio < 1.0 - threshold:
+			regressions.append(key)
+			flag = '  REGRESSION'
+		print('{:60s} {:12.1f} {:12.1f} {:7.2f}x{}'.format(key, baseline[key], results[key], ratio, flag))
+	return regressions
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Throughput benchmarks of the simulator, replay buffer and DQN')
+	parser.add_argument('--suites', default='sim,longroad,state,buffer,numpy_q,dqn', help='comma-separated subset of sim,longroad,state,buffer,numpy_q,dqn')
+	parser.add_argument('--min-time', type=float, default=1.0, help='seconds measured per benchmark')
+	parser.add_argument('--quick', action='store_true', help='smaller buffer sizes and batch sizes')
+	parser.add_argument('--out', help='write the results to this JSON file')
+	parser.add_argument('--compare', help='baseline JSON file written by --out')
+	parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+	args = parser.parse_args(argv)
+
+	report = run(args.suites.split(','), args.min_time, args.quick)
+	for name, reason in report['meta']['skipped'].items():
+		print('Skipped {}: {}'.format(name, reason))
+	if args.out:
+		with open(args.out, 'w') as f:
+			json.dump(report, f, indent=2, sort_keys=True)
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)['results']
+		regressions = compare(report['results'], baseline, args.threshold)
+		if regressions:
+			print('{} regression(s) beyond {:.0%}'.format(len(regressions), args.threshold))
+			sys.exit(1)
+	elif not args.out:
+		for key in sorted(report['results']):
+			print('{:60s} {:12.1f}'.format(key, report['results'][key]))
+
+if __name__ == '__main__':
+	main()
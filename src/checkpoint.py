@@ -0,0 +1,118 @@
+import os
+import pickle
+import queue
+import re
+import struct
+import threading
+
+class CheckpointManager(object):
+	"""
+	Writes training checkpoints on a background thread. save() takes a snapshot that shares
+	no memory with the training state (see model.get_training_state) and only queues it, so
+	training pays for the copy but not for serialization or I/O. Each snapshot is written to
+	a temporary file and renamed to ckpt-<step>.pkl once complete, so a crash never leaves a
+	partial file under a checkpoint name. Then all but the keep most recent checkpoints are
+	deleted.
+
+	A snapshot is a dict, written as one pickle per key followed by an index of their offsets,
+	so load(keys=...) only unpickles the keys it needs (e.g. the weights, not the buffer).
+
+	At most one snapshot waits behind the one being written: save() blocks while it is there.
+	An exception raised by the writer is re-raised by the next save(), wait() or close().
+	"""
+	PATTERN = re.compile(r'^ckpt-(\d+)\.pkl$')
+	FOOTER = struct.Struct('<Q') # offset of the index
+
+	def __init__(self, directory, keep=3):
+		self.directory = directory
+		self.keep = keep
+		self._queue = queue.Queue(maxsize=1)
+		self._error = None
+		self._thread = None
+
+	def path(self, step):
+		return os.path.join(self.directory, 'ckpt-{:09d}.pkl'.format(step))
+
+	def steps(self):
+		# Steps of the checkpoints on disk, oldest first
+		if not os.path.isdir(self.directory):
+			return []
+		matches = [self.PATTERN.match(name) for name in os.listdir(self.directory)]
+		return sorted(int(match.group(1)) for match in matches if match)
+
+	def latest(self):
+		steps = self.steps()
+		return steps[-1] if steps else None
+
+	def load(self, step=None, keys=None):
+		# State saved at step, the latest checkpoint by default, None if there is none. With
+		# keys, only those entries are read
+		step = self.latest() if step is None else step
+		if step is None:
+			return None
+		with open(self.path(step), 'rb') as f:
+			f.seek(-self.FOOTER.size, os.SEEK_END)
+			f.seek(self.FOOTER.unpack(f.read(self.FOOTER.size))[0])
+			offsets = pickle.load(f)
+			state = {}
+			for key in (offsets if keys is None else keys):
+				f.seek(offsets[key])
+				state[key] = pickle.load(f)
+			return state
+
+	def save(self, step, state):
+		self._raise()
+		if self._thread is None:
+			self._thread = threading.Thread(target=self._run)
+			self._thread.daemon = True
+			self._thread.start()
+		self._queue.put((step, state))
+
+	def wait(self):
+		# Block until every queued checkpoint is written
+		self._queue.join()
+		self._raise()
+
+	def close(self):
+		if self._thread is not None:
+			self._queue.put(None)
+			self._thread.join()
+			self._thread = None
+		self._raise()
+
+	def _raise(self):
+		if self._error is not None:
+			error, self._error = self._error, None
+			raise error
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			try:
+				if item is None:
+					return
+				self._write(*item)
+			except Exception as e:
+				self._error = e
+			finally:
+				self._queue.task_done()
+
+	def _write(self, step, state):
+		if not os.path.exists(self.directory):
+			os.makedirs(self.directory)
+		path = self.path(step)
+		tmp = '{}.{}.tmp'.format(path, os.getpid())
+		with open(tmp, 'wb') as f:
+			offsets = {}
+			for key, value in state.items():
+				offsets[key] = f.tell()
+				pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+			index = f.tell()
+			pickle.dump(offsets, f, protocol=pickle.HIGHEST_PROTOCOL)
+			f.write(self.FOOTER.pack(index))
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, path)
+		if self.keep > 0:
+			for old in self.steps()[:-self.keep]:
+				os.remove(self.path(old))
@@ -0,0 +1,217 @@
+import time
+_START = time.perf_counter()
+import argparse
+import json
+import sys
+
+from config import Config
+
+# Single entry point, e.g.
+#
+#   python cli.py simulate --episodes 10 --set numCars=40
+#   python cli.py train --config run.json --set lr_begin=1e-4 --set 'hidden_size=[256, 128, 64]'
+#   python cli.py eval --policy numpy
+#   python cli.py export
+#   python cli.py bench --suites sim,state --quick
+#   python cli.py serve --set server_envs=256
+#
+# Modules are imported by the subcommands that need them, TensorFlow only by train, export and
+# eval --policy dqn, so simulator-only work starts without it. Every subcommand prints how long
+# its startup took, from the import of this module to the first simulator or training step,
+# split into phases; --startup-only exits right after that line.
+
+class StartupTimer(object):
+	# Durations of the consecutive startup phases, the first one starting at the import of cli.py
+	def __init__(self):
+		self.phases = []
+		self._last = _START
+
+	def mark(self, name):
+		now = time.perf_counter()
+		self.phases.append((name, now - self._last))
+		self._last = now
+
+	def report(self):
+		total = sum(seconds for _, seconds in self.phases)
+		print('Startup {:.3f} s ({})'.format(total, ', '.join('{} {:.3f} s'.format(name, seconds) for name, seconds in self.phases)))
+		sys.stdout.flush()
+
+def parse_value(text):
+	# JSON values (numbers, booleans, null, lists), anything else is a string
+	try:
+		return json.loads(text)
+	except ValueError:
+		return text
+
+def make_config(args):
+	# Config with the fields of --config files, then of --set flags, in order
+	overrides = {}
+	for path in args.config:
+		with open(path) as f:
+			overrides.update(json.load(f))
+	for item in args.set:
+		name, sep, value = item.partition('=')
+		if not sep:
+			raise ValueError('--set expects name=value, got {}'.format(item))
+		overrides[name.strip()] = parse_value(value)
+	return Config().update(overrides)
+
+def make_policy(name, config, timer):
+	if name == 'random':
+		from policies import RandomPolicy
+		return RandomPolicy(config.numActions)
+	if name == 'samelane':
+		from policies import ConstantPolicy
+		# always accelerate, never change lanes
+		return ConstantPolicy(3)
+	if name == 'numpy':
+		from numpy_q import NumpyQNetwork
+		from policies import GreedyPolicy
+		return GreedyPolicy(NumpyQNetwork.load(config.policy_path))
+	if name == 'dqn':
+		DQN = load_dqn(timer)
+		config.mode = 'test'
+		config.dropout = 1.0
+		model = DQN(config)
+		model.initialize()
+		timer.mark('model')
+		return model.get_policy(0.0)
+	raise ValueError('Unknown policy {}'.format(name))
+
+def load_dqn(timer):
+	# dqn_model imports TensorFlow, nearly all of this phase
+	from dqn_model import DQN
+	timer.mark('tensorflow')
+	return DQN
+
+def simulate(args, config, timer):
+	import numpy as np
+	if args.long_road:
+		from LongRoadSimulator import LongRoadSimulator as Simulator
+	else:
+		from TrafficSimulator import TrafficSimulator as Simulator
+	timer.mark('imports')
+	policy = make_policy(args.policy, config, timer)
+	sim = Simulator(config)
+	if args.seed is not None:
+		np.random.seed(args.seed)
+	timer.mark('simulator')
+	timer.report()
+	if args.startup_only:
+		return
+	T = config.T if args.steps is None else args.steps
+	# same zero-padded history as model.pad_state
+	stack = np.zeros((1, config.state_length, config.state_history), dtype=np.float32)
+	start = time.perf_counter()
+	rewards = []
+	for episode in range(args.episodes):
+		sim.reset()
+		stack[:] = 0
+		total = 0.0
+		for t in range(T):
+			stack[0, :, :-1] = stack[0, :, 1:]
+			sim.state(out=stack[0, :, -1])
+			total += sim.progress(policy.get_actions(stack)[0])
+		rewards.append(total / T)
+	seconds = time.perf_counter() - start
+	sim.close()
+	print('Mean reward over {} episodes: {:.4f}'.format(len(rewards), float(np.mean(rewards))))
+	print('{} steps in {:.3f} s, {:.1f} steps/s'.format(args.episodes * T, seconds, args.episodes * T / seconds))
+
+def train(args, config, timer):
+	DQN = load_dqn(timer)
+	model = DQN(config)
+	model.initialize()
+	timer.mark('model')
+	timer.report()
+	if not args.startup_only:
+		model.train()
+
+def eval_policy(args, config, timer):
+	from evaluation import evaluate
+	timer.mark('imports')
+	policy = make_policy(args.policy, config, timer)
+	timer.report()
+	if not args.startup_only:
+		evaluate(config, policy, args.seed)
+
+def export(args, config, timer):
+	DQN = load_dqn(timer)
+	config.mode = 'test'
+	config.dropout = 1.0
+	model = DQN(config)
+	model.initialize()
+	timer.mark('model')
+	timer.report()
+	if not args.startup_only:
+		print('Exported the q network to {}'.format(model.export(args.out)))
+
+def bench(args, config, timer):
+	import benchmark
+	timer.mark('imports')
+	timer.report()
+	if not args.startup_only:
+		benchmark.main(args.bench_args)
+
+def serve(args, config, timer):
+	from envserver import run_server
+	timer.mark('imports')
+	def on_ready(server):
+		timer.mark('simulator')
+		timer.report()
+		if args.startup_only:
+			sys.exit(0)
+	run_server(config, on_ready)
+
+def make_parser():
+	common = argparse.ArgumentParser(add_help=False)
+	common.add_argument('--config', action='append', default=[], help='JSON file of Config fields, may be repeated')
+	common.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='Config field, the value parsed as JSON if possible, may be repeated')
+	common.add_argument('--startup-only', action='store_true', help='exit after printing the startup time')
+
+	parser = argparse.ArgumentParser(description='Simulate, train, evaluate, export, benchmark or serve roads')
+	commands = parser.add_subparsers(dest='command')
+	commands.required = True
+	policies = ['random', 'samelane', 'numpy', 'dqn']
+
+	sub = commands.add_parser('simulate', parents=[common], help='run episodes and report steps/s')
+	sub.add_argument('--policy', choices=policies, default='random')
+	sub.add_argument('--episodes', type=int, default=10)
+	sub.add_argument('--steps', type=int, help='steps per episode, config.T by default')
+	sub.add_argument('--seed', type=int)
+	sub.add_argument('--long-road', action='store_true', help='use LongRoadSimulator')
+	sub.set_defaults(run=simulate)
+
+	sub = commands.add_parser('train', parents=[common], help='train a DQN (needs TensorFlow)')
+	sub.set_defaults(run=train)
+
+	sub = commands.add_parser('eval', parents=[common], help='evaluate a policy with the eval_* settings')
+	sub.add_argument('--policy', choices=policies, default='numpy', help='numpy evaluates config.policy_path without TensorFlow')
+	sub.add_argument('--seed', type=int, default=0)
+	sub.set_defaults(run=eval_policy)
+
+	sub = commands.add_parser('export', parents=[common], help='write the q network of the latest checkpoint to a .npz (needs TensorFlow)')
+	sub.add_argument('--out', help='config.policy_path by default')
+	sub.set_defaults(run=export)
+
+	# the remaining arguments go to benchmark.py, which builds its own configs
+	sub = commands.add_parser('bench', parents=[common], help='throughput benchmarks, other arguments as for benchmark.py')
+	sub.set_defaults(run=bench)
+
+	sub = commands.add_parser('serve', parents=[common], help='serve server_envs roads on server_address, see envserver.py')
+	sub.set_defaults(run=serve)
+	return parser
+
+def main(argv=None):
+	timer = StartupTimer()
+	timer.mark('cli imports')
+	parser = make_parser()
+	args, args.bench_args = parser.parse_known_args(argv)
+	if args.bench_args and args.command != 'bench':
+		parser.error('unrecognized arguments: {}'.format(' '.join(args.bench_args)))
+	config = make_config(args)
+	timer.mark('config')
+	args.run(args, config, timer)
+
+if __name__ == '__main__':
+	main()
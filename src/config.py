@@ -1,3 +1,5 @@
+from observation import observationLength
+
 class Config:
 	def __init__(self):
 		self.mode = 'train'
@@ -6,8 +8,18 @@ class Config:
 		self.print_freq = 50
 		self.target_update_freq = 1000
 		self.saving_freq = 2500
+		self.checkpoint_dir = '../outputs/checkpoints' # full training state every saving_freq steps, see checkpoint.py
+		self.checkpoint_keep = 3 # most recent checkpoints kept, 0 keeps all
+		self.checkpoint_buffer = True # include the replay buffer (only its cursor with buffer_dir, the arrays stay on disk), needed to resume exactly
+		self.resume = False # continue training from the latest checkpoint of checkpoint_dir, exactly (except for TF's dropout masks) unless prefetch_batches > 0, async_training or buffer_dir is set
 		self.simulation_freq = 1000
 		self.model_output = '../outputs'
+		self.policy_path = '../outputs/policy.npz' # q network exported by DQN.export, for TF-free evaluation (see numpy_q.py)
+		self.print_q_values = False # test mode: print the Q values of every get_best_action call
+		self.profile = False # time training phases and count env steps / updates, see profiler.py
+		self.profile_freq = 1000 # train steps between two profile records
+		self.profile_path = '../outputs/profile.jsonl' # .jsonl, or CSV of (step, key, value) rows
+		self.profile_summaries = True # also write profile records as TF summaries under model_output
 
 		self.eps_begin = 1.0
 		self.eps_end = 0.1
@@ -16,16 +28,43 @@ class Config:
 
 		self.lr_begin = 0.00005
 		self.lr_end = 0.00001
-		self.lr_nsteps = self.nsteps_train / 2
+		self.lr_nsteps = None # nsteps_train / 2 unless set, see _derive
 
 		self.gamma = 0.99
+		self.n_step = 1 # bootstrap targets from the state n steps later, with the discounted sum of the n rewards in between
 		self.grad_clip = True
 		self.clip_val = 10
 		self.batch_size = 32
+		self.buffer_size = 10000
+		self.buffer_dir = None # directory of a memory-mapped, persistent replay buffer; in memory if None. A resume with it only restores its cursor, not the transitions overwritten since the checkpoint, so it is not exact
+		self.buffer_dtype = 'float32' # storage dtype of replay buffer frames, e.g. 'float16' to halve memory
+		self.prioritized_replay = False
+		self.prioritized_alpha = 0.6
+		self.prioritized_beta_begin = 0.4 # annealed linearly to 1 over nsteps_train
+		self.prioritized_eps = 1e-6
+		self.prefetch_batches = 0 # > 0 gathers that many minibatches ahead on a background thread, which draws from np.random concurrently with the simulation, so runs are no longer reproducible
 
 		self.T = 100
 		self.N = 100
 		self.nBufferSample = 100
+		self.trace_dir = None # record the episodes simulated one at a time into this trace directory, see traces.py
+		self.trace_chunk_episodes = 100
+		self.offline_trace_dir = None # fill the replay buffer from this trace directory instead of simulating
+		self.eval_ci_width = None # stop evaluating once the CI half-width of the mean reward is below this
+		self.eval_confidence = 0.95
+		self.eval_min_episodes = 30
+		self.eval_freq = 5000 # train steps between two calls of the DQN.train callback (intermediate evaluations of sweep.py)
+		self.num_workers = 1 # > 1 collects buffer episodes on a process pool
+		self.seed = None # base seed of the worker pool, drawn from np.random if None
+		self.rollout_batch = 1 # > 1 runs that many episodes in lockstep with batched action selection, on VecTrafficSimulator from 64 on, see makeBatchSimulator
+		self.async_training = False # collect episodes in the background while training, see actor_learner.py
+		self.replay_ratio = 0.1 # async: gradient steps per environment step
+		self.actor_round = 10 # async: episodes collected per actor round
+		self.actor_refresh_freq = 100 # async: gradient steps between two policy snapshots for the actors
+		self.actor_max_ahead = 20000 # async: env steps the actors may run ahead of the replay ratio
+		self.server_address = '../outputs/envserver.sock' # env server: Unix socket path, or host:port for TCP (see envserver.py)
+		self.server_envs = 64 # env server: roads hosted, shared by all clients
+		self.server_batch_wait = 0.001 # env server: seconds a step may wait for the steps of other clients to batch with
 
 		self.hidden_size = [128, 64, 32]
 		self.numActions = 5
@@ -37,6 +76,7 @@ class Config:
 		self.gridHeight = 10
 		self.carHeightGrid = 4
 		self.decisionFreq = 5
+		self.adaptiveSubsteps = False # advance cars far from all others with scalar updates, same results (see TrafficSimulator.isolateCars)
 		self.speedScaling = 15
 		self.actionSpeedHistory = 5
 		self.egoTopSpeed = 80.0
@@ -44,7 +84,36 @@ class Config:
 		self.acc = 0.01
 		self.minSpeedFrac = 0.5
 		self.egoCarPos = 18
-		self.state_length = 1 + 2 + 2 * self.actionSpeedHistory + 3 * self.numCars
-								# + self.numLanes * self.canvasHeight // self.gridHeight
-								
-		self.state_history = 1
\ No newline at end of file
+		self.scenarioBankSize = 0 # > 0 resets from a bank of that many precomputed car placements, see placement.py
+		self.scenarioBankDir = '../outputs/scenarios'
+		self.scenarioBankSeed = 0
+		self.longRoadRows = 100000 # LongRoadSimulator: length of the ring road in grid rows
+		self.longRoadCars = 20000 # LongRoadSimulator: cars on the whole road, used instead of numCars
+		self.longRoadMargin = 20 # LongRoadSimulator: rows beyond the canvas where cars are still simulated one by one
+		self.longRoadCruiseFrac = 0.75 # LongRoadSimulator: speed fraction of the cars further away
+		self.renderMode = 'none' # 'none', 'ascii' or 'record'
+		self.renderInterval = 1.0 # min seconds between two ascii frames
+		self.renderPath = '../outputs/frames.npz' # .npz of frame chunks (see renderer.loadFrames), or a video file (.mp4/.gif) if imageio is installed
+		self.observationFeatures = ['vector'] # any of 'vector', 'grid', 'lidar', see observation.py
+		self.observationGridRows = 14 # rows of the pooled 'grid' feature
+		self.state_length = None # length of the observation, see _derive
+
+		self.state_history = 1
+		self._derive()
+
+	def _derive(self, fixed=()):
+		# Fields computed from the others, except those in fixed
+		if 'lr_nsteps' not in fixed:
+			self.lr_nsteps = self.nsteps_train / 2
+		if 'state_length' not in fixed:
+			self.state_length = observationLength(self)
+
+	def update(self, overrides):
+		# Set existing fields from a {name: value} dict, then the fields derived from them,
+		# unless overridden too
+		for name, value in overrides.items():
+			if not hasattr(self, name):
+				raise ValueError('Unknown Config field {}'.format(name))
+			setattr(self, name, value)
+		self._derive(overrides)
+		return self
\ No newline at end of file
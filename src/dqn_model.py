@@ -6,6 +6,10 @@ import os
 
 from config import Config
 from model_base import model
+from numpy_q import NumpyQNetwork
+from policies import EpsilonGreedyPolicy
+from actor_learner import ActorLearner
+from prefetcher import BatchPrefetcher
 
 class DQN(model):
 	"""
@@ -17,34 +21,41 @@ class DQN(model):
 
 		# self.state: batch of states, type = float32
 		# self.a: batch of actions, type = int32
-		# self.r: batch of rewards, type = float32
+		# self.r: batch of (n-step) returns, type = float32
+		# self.discount: batch of discounts of the bootstrapped values, type = float32
 		# self.state_p: batch of next states, type = float32
 		# self.lr: learning rate, type = float32
+		# self.w: batch of importance-sampling weights, type = float32
+		# self.is_training: batch norm on batch statistics and dropout on, type = bool. Only
+		# train_step feeds True, otherwise the networks run in inference mode as NumpyQNetwork
 
 		self.state = tf.placeholder(dtype=tf.float32, shape=[None, state_length, state_history])
 		self.a = tf.placeholder(dtype=tf.int32, shape=[None])
 		self.r = tf.placeholder(dtype=tf.float32, shape=[None])
+		self.discount = tf.placeholder(dtype=tf.float32, shape=[None])
 		self.state_p = tf.placeholder(dtype=tf.float32, shape=[None, state_length, state_history])
 		self.lr = tf.placeholder(dtype=tf.float32, shape=[])
+		self.w = tf.placeholder(dtype=tf.float32, shape=[None])
+		self.is_training = tf.placeholder_with_default(False, shape=[])
 
 	def get_q_values_op(self, state, scope, reuse=False):
 		num_actions = self._config.numActions
 		with tf.variable_scope(scope, reuse=reuse):
 			state_flattened = layers.flatten(state)
 			l1 = layers.fully_connected(state_flattened, self._config.hidden_size[0], activation_fn=None)
-			l1 = layers.batch_norm(l1)
+			l1 = layers.batch_norm(l1, is_training=self.is_training)
 			l1 = tf.nn.relu(l1)
-			l1 = tf.nn.dropout(l1, self._config.dropout)
+			l1 = layers.dropout(l1, self._config.dropout, is_training=self.is_training)
 			
 			l2 = layers.fully_connected(l1, self._config.hidden_size[1], activation_fn=None)
-			l2 = layers.batch_norm(l2)
+			l2 = layers.batch_norm(l2, is_training=self.is_training)
 			l2 = tf.nn.relu(l2)
-			l2 = tf.nn.dropout(l2, self._config.dropout)
+			l2 = layers.dropout(l2, self._config.dropout, is_training=self.is_training)
 
 			l3 = layers.fully_connected(l2, self._config.hidden_size[2], activation_fn=None)
-			l3 = layers.batch_norm(l3)
+			l3 = layers.batch_norm(l3, is_training=self.is_training)
 			l3 = tf.nn.relu(l3)
-			l3 = tf.nn.dropout(l3, self._config.dropout)
+			l3 = layers.dropout(l3, self._config.dropout, is_training=self.is_training)
 
 			out = layers.fully_connected(l3, num_actions, activation_fn=None)
 		return out
@@ -56,9 +67,10 @@ class DQN(model):
 
 	def add_loss_op(self, q, target_q):
 		num_actions = self._config.numActions
-		Q_samp = self.r + self._config.gamma * tf.reduce_max(target_q, axis=1)
+		Q_samp = self.r + self.discount * tf.reduce_max(target_q, axis=1)
 		Q_s_a = tf.reduce_sum(tf.one_hot(self.a, num_actions) * q, axis=1)
-		self.loss = tf.reduce_mean(tf.square(Q_samp - Q_s_a))
+		self.td_error = Q_samp - Q_s_a
+		self.loss = tf.reduce_mean(self.w * tf.square(self.td_error))
 
 	def add_optimizer_op(self, scope):
 		optimizer = tf.train.AdamOptimizer(learning_rate=self.lr)
@@ -66,7 +78,9 @@ class DQN(model):
 		grads = optimizer.compute_gradients(self.loss, var_list=var_list)
 		if self._config.grad_clip:
 			grads = [(tf.clip_by_norm(grad, self._config.clip_val), var) for grad, var in grads]
-		self.train_op = optimizer.apply_gradients(grads)
+		# keep the batch norm moving statistics up to date, the NumPy policies run on them
+		with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS, scope=scope)):
+			self.train_op = optimizer.apply_gradients(grads)
 		self.grad_norm = tf.global_norm([grad for grad, _ in grads])
 
 	def build(self):
@@ -85,53 +99,131 @@ class DQN(model):
 			self.sess.run(tf.global_variables_initializer())
 			print('running training mode')
 		elif self._config.mode == 'test':
-			self.saver.restore(self.sess, tf.train.latest_checkpoint(self._config.model_output))
+			# the weights only, not the replay buffer
+			state = self._checkpoints.load(keys=['variables'])
+			if state is not None:
+				self.set_variables(state['variables'])
+			else:
+				# weights saved by runs from before checkpoint.py
+				self.saver.restore(self.sess, tf.train.latest_checkpoint(self._config.model_output))
 			print('running test mode')
 		self.sess.run(self.update_target_op)
+		if self._config.profile and self._config.profile_summaries:
+			self._profiler.summary_writer = tf.summary.FileWriter(self._config.model_output)
 
-	def train(self):
-		print("Start to sample buffer")
-		self.sampling_buffer()
-		print("Finished sample buffer")
-		t = 0
-		total_loss = 0
-		while t < self._config.nsteps_train:
+	def train(self, callback=None):
+		# callback(t, model) is called every eval_freq steps and stops training by returning True.
+		# Returns whether it did
+		t = self.restore_checkpoint() if self._config.resume else 0
+		if self._config.async_training:
+			stopped = ActorLearner(self).run(self._config.nsteps_train, t, callback)
+			self.close_prefetcher()
+			self._checkpoints.close()
+			return stopped
+		# A disk-backed buffer reopened from a previous run, or restored from a checkpoint, is already filled
+		if self._bf.num_in_buffer == 0:
+			print("Start to sample buffer")
+			self.sampling_buffer()
+			print("Finished sample buffer")
+		else:
+			print("Reusing {} transitions from the replay buffer".format(self._bf.num_in_buffer))
+		stopped = False
+		while t < self._config.nsteps_train and not stopped:
 			t += 1
 			self._lr_schedule.update(t)
 			self._eps_schedule.update(t)
-			loss_t = self.train_step(t, self._config.batch_size, self._lr_schedule.get_epsilon())
-			total_loss += loss_t
+			self._beta_schedule.update(t)
+			self.train_step(t, self._config.batch_size, self._lr_schedule.get_epsilon())
 			if t % self._config.print_freq == 0:
-				sys.stdout.write('Iter {} \t Loss {} \n'.format(t, total_loss / t))
+				sys.stdout.write('Iter {} \t Loss {} \n'.format(t, self._total_loss / t))
 				sys.stdout.flush()
+			if t % self._config.profile_freq == 0:
+				self._profiler.flush(t)
+			if callback is not None and t % self._config.eval_freq == 0:
+				stopped = bool(callback(t, self))
+		self.close_prefetcher()
+		self._checkpoints.close()
+		self.close_trace()
+		return stopped
+
+	def sample_batch(self, batch_size):
+		# Minibatch as contiguous arrays ready to feed, idxes is None without prioritized replay
+		if self._config.prioritized_replay:
+			states, states_p, actions, rewards, discounts, weights, idxes = self._bf.sample(batch_size, self._beta_schedule.get_epsilon())
+		else:
+			states, states_p, actions, rewards, discounts = self._bf.sample(batch_size)
+			weights = np.ones(len(actions), dtype=np.float32)
+			idxes = None
+		return (np.ascontiguousarray(states), np.ascontiguousarray(states_p), actions, rewards, discounts, weights, idxes)
+
+	def next_batch(self, batch_size):
+		if self._config.prefetch_batches <= 0:
+			return self.sample_batch(batch_size)
+		# Prefetched batches are sampled a few steps early, so with prioritized replay they
+		# may miss the latest priority updates
+		if self._prefetcher is None:
+			self._prefetcher = BatchPrefetcher(lambda: self.sample_batch(batch_size), self._config.prefetch_batches)
+		return self._prefetcher.get()
+
+	def close_prefetcher(self):
+		if self._prefetcher is not None:
+			self._prefetcher.close()
+			self._prefetcher = None
 
 	def train_step(self, t, batch_size, lr):
-		states, states_p, actions, rewards = self._bf.sample(batch_size)
+		profiler = self._profiler
+		with profiler.timer('sample'):
+			states, states_p, actions, rewards, discounts, weights, idxes = self.next_batch(batch_size)
 		feed_dict = {self.state: states, self.state_p: states_p, 
-			self.a: actions, self.r: rewards, self.lr:lr}
-		loss_eval, _ = self.sess.run([self.loss, self.train_op], feed_dict=feed_dict)
+			self.a: actions, self.r: rewards, self.discount: discounts, self.lr:lr, self.w: weights, self.is_training: True}
+		with profiler.timer('sgd'):
+			loss_eval, td_error, _ = self.sess.run([self.loss, self.td_error, self.train_op], feed_dict=feed_dict)
+		profiler.count('updates')
+		self._total_loss += loss_eval
+		if self._config.prioritized_replay:
+			with profiler.timer('update_priorities'):
+				self._bf.update_priorities(idxes, td_error)
 
 		if t % self._config.target_update_freq == 0:
-			self.sess.run(self.update_target_op)
-		if t % self._config.saving_freq == 0:
-			print(self._config.model_output)
-			if not os.path.exists(self._config.model_output):
-				os.makedirs(self._config.model_output)
-			self.saver.save(self.sess, save_path=os.path.join(self._config.model_output, 'model'))
-		if t % self._config.simulation_freq == 0:
+			with profiler.timer('target_update'):
+				self.sess.run(self.update_target_op)
+		# with async_training the actors keep filling the buffer
+		if t % self._config.simulation_freq == 0 and not self._config.async_training:
 			self.sampling_buffer()
+		# last, so that resuming continues with step t + 1. Only the snapshot is timed, the
+		# checkpoint is written in the background
+		if t % self._config.saving_freq == 0:
+			with profiler.timer('save'):
+				self.save_checkpoint(t)
 		return loss_eval
 
+	def get_variables(self):
+		# Values of all global variables (q, target_q, optimizer slots), by name
+		variables = tf.global_variables()
+		return dict(zip([var.name for var in variables], self.sess.run(variables)))
+
+	def set_variables(self, values):
+		for var in tf.global_variables():
+			var.load(values[var.name], self.sess)
+
+	def get_training_state(self, t):
+		state = super(DQN, self).get_training_state(t)
+		state['variables'] = self.get_variables()
+		return state
+
+	def set_training_state(self, state):
+		self.set_variables(state['variables'])
+		return super(DQN, self).set_training_state(state)
+
 	def get_random_action(self, state):
+		# No need to run the network, the q value of a random action is never used
 		action = np.random.randint(self._config.numActions)
-		q = self.get_q_values(state)[0]
-		q_value = q_value = q[action]
-		return (action, q_value)
+		return (action, None)
 
 	def get_best_action(self, state):
 		q = self.get_q_values(state)[0]
 		action = np.argmax(q)
-		if self._config.mode == "test":
+		if self._config.mode == "test" and self._config.print_q_values:
 			print("Q value and best action:")
 			print(q)
 			print(action)
@@ -139,10 +231,34 @@ class DQN(model):
 		q_value = q[action]
 		return (action, q_value)
 
+	def get_best_actions(self, states):
+		return np.argmax(self.get_q_values(states), axis=1)
+
 	def get_q_values(self, state):
 		q, = self.sess.run([self.q], feed_dict={self.state:state})
 		return q
 
+	def get_numpy_network(self):
+		# Snapshot of the current q weights, batch norm folded in
+		q_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='q')
+		q_vars = [var for var in q_vars if 'Adam' not in var.name]
+		values = self.sess.run(q_vars)
+		return NumpyQNetwork.from_variables([var.name for var in q_vars], values)
+
+	def get_policy(self, eps=None):
+		# Snapshot of the current q weights as a NumPy epsilon-greedy policy, for worker processes
+		eps = self._eps_schedule.get_epsilon() if eps is None else eps
+		return EpsilonGreedyPolicy(self.get_numpy_network(), eps, self._config.numActions)
+
+	def export(self, path=None):
+		# Write the q network to a .npz for NumpyQNetwork.load, config.policy_path by default
+		path = self._config.policy_path if path is None else path
+		directory = os.path.dirname(path)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory)
+		self.get_numpy_network().save(path)
+		return path
+
 	def get_best_action_fn(self):
 		def action_fn(state):
 			action = self.get_best_action(state)[0]
@@ -0,0 +1,294 @@
+import asyncio
+import os
+import socket
+import stat
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from config import Config
+from VecTrafficSimulator import makeBatchSimulator
+
+# Local server hosting server_envs roads of a batch simulator behind a Unix socket (or TCP
+# for host:port addresses), so several processes (trainer, evaluators, viewers) can share them:
+#
+#   python cli.py serve --set server_envs=256
+#
+# A client acquires roads, then resets and steps them by id. Steps sent by different clients
+# within server_batch_wait seconds of each other run as one batched step, on a
+# single simulation thread, while the event loop keeps reading the next requests.
+#
+# Binary protocol, little endian. A request is a 4-byte header (op uint8, pad, n uint16),
+# followed by n int32 road ids (n uint8 actions after them for STEP). A reply is an 8-byte
+# header (status uint8, pad, n uint16, payload bytes uint32) followed by the payload:
+#
+#   INFO     n = 0             int32 [num_envs, state_length, num_actions, free roads]
+#   ACQUIRE  n roads, no ids   int32 ids of n free roads, owned by the connection until
+#                              RELEASE or disconnect
+#   RELEASE  ids               empty
+#   RESET    ids               float32 [n, state_length] states after the reset
+#   STEP     ids, actions      float32 [n] rewards, then float32 [n, state_length] next states
+#   STATE    ids               float32 [n, state_length], of any roads
+#
+# RELEASE, RESET, STEP and STATE need at least one id, and RESET and STEP need roads owned by
+# the connection. On errors status is 1 and the payload is the UTF-8 message.
+
+INFO, ACQUIRE, RELEASE, RESET, STEP, STATE = range(6)
+REQUEST = struct.Struct('<BxH')
+REPLY = struct.Struct('<BxHI')
+OK, ERROR = 0, 1
+
+def parse_address(address):
+	# ('tcp', (host, port)) for host:port, ('unix', path) for anything else
+	host, sep, port = address.rpartition(':')
+	if sep and port.isdigit():
+		return ('tcp', (host, int(port)))
+	return ('unix', address)
+
+class EnvServer(object):
+	"""
+	Serves the roads of one batch simulator (see makeBatchSimulator) to many asyncio
+	connections. Every simulator call runs on a single worker thread, so calls never overlap.
+	Pending steps are batched by _batch_steps: a batch waits up to batch_wait seconds for steps
+	of other roads unless every acquired road already has one pending, and a second step of a
+	road already in the batch goes to the next batch.
+	"""
+	def __init__(self, config, num_envs, seed=None, batch_wait=0.001):
+		self.sim = makeBatchSimulator(config, num_envs, seed)
+		self.num_envs = num_envs
+		self.state_length = config.state_length
+		self.num_actions = config.numActions
+		self.batch_wait = batch_wait
+		self._owner = np.full(num_envs, -1, dtype=np.int64)
+		self._next_conn = 0
+		self._pending = []
+		self._wake = None
+		self._executor = ThreadPoolExecutor(1)
+		self.steps = 0
+		self.batches = 0
+
+	async def serve(self, address):
+		kind, where = parse_address(address)
+		if kind == 'unix':
+			# a socket file left by a previous server
+			if os.path.exists(where) and stat.S_ISSOCK(os.stat(where).st_mode):
+				os.remove(where)
+			server = await asyncio.start_unix_server(self._handle, where)
+		else:
+			server = await asyncio.start_server(self._handle, *where)
+		self._wake = asyncio.Event()
+		batcher = asyncio.ensure_future(self._batch_steps())
+		try:
+			async with server:
+				await server.serve_forever()
+		finally:
+			batcher.cancel()
+			self._executor.shutdown()
+			if kind == 'unix' and os.path.exists(where):
+				os.remove(where)
+
+	async def _handle(self, reader, writer):
+		conn = self._next_conn
+		self._next_conn += 1
+		try:
+			while True:
+				op, n = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+				ids = actions = None
+				if op != ACQUIRE:
+					ids = np.frombuffer(await reader.readexactly(4 * n), dtype='<i4').astype(np.int64)
+				if op == STEP:
+					actions = np.frombuffer(await reader.readexactly(n), dtype=np.uint8)
+				try:
+					buffers = await self._dispatch(conn, op, n, ids, actions)
+					writer.write(REPLY.pack(OK, n, sum(buf.nbytes for buf in buffers)))
+					writer.writelines(buffers)
+				except ValueError as e:
+					message = str(e).encode('utf-8')
+					writer.write(REPLY.pack(ERROR, n, len(message)) + message)
+				await writer.drain()
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			self._owner[self._owner == conn] = -1
+			writer.close()
+
+	def _check(self, conn, op, ids, owned):
+		if len(ids) == 0:
+			raise ValueError('No road ids given')
+		if ids.min() < 0 or ids.max() >= self.num_envs:
+			raise ValueError('Road ids must be in [0, {})'.format(self.num_envs))
+		if owned and (self._owner[ids] != conn).any():
+			raise ValueError('Roads {} are not acquired by this connection'.format(ids[self._owner[ids] != conn].tolist()))
+		if op == STEP and len(np.unique(ids)) != len(ids):
+			raise ValueError('Repeated road ids in one step')
+
+	async def _dispatch(self, conn, op, n, ids, actions):
+		# Returns the reply payload as a list of buffers
+		loop = asyncio.get_running_loop()
+		if op == INFO:
+			return [np.array([self.num_envs, self.state_length, self.num_actions, (self._owner < 0).sum()], dtype='<i4').data]
+		if op == ACQUIRE:
+			free = np.flatnonzero(self._owner < 0)[:n]
+			if len(free) < n:
+				raise ValueError('{} roads requested, {} free'.format(n, len(free)))
+			self._owner[free] = conn
+			return [free.astype('<i4').data]
+		if op == RELEASE:
+			self._check(conn, op, ids, True)
+			self._owner[ids] = -1
+			return []
+		if op == RESET:
+			self._check(conn, op, ids, True)
+			return [await loop.run_in_executor(self._executor, self._reset, ids)]
+		if op == STATE:
+			self._check(conn, op, ids, False)
+			return [await loop.run_in_executor(self._executor, self._state, ids)]
+		if op == STEP:
+			self._check(conn, op, ids, True)
+			if len(actions) and actions.max() >= self.num_actions:
+				raise ValueError('Actions must be in [0, {})'.format(self.num_actions))
+			future = loop.create_future()
+			self._pending.append((ids, actions, future))
+			self._wake.set()
+			return await future
+		raise ValueError('Unknown op {}'.format(op))
+
+	def _state(self, ids):
+		states = np.empty((len(ids), self.state_length), dtype='<f4')
+		self.sim.state(ids, out=states)
+		return states.data
+
+	def _reset(self, ids):
+		self.sim.reset(ids)
+		return self._state(ids)
+
+	def _step(self, ids, actions):
+		rewards = self.sim.step(actions, ids).astype('<f4')
+		states = np.empty((len(ids), self.state_length), dtype='<f4')
+		self.sim.state(ids, out=states)
+		return rewards, states
+
+	def _next_batch(self):
+		# Pending steps of distinct roads, in arrival order
+		batch, rest, taken = [], [], set()
+		for request in self._pending:
+			roads = set(request[0].tolist())
+			if roads & taken:
+				rest.append(request)
+			else:
+				batch.append(request)
+				taken |= roads
+		self._pending = rest
+		return batch
+
+	async def _batch_steps(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			await self._wake.wait()
+			acquired = (self._owner >= 0).sum()
+			if self.batch_wait > 0 and sum(len(request[0]) for request in self._pending) < acquired:
+				await asyncio.sleep(self.batch_wait)
+			batch = self._next_batch()
+			if not self._pending:
+				self._wake.clear()
+			ids = np.concatenate([request[0] for request in batch])
+			actions = np.concatenate([request[1] for request in batch])
+			try:
+				rewards, states = await loop.run_in_executor(self._executor, self._step, ids, actions)
+			except Exception as e:
+				for _, _, future in batch:
+					if not future.done():
+						future.set_exception(e)
+				continue
+			self.steps += len(ids)
+			self.batches += 1
+			start = 0
+			for request_ids, _, future in batch:
+				stop = start + len(request_ids)
+				# done if the connection was dropped meanwhile
+				if not future.done():
+					future.set_result([rewards[start:stop].data, states[start:stop].data])
+				start = stop
+
+class EnvClient(object):
+	"""
+	Blocking client of an EnvServer. Replies are read straight into NumPy arrays.
+	"""
+	def __init__(self, address):
+		kind, where = parse_address(address)
+		if kind == 'unix':
+			self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		else:
+			self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self._sock.connect(where)
+		self._header = bytearray(REPLY.size)
+		self.num_envs, self.state_length, self.num_actions, _ = self.info()
+
+	def _recv_into(self, buf):
+		view = memoryview(buf).cast('B')
+		while len(view):
+			count = self._sock.recv_into(view)
+			if count == 0:
+				raise ConnectionError('Env server closed the connection')
+			view = view[count:]
+
+	def _call(self, op, n, *arrays):
+		self._sock.sendall(REQUEST.pack(op, n) + b''.join(array.tobytes() for array in arrays))
+		self._recv_into(self._header)
+		status, _, size = REPLY.unpack(self._header)
+		payload = bytearray(size)
+		self._recv_into(payload)
+		if status != OK:
+			raise ValueError(payload.decode('utf-8'))
+		return payload
+
+	def _ids(self, ids):
+		return np.asarray(ids, dtype='<i4').reshape(-1)
+
+	def info(self):
+		# [num_envs, state_length, num_actions, free roads]
+		return np.frombuffer(self._call(INFO, 0), dtype='<i4').tolist()
+
+	def acquire(self, n):
+		return np.frombuffer(self._call(ACQUIRE, n), dtype='<i4')
+
+	def release(self, ids):
+		ids = self._ids(ids)
+		self._call(RELEASE, len(ids), ids)
+
+	def reset(self, ids):
+		ids = self._ids(ids)
+		return np.frombuffer(self._call(RESET, len(ids), ids), dtype='<f4').reshape(len(ids), self.state_length)
+
+	def step(self, ids, actions):
+		# Returns rewards [n] and next states [n, state_length]
+		ids = self._ids(ids)
+		payload = self._call(STEP, len(ids), ids, np.asarray(actions, dtype=np.uint8).reshape(-1))
+		rewards = np.frombuffer(payload, dtype='<f4', count=len(ids))
+		states = np.frombuffer(payload, dtype='<f4', offset=4 * len(ids)).reshape(len(ids), self.state_length)
+		return rewards, states
+
+	def state(self, ids):
+		ids = self._ids(ids)
+		return np.frombuffer(self._call(STATE, len(ids), ids), dtype='<f4').reshape(len(ids), self.state_length)
+
+	def close(self):
+		self._sock.close()
+
+def run_server(config, on_ready=None):
+	# Serve config.server_envs roads on config.server_address until interrupted
+	server = EnvServer(config, config.server_envs, config.seed, config.server_batch_wait)
+	if on_ready is not None:
+		on_ready(server)
+	print('Serving {} roads on {}'.format(config.server_envs, config.server_address))
+	sys.stdout.flush()
+	try:
+		asyncio.run(server.serve(config.server_address))
+	except KeyboardInterrupt:
+		pass
+	print('Served {} steps in {} batches'.format(server.steps, server.batches))
+
+if __name__ == '__main__':
+	run_server(Config())
@@ -1,25 +1,16 @@
-import time
-import sys
 import numpy as np
-import sys
-
-import tensorflow as tf
-import tensorflow.contrib.layers as layers
-import os
 
 from config import Config
-from replay_buffer import ReplayBuffer
-from schedule import LinearSchedule
 from dqn_model import DQN
-from TrafficSimulator import TrafficSimulator
+from evaluation import Evaluator
 
 def evaluate_policy(model, T = 100, N = 100):
-	rewards = []
-	for k in range(N):
-		print ('I am at the %d episode'%(k))
-		states, reward, actions = model.simulate_an_episode(T, model.get_best_action_fn())
-		rewards.append(np.mean(reward))
-	return rewards
+	# Greedy policy of model, evaluated on the worker pool of evaluation.py
+	config = model._config
+	evaluator = Evaluator(config, config.num_workers, 0, config.eval_confidence,
+		config.eval_min_episodes, config.eval_ci_width)
+	result = evaluator.evaluate(model.get_policy(0.0), N, T)
+	return result['rewards']
 
 def main():
 	config = Config()
@@ -0,0 +1,17 @@
+from config import Config
+from evaluation import evaluate
+from numpy_q import NumpyQNetwork
+from policies import GreedyPolicy
+
+# Greedy policy of an exported q network (see export_DQN.py), evaluated without TensorFlow
+
+def evaluate_policy(config):
+	network = NumpyQNetwork.load(config.policy_path)
+	return evaluate(config, GreedyPolicy(network))['rewards']
+
+def main():
+	config = Config()
+	evaluate_policy(config)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,110 @@
+import multiprocessing as mp
+import sys
+from statistics import NormalDist
+import numpy as np
+
+from TrafficSimulator import TrafficSimulator
+
+class Evaluator(object):
+	"""
+	Evaluates a picklable policy (see policies.py) over up to max_episodes episodes of T steps.
+	The reward of an episode is its mean step reward.
+
+	Episode i reseeds np.random with (seed, i) before resetting the simulator, so its reward
+	does not depend on which worker runs it or on the number of workers. Episodes run on a
+	process pool of num_workers (inline when num_workers <= 1) and statistics are always
+	computed over the completed prefix 0..n-1, so results are deterministic for a given seed.
+
+	With ci_width set, evaluation stops as soon as at least min_episodes are done and the
+	confidence interval half-width of the mean is <= ci_width (normal approximation).
+	"""
+	def __init__(self, config, num_workers=1, seed=0, confidence=0.95, min_episodes=30, ci_width=None):
+		self._config = config
+		self.num_workers = num_workers
+		self.seed = seed
+		self.min_episodes = min_episodes
+		self.ci_width = ci_width
+		self._z = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+
+	def stats(self, rewards):
+		n = len(rewards)
+		mean = float(np.mean(rewards))
+		half_width = self._z * float(np.std(rewards, ddof=1)) / np.sqrt(n) if n > 1 else float('inf')
+		return {'n': n, 'mean': mean, 'ci': half_width}
+
+	def _done(self, stats):
+		return self.ci_width is not None and stats['n'] >= self.min_episodes and stats['ci'] <= self.ci_width
+
+	def evaluate(self, policy, max_episodes, T, log_freq=10):
+		# Returns {'n', 'mean', 'ci', 'rewards' (per episode, in order), 'stopped_early'}
+		rewards = []
+		pending = {}
+		stopped_early = False
+		for episode, reward in self._run(policy, max_episodes, T):
+			pending[episode] = reward
+			# extend the completed prefix
+			while len(rewards) in pending:
+				rewards.append(pending.pop(len(rewards)))
+				stats = self.stats(rewards)
+				if log_freq and stats['n'] % log_freq == 0:
+					sys.stdout.write('Episodes {} \t mean reward {:.4f} +- {:.4f} \n'.format(stats['n'], stats['mean'], stats['ci']))
+					sys.stdout.flush()
+				if self._done(stats):
+					stopped_early = stats['n'] < max_episodes
+					break
+			if stopped_early:
+				break
+		result = self.stats(rewards)
+		result['rewards'] = rewards
+		result['stopped_early'] = stopped_early
+		return result
+
+	def _run(self, policy, max_episodes, T):
+		episodes = range(max_episodes)
+		if self.num_workers <= 1:
+			_init_worker(self._config, policy, self.seed)
+			for episode in episodes:
+				yield _run_episode(episode, T)
+			return
+		# spawn, so that workers never inherit a forked TensorFlow runtime
+		ctx = mp.get_context('spawn')
+		pool = ctx.Pool(self.num_workers, initializer=_init_worker, initargs=(self._config, policy, self.seed))
+		try:
+			# results stream back as they complete; terminate() drops the rest on early stop
+			for item in pool.imap_unordered(_run_episode_star, [(episode, T) for episode in episodes]):
+				yield item
+		finally:
+			pool.terminate()
+			pool.join()
+
+_worker = {}
+
+def _init_worker(config, policy, seed):
+	_worker['sim'] = TrafficSimulator(config)
+	_worker['policy'] = policy
+	_worker['seed'] = seed
+	_worker['config'] = config
+
+def _run_episode(episode, T):
+	sim, policy, config = _worker['sim'], _worker['policy'], _worker['config']
+	np.random.seed([_worker['seed'], episode])
+	sim.reset()
+	# same zero-padded history as model.pad_state
+	stack = np.zeros((1, config.state_length, config.state_history), dtype=np.float32)
+	total = 0.0
+	for t in range(T):
+		stack[0, :, :-1] = stack[0, :, 1:]
+		sim.state(out=stack[0, :, -1])
+		total += sim.progress(policy.get_actions(stack)[0])
+	return (episode, total / T)
+
+def _run_episode_star(args):
+	return _run_episode(*args)
+
+def evaluate(config, policy, seed=0):
+	# Evaluate policy with the eval_* settings of config
+	evaluator = Evaluator(config, config.num_workers, seed, config.eval_confidence,
+		config.eval_min_episodes, config.eval_ci_width)
+	result = evaluator.evaluate(policy, config.N, config.T)
+	print('Mean reward over {} episodes: {:.4f} +- {:.4f}'.format(result['n'], result['mean'], result['ci']))
+	return result
@@ -0,0 +1,15 @@
+from config import Config
+from dqn_model import DQN
+
+def main():
+	# Restore the q network of the latest checkpoint of checkpoint_dir (or of the TF checkpoint of
+	# model_output written by runs from before checkpoint.py) and write it to policy_path
+	config = Config()
+	config.mode = 'test'
+	config.dropout = 1.0
+	model = DQN(config)
+	model.initialize()
+	print('Exported the q network to {}'.format(model.export()))
+
+if __name__ == '__main__':
+	main()
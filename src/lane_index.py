@@ -0,0 +1,185 @@
+import bisect
+import numpy as np
+
+class LaneIndex(object):
+	# Sparse replacement for the dense [numRows, numLanes] speed grid. Each lane keeps
+	#  - the rows of the cars in it, sorted, for leader/follower/gap queries, and
+	#  - its occupied cells as sorted, non-overlapping segments [start, stop) with a speed,
+	#    updated with the same writes the dense grid would get (including overwrites and
+	#    erasures by overlapping cars), so cell queries return exactly what the grid held.
+	# Updates and queries are bisections, so cost scales with the number of cars, not rows.
+	def __init__(self, numLanes, numRows, carHeight):
+		self.numLanes = numLanes
+		self.numRows = numRows
+		self.carHeight = carHeight
+		self._rows = [[] for _ in range(numLanes)]
+		self._ids = [[] for _ in range(numLanes)]
+		self._starts = [[] for _ in range(numLanes)]
+		self._stops = [[] for _ in range(numLanes)]
+		self._speeds = [[] for _ in range(numLanes)]
+
+	def insert(self, carID, lane, row):
+		i = bisect.bisect_right(self._rows[lane], row)
+		self._rows[lane].insert(i, row)
+		self._ids[lane].insert(i, carID)
+
+	def remove(self, carID, lane, row):
+		i = bisect.bisect_left(self._rows[lane], row)
+		while self._ids[lane][i] != carID:
+			i += 1
+		del self._rows[lane][i]
+		del self._ids[lane][i]
+
+	def move(self, carID, lane, row, newLane, newRow):
+		if lane != newLane or row != newRow:
+			self.remove(carID, lane, row)
+			self.insert(carID, newLane, newRow)
+
+	# Clip [start, stop) like a Python slice of a grid column (negative bounds count from the end)
+	def _slice(self, start, stop):
+		if start < 0: start = max(start + self.numRows, 0)
+		if stop < 0: stop = max(stop + self.numRows, 0)
+		return min(start, self.numRows), min(stop, self.numRows)
+
+	# Equivalent of grid[start:stop, lane] = speed (speed 0 clears the cells)
+	def fill(self, lane, start, stop, speed):
+		start, stop = self._slice(start, stop)
+		if start >= stop:
+			return
+		starts, stops, speeds = self._starts[lane], self._stops[lane], self._speeds[lane]
+		i = bisect.bisect_right(stops, start)
+		j = bisect.bisect_left(starts, stop)
+		newStarts, newStops, newSpeeds = [], [], []
+		if i < j and starts[i] < start:
+			newStarts.append(starts[i]); newStops.append(start); newSpeeds.append(speeds[i])
+		if speed != 0:
+			newStarts.append(start); newStops.append(stop); newSpeeds.append(speed)
+		if i < j and stops[j - 1] > stop:
+			newStarts.append(stop); newStops.append(stops[j - 1]); newSpeeds.append(speeds[j - 1])
+		starts[i:j] = newStarts
+		stops[i:j] = newStops
+		speeds[i:j] = newSpeeds
+
+	# Max of grid[start:stop, lane], 0 if all empty
+	def maxSpeed(self, lane, start, stop):
+		start, stop = self._slice(start, stop)
+		if start >= stop:
+			return 0.0
+		i = bisect.bisect_right(self._stops[lane], start)
+		j = bisect.bisect_left(self._starts[lane], stop)
+		return max(self._speeds[lane][i:j]) if i < j else 0.0
+
+	def occupied(self, lane, start, stop):
+		return self.maxSpeed(lane, start, stop) > 0
+
+	# Whether all of grid[start:stop, lane] equals speed
+	def holds(self, lane, start, stop, speed):
+		start, stop = self._slice(start, stop)
+		starts, stops, speeds = self._starts[lane], self._stops[lane], self._speeds[lane]
+		i = bisect.bisect_right(stops, start)
+		while start < stop:
+			if i == len(starts) or starts[i] > start or speeds[i] != speed:
+				return False
+			start = stops[i]
+			i += 1
+		return True
+
+	# Nearest car strictly ahead of (leader) / behind (follower) row, as (carID, row) or None
+	def leader(self, lane, row, exclude=None):
+		rows = self._rows[lane]
+		i = bisect.bisect_right(rows, row)
+		while i < len(rows) and self._ids[lane][i] == exclude:
+			i += 1
+		return (self._ids[lane][i], rows[i]) if i < len(rows) else None
+
+	def follower(self, lane, row, exclude=None):
+		rows = self._rows[lane]
+		i = bisect.bisect_left(rows, row) - 1
+		while i >= 0 and self._ids[lane][i] == exclude:
+			i -= 1
+		return (self._ids[lane][i], rows[i]) if i >= 0 else None
+
+	# Rows from row down to the nearest car at or below it and up to the nearest car above it,
+	# among the cars keep(carID) accepts if given (inf if none)
+	def gaps(self, lane, row, exclude=None, keep=None):
+		rows, ids = self._rows[lane], self._ids[lane]
+		i = bisect.bisect_right(rows, row)
+		below = above = np.inf
+		for k in range(i - 1, -1, -1):
+			if ids[k] != exclude and (keep is None or keep(ids[k])):
+				below = row - rows[k]
+				break
+		for k in range(i, len(rows)):
+			if ids[k] != exclude and (keep is None or keep(ids[k])):
+				above = rows[k] - row
+				break
+		return below, above
+
+	# (carID, row) of the cars at or above row, highest first
+	def carsFrom(self, lane, row):
+		rows, ids = self._rows[lane], self._ids[lane]
+		for k in range(len(rows) - 1, bisect.bisect_left(rows, row) - 1, -1):
+			yield ids[k], rows[k]
+
+	# Free rows between the front of a car at row and the back of its leader (inf if none)
+	def gap(self, lane, row, exclude=None):
+		front = self.leader(lane, row, exclude)
+		if front is None:
+			return np.inf
+		return front[1] - (row + self.carHeight)
+
+	# Lowest / highest car row in a lane, None if the lane has no cars
+	def lowest(self, lane, exclude=None):
+		for carID, row in zip(self._ids[lane], self._rows[lane]):
+			if carID != exclude:
+				return row
+		return None
+
+	def highest(self, lane, exclude=None):
+		for carID, row in zip(reversed(self._ids[lane]), reversed(self._rows[lane])):
+			if carID != exclude:
+				return row
+		return None
+
+	# Whether the lane has occupied cells that are not under any car in it, as left by writes
+	# that wrapped around like negative slices
+	def hasStrayCells(self, lane):
+		covered = []
+		for row in self._rows[lane]:
+			start, stop = max(row, 0), min(row + self.carHeight, self.numRows)
+			if start >= stop:
+				continue
+			if covered and start <= covered[-1][1]:
+				covered[-1][1] = max(covered[-1][1], stop)
+			else:
+				covered.append([start, stop])
+		i = 0
+		for start, stop in zip(self._starts[lane], self._stops[lane]):
+			while i < len(covered) and covered[i][1] <= start:
+				i += 1
+			if i == len(covered) or covered[i][0] > start or covered[i][1] < stop:
+				return True
+		return False
+
+	# Copy of the per-lane lists, to be passed to restore(). Restoring copies again, so one
+	# snapshot can be restored any number of times
+	def snapshot(self):
+		return tuple([list(lane) for lane in lists] for lists in (self._rows, self._ids, self._starts, self._stops, self._speeds))
+
+	def restore(self, state):
+		self._rows, self._ids, self._starts, self._stops, self._speeds = \
+			([list(lane) for lane in lists] for lists in state)
+
+	# Materialize the dense [numRows, numLanes] speed grid, or only its rows from first on when
+	# grid is given (rows [first, first + len(grid)), in the dtype of grid)
+	def toGrid(self, grid=None, first=0):
+		if grid is None:
+			grid = np.zeros((self.numRows - first, self.numLanes))
+		else:
+			grid[:] = 0.0
+		last = first + len(grid)
+		for lane in range(self.numLanes):
+			for start, stop, speed in zip(self._starts[lane], self._stops[lane], self._speeds[lane]):
+				if stop > first and start < last:
+					grid[max(start, first) - first:min(stop, last) - first, lane] = speed
+		return grid
@@ -3,9 +3,14 @@ import sys
 import numpy as np
 
 from config import Config
-from replay_buffer import ReplayBuffer
+from replay_buffer import make_replay_buffer
+from profiler import make_profiler
+from checkpoint import CheckpointManager
+from traces import TraceWriter, TraceStream
 from schedule import LinearSchedule
 from TrafficSimulator import TrafficSimulator
+from parallel_sampler import ParallelSampler
+from rollout import BatchRollout
 
 class model(object):
 	def __init__(self, config):
@@ -18,8 +23,21 @@ class model(object):
 			self._config.lr_begin,
 			self._config.lr_end,
 			self._config.lr_nsteps)
+		self._beta_schedule = LinearSchedule(
+			self._config.prioritized_beta_begin,
+			1.0,
+			self._config.nsteps_train)
 		self._sim = TrafficSimulator(config)
-		self._bf = ReplayBuffer(10000, config)
+		self._bf = make_replay_buffer(config)
+		self._sampler = None # worker pool, created on first use when num_workers > 1
+		self._rollouts = {} # batched rollout drivers, by batch size
+		self._profiler = make_profiler(config)
+		self._prefetcher = None # background minibatch sampler, created on first use when prefetch_batches > 0
+		self._checkpoints = CheckpointManager(config.checkpoint_dir, config.checkpoint_keep)
+		self._sampler_state = None # (seed, round) of a resumed worker pool, applied when it is created
+		self._total_loss = 0.0 # sum of the train_step losses since the start of the run
+		self._trace_writer = TraceWriter(config.trace_dir, config, config.trace_chunk_episodes) if config.trace_dir is not None else None
+		self._trace_stream = None # episodes of offline_trace_dir, opened on first use
 
 		self._action_fn = self.get_action_fn()
 
@@ -38,6 +56,78 @@ class model(object):
 		### return action, q value
 		pass
 
+	def get_best_actions(self, states):
+		### return the greedy actions of a batch of states
+		pass
+
+	def get_actions(self, states, eps):
+		# Epsilon-greedy actions for a whole batch of states, with a single get_best_actions call
+		explore = np.random.random(len(states)) < eps
+		actions = np.random.randint(self._config.numActions, size=len(states))
+		if explore.all():
+			return actions
+		return np.where(explore, actions, self.get_best_actions(states))
+
+	def get_policy(self, eps=None):
+		### return a picklable snapshot of the current policy (see policies.py), acting
+		### epsilon-greedily with eps, or with the current epsilon if None
+		pass
+
+	def get_training_state(self, t):
+		# Copy of everything the training loop needs to continue exactly after step t: replay
+		# buffer, schedules, np.random, the episode collectors' random state and the loss so far.
+		# Models add their variables
+		rollouts = dict((K, rollout.get_state()) for K, rollout in self._rollouts.items())
+		sampler = self._sampler.get_state() if self._sampler is not None else self._sampler_state
+		return {
+			't': t,
+			'total_loss': self._total_loss,
+			'buffer': self._bf.get_state() if self._config.checkpoint_buffer else None,
+			'schedules': dict((name, schedule.get_state()) for name, schedule in self._schedules()),
+			'rollouts': rollouts,
+			'sampler': sampler,
+			'np_random': np.random.get_state(),
+		}
+
+	def set_training_state(self, state):
+		# Returns the step to continue after
+		self._total_loss = state['total_loss']
+		if state['buffer'] is not None:
+			self._bf.set_state(state['buffer'])
+		schedules = state['schedules']
+		for name, schedule in self._schedules():
+			schedule.set_state(schedules[name])
+		for K, rollout_state in state['rollouts'].items():
+			if K not in self._rollouts:
+				self._rollouts[K] = BatchRollout(self._config, K)
+			self._rollouts[K].set_state(rollout_state)
+		if self._sampler is not None and state['sampler'] is not None:
+			self._sampler.set_state(state['sampler'])
+		else:
+			self._sampler_state = state['sampler']
+		# last, creating the rollouts above draws from np.random
+		np.random.set_state(state['np_random'])
+		return state['t']
+
+	def _schedules(self):
+		return (('eps', self._eps_schedule), ('lr', self._lr_schedule), ('beta', self._beta_schedule))
+
+	def close_trace(self):
+		# Write the recorded episodes that do not fill a chunk yet
+		if self._trace_writer is not None:
+			self._trace_writer.close()
+
+	def save_checkpoint(self, t):
+		self._checkpoints.save(t, self.get_training_state(t))
+
+	def restore_checkpoint(self):
+		# Resume from the latest checkpoint of checkpoint_dir, returns its step (0 if there is none)
+		state = self._checkpoints.load()
+		if state is None:
+			return 0
+		print("Resuming from step {}".format(state['t']))
+		return self.set_training_state(state)
+
 	def get_action(self, state):
 		if np.random.random() < self._eps_schedule.get_epsilon():
 			return self.get_random_action(state)[0]
@@ -73,18 +163,76 @@ class model(object):
 			states.append(state)
 
 			state_input = self.pad_state(states[-self._config.state_history:], self._config.state_history)
-			action = action_fn(state_input)
+			with self._profiler.timer('act'):
+				action = action_fn(state_input)
 			actions.append(action)
 
-			reward = self._sim.progress(action)
+			if self._trace_writer is not None:
+				self._trace_writer.observe(self._sim)
+			with self._profiler.timer('env'):
+				reward = self._sim.progress(action)
 			rewards.append(reward)
+			if self._trace_writer is not None:
+				self._trace_writer.step(self._sim, action, reward)
 
+		self._profiler.count('env_steps', T)
 		return (states, rewards, actions)
 
 
+	def simulate_episodes(self, N, T, eps):
+		# Run N episodes, rollout_batch of them at a time in lockstep, with one batched
+		# epsilon-greedy action call per timestep. Returns states [N, T, state_length], rewards, actions [N, T]
+		batch = self._config.rollout_batch
+		def actions_fn(states):
+			with self._profiler.timer('act'):
+				return self.get_actions(states, eps)
+		results = []
+		for start in range(0, N, batch):
+			K = min(batch, N - start)
+			if K not in self._rollouts:
+				self._rollouts[K] = BatchRollout(self._config, K)
+			# includes the 'act' time of the batch
+			with self._profiler.timer('rollout'):
+				results.append(self._rollouts[K].run(T, actions_fn))
+			self._profiler.count('env_steps', K * T)
+		states, actions, rewards = [np.concatenate(x) for x in zip(*results)]
+		return (states, rewards, actions)
+
 	def sampling_buffer(self):
+		with self._profiler.timer('sampling_buffer'):
+			self._sampling_buffer()
+
+	def _sampling_buffer(self):
+		if self._config.offline_trace_dir is not None:
+			if self._trace_stream is None:
+				self._trace_stream = TraceStream(self._config.offline_trace_dir, self._config, self._config.seed)
+			with self._profiler.timer('store'):
+				self._trace_stream.fill(self._bf, self._config.nBufferSample)
+			return
+		if self._config.num_workers > 1:
+			self.parallel_sampling_buffer()
+			return
+		if self._config.rollout_batch > 1:
+			states, rewards, actions = self.simulate_episodes(self._config.nBufferSample, self._config.T, self._eps_schedule.get_epsilon())
+			with self._profiler.timer('store'):
+				self._bf.store_episodes(states, actions, rewards)
+			return
 		for s in range(self._config.nBufferSample):
 			if s % 20 == 0:
 				print("Sample buffer: ", s)
 			states, rewards, actions = self.simulate_an_episode(self._config.T, self._action_fn)
-			self._bf.store(states, actions, rewards)
+			with self._profiler.timer('store'):
+				self._bf.store(states, actions, rewards)
+
+	def parallel_sampling_buffer(self):
+		# Collect nBufferSample episodes on a process pool, each worker running a snapshot of the policy
+		if self._sampler is None:
+			seed = self._config.seed if self._sampler_state is None else self._sampler_state[0]
+			self._sampler = ParallelSampler(self._config, self._config.num_workers, self._config.nBufferSample, seed)
+			if self._sampler_state is not None:
+				self._sampler.set_state(self._sampler_state)
+		with self._profiler.timer('collect'):
+			states, actions, rewards = self._sampler.sample(self.get_policy(), self._config.nBufferSample)
+		self._profiler.count('env_steps', actions.size)
+		with self._profiler.timer('store'):
+			self._bf.store_episodes(states, actions, rewards)
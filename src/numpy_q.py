@@ -0,0 +1,66 @@
+import numpy as np
+
+def fold_batch_norm(layer, bn_epsilon=0.001):
+	# (weights, biases) of a dense layer followed by batch norm in inference mode, with the
+	# normalization folded in: ((x W + b) - mean) * gamma / sqrt(var + eps) + beta = x W' + b'
+	weights = layer['weights']
+	biases = layer.get('biases', np.zeros(weights.shape[1], dtype=np.float32))
+	if 'moving_mean' not in layer:
+		return weights, biases
+	scale = layer.get('gamma', 1.0) / np.sqrt(layer['moving_variance'] + bn_epsilon)
+	return weights * scale, (biases - layer['moving_mean']) * scale + layer.get('beta', 0.0)
+
+class NumpyQNetwork(object):
+	"""
+	NumPy forward pass of DQN.get_q_values_op in inference mode: dropout is off and
+	batch norm uses its moving statistics, folded into the dense layers so a forward pass is
+	one matrix product, bias and ReLU per layer. save() / load() keep the folded weights in a
+	single .npz (see DQN.export), which is all a process needs to act without TensorFlow.
+	"""
+	def __init__(self, weights, biases):
+		self.weights = [np.ascontiguousarray(w, dtype=np.float32) for w in weights]
+		self.biases = [np.ascontiguousarray(b, dtype=np.float32) for b in biases]
+
+	@classmethod
+	def from_layers(cls, layers, bn_epsilon=0.001):
+		# Layers are dicts with the TF variable names of the layer ('weights', 'biases', and
+		# 'beta', 'moving_mean', 'moving_variance' when the layer is batch normalized)
+		folded = [fold_batch_norm(layer, bn_epsilon) for layer in layers]
+		return cls([w for w, _ in folded], [b for _, b in folded])
+
+	@classmethod
+	def from_variables(cls, names, values):
+		# names/values of the q scope's global variables, in creation order
+		layers = []
+		for name, value in zip(names, values):
+			key = name.split('/')[-1].split(':')[0]
+			if key == 'weights':
+				layers.append({})
+			layers[-1][key] = np.asarray(value, dtype=np.float32)
+		return cls.from_layers(layers)
+
+	def save(self, path):
+		arrays = {}
+		for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+			arrays['weights_{}'.format(i)] = w
+			arrays['biases_{}'.format(i)] = b
+		np.savez(path, **arrays)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path) as f:
+			n = len(f.files) // 2
+			return cls([f['weights_{}'.format(i)] for i in range(n)], [f['biases_{}'.format(i)] for i in range(n)])
+
+	def get_q_values(self, states):
+		x = np.asarray(states, dtype=np.float32).reshape(len(states), -1)
+		last = len(self.weights) - 1
+		for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+			x = x.dot(w)
+			x += b
+			if i < last:
+				np.maximum(x, 0, out=x)
+		return x
+
+	def get_best_actions(self, states):
+		return np.argmax(self.get_q_values(states), axis=1)
@@ -0,0 +1,105 @@
+import numpy as np
+
+# Observation features of TrafficSimulator.state, selected with config.observationFeatures
+# and laid out in this order:
+#  - 'vector': ego speed, ego position, action history, speed history (oldest first), then
+#    the speed and the (row, lane) position of every other car
+#  - 'grid': the [rows, lanes] grid pooled to observationGridRows rows, as the occupied
+#    fraction of each cell then the mean speed of its occupied cells
+#  - 'lidar': for each lane, the gap from the ego car to the nearest car ahead and its speed,
+#    then the same behind, in grid rows (gridRows and speed 0 when there is no car)
+FEATURES = ('vector', 'grid', 'lidar')
+
+def observationLength(config):
+	length = 0
+	for feature in config.observationFeatures:
+		if feature == 'vector':
+			length += 1 + 2 + 2 * config.actionSpeedHistory + 3 * config.numCars
+		elif feature == 'grid':
+			length += 2 * config.observationGridRows * config.numLanes
+		elif feature == 'lidar':
+			length += 4 * config.numLanes
+		else:
+			raise ValueError('Unknown observation feature {}, expected one of {}'.format(feature, FEATURES))
+	return length
+
+class ObservationBuilder(object):
+	# Writes the selected features of a TrafficSimulator into a flat buffer. The grid is pooled
+	# from the car arrays with a fixed number of NumPy calls, independent of the grid size, and
+	# the lidar features are leader / follower queries on the simulator's lane index.
+	def __init__(self, config):
+		self.features = list(config.observationFeatures)
+		self.length = observationLength(config)
+		self.numCars = config.numCars
+		self.numLanes = config.numLanes
+		self.carHeightGrid = config.carHeightGrid
+		self.actionSpeedHistory = config.actionSpeedHistory
+		self.gridRows = config.canvasHeight // config.gridHeight
+		self.poolRows = config.observationGridRows
+
+		# Grid pooling. Cell rows are clipped to [-1, gridRows] and mapped to the first cell of
+		# their pooled row, with rows off the grid going to an extra pooled row that is dropped
+		poolOf = np.arange(self.gridRows) * self.poolRows // self.gridRows
+		self._poolOf = np.concatenate([[self.poolRows], poolOf, [self.poolRows]]) * self.numLanes
+		self._invPoolSize = np.repeat(1.0 / np.bincount(poolOf, minlength=self.poolRows), self.numLanes)
+		self._cellOffsets = np.arange(self.carHeightGrid) + 1
+		# (row, lane) and speed of all cars, the ego car last
+		self._pos = np.empty((self.numCars + 1, 2), dtype=int)
+		self._speeds = np.empty((self.numCars + 1, 1))
+		self._cellSpeeds = np.empty((self.numCars + 1, self.carHeightGrid))
+
+	def write(self, sim, out):
+		offset = 0
+		for feature in self.features:
+			if feature == 'vector':
+				offset = self.writeVector(sim, out, offset)
+			elif feature == 'grid':
+				offset = self.writeGrid(sim, out, offset)
+			else:
+				offset = self.writeLidar(sim, out, offset)
+		return out
+
+	def writeVector(self, sim, out, offset):
+		h, n = self.actionSpeedHistory, self.numCars
+		out[offset] = sim.EgoCarTopSpeed * sim.EgoCarSpeedFrac
+		out[offset + 1:offset + 3] = sim.EgoCarPos
+		offset += 3
+		for history, head in ((sim.actionHistory, sim.actionHead), (sim.speedHistory, sim.speedHead)):
+			# ring arrays, the oldest entry is at head
+			out[offset:offset + h - head] = history[head:]
+			out[offset + h - head:offset + h] = history[:head]
+			offset += h
+		np.multiply(sim.carsTopSpeed, sim.carsSpeedFrac, out=out[offset:offset + n])
+		out[offset + n:offset + 3 * n] = sim.carsPos.ravel()
+		return offset + 3 * n
+
+	def writeGrid(self, sim, out, offset):
+		n, size = self.numCars, self.poolRows * self.numLanes
+		pos, speeds = self._pos, self._speeds
+		pos[:n] = sim.carsPos
+		pos[n] = sim.EgoCarPos
+		np.multiply(sim.carsTopSpeed, sim.carsSpeedFrac, out=speeds[:n, 0])
+		speeds[n] = sim.EgoCarTopSpeed * sim.EgoCarSpeedFrac
+		# [cars, carHeightGrid] pooled cell of every car cell, take() with mode='clip' does the clipping
+		flat = self._poolOf.take(pos[:, :1] + self._cellOffsets, mode='clip')
+		flat += pos[:, 1:]
+		counts = np.bincount(flat.ravel(), minlength=size + self.numLanes)[:size]
+		self._cellSpeeds[:] = speeds
+		speedSums = np.bincount(flat.ravel(), weights=self._cellSpeeds.ravel(), minlength=size + self.numLanes)[:size]
+		np.multiply(counts, self._invPoolSize, out=out[offset:offset + size])
+		np.divide(speedSums, np.maximum(counts, 1), out=out[offset + size:offset + 2 * size])
+		return offset + 2 * size
+
+	def writeLidar(self, sim, out, offset):
+		L, row = self.numLanes, sim.EgoCarPos[0]
+		values = [0.0] * (4 * L)
+		for lane in range(L):
+			# cars level with the ego car count as ahead
+			for car, block in ((sim.index.leader(lane, row - 1, sim.egoID), 0), (sim.index.follower(lane, row, sim.egoID), 2 * L)):
+				if car is None:
+					values[block + lane] = self.gridRows
+				else:
+					values[block + lane] = abs(car[1] - row) - self.carHeightGrid
+					values[block + L + lane] = sim.carsTopSpeed[car[0]] * sim.carsSpeedFrac[car[0]]
+		out[offset:offset + 4 * L] = values
+		return offset + 4 * L
@@ -0,0 +1,118 @@
+import atexit
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+from TrafficSimulator import TrafficSimulator
+
+class ParallelSampler(object):
+	"""
+	Pool of worker processes collecting episodes for the replay buffer. Each worker owns a
+	TrafficSimulator and writes its transitions straight into shared-memory staging arrays
+	(states [nEpisodes, T, state_length], actions and rewards [nEpisodes, T]), so only the
+	policy snapshot and a few integers go through pipes.
+
+	Episodes are assigned to workers round-robin and each worker reseeds np.random with
+	(seed, round, worker id) before a round, so a fixed seed and worker count always give
+	the same transitions.
+	"""
+	def __init__(self, config, num_workers, capacity, seed=None):
+		self._config = config
+		self.num_workers = num_workers
+		self.capacity = capacity
+		self.seed = np.random.randint(2**31 - 1) if seed is None else seed
+		self._round = 0
+
+		T, state_length = config.T, config.state_length
+		self._specs = {
+			'states': ((capacity, T, state_length), np.float32),
+			'actions': ((capacity, T), np.int32),
+			'rewards': ((capacity, T), np.float32),
+		}
+		self._shm = {}
+		self.staging = {}
+		for key, (shape, dtype) in self._specs.items():
+			shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+			self._shm[key] = shm
+			self.staging[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+		# spawn, so that workers never inherit a forked TensorFlow runtime
+		ctx = mp.get_context('spawn')
+		self._conns = []
+		self._procs = []
+		shm_names = dict((key, (shm.name,) + self._specs[key]) for key, shm in self._shm.items())
+		for worker_id in range(num_workers):
+			parent_conn, child_conn = ctx.Pipe()
+			proc = ctx.Process(target=_worker, args=(config, shm_names, child_conn))
+			proc.daemon = True
+			proc.start()
+			self._conns.append(parent_conn)
+			self._procs.append(proc)
+		atexit.register(self.close)
+
+	# (seed, round), which determine the episodes of the next rounds
+	def get_state(self):
+		return (self.seed, self._round)
+
+	def set_state(self, state):
+		self.seed, self._round = state
+
+	def sample(self, policy, num_episodes):
+		# Returns views on the staging arrays, valid until the next call
+		assert num_episodes <= self.capacity
+		self._round += 1
+		for worker_id, conn in enumerate(self._conns):
+			episodes = list(range(worker_id, num_episodes, self.num_workers))
+			conn.send(('collect', policy, episodes, [self.seed, self._round, worker_id]))
+		for conn in self._conns:
+			conn.recv()
+		return (self.staging['states'][:num_episodes], self.staging['actions'][:num_episodes],
+			self.staging['rewards'][:num_episodes])
+
+	def close(self):
+		if self._shm is None:
+			return
+		for conn in self._conns:
+			try:
+				conn.send(('close',))
+			except (OSError, EOFError):
+				pass
+		for proc in self._procs:
+			proc.join(timeout=5)
+		self.staging = None
+		for shm in self._shm.values():
+			shm.close()
+			shm.unlink()
+		self._shm = None
+
+def _worker(config, shm_names, conn):
+	shms = {}
+	staging = {}
+	for key, (name, shape, dtype) in shm_names.items():
+		shms[key] = shared_memory.SharedMemory(name=name)
+		staging[key] = np.ndarray(shape, dtype=dtype, buffer=shms[key].buf)
+	sim = TrafficSimulator(config)
+	stack = np.zeros((1, config.state_length, config.state_history), dtype=np.float32)
+
+	while True:
+		cmd = conn.recv()
+		if cmd[0] == 'close':
+			break
+		_, policy, episodes, seed = cmd
+		np.random.seed(seed)
+		for e in episodes:
+			sim.reset()
+			stack[:] = 0
+			for t in range(config.T):
+				state = sim.state(out=staging['states'][e, t])
+				# same zero-padded history as model.pad_state
+				stack[0, :, :-1] = stack[0, :, 1:]
+				stack[0, :, -1] = state
+				action = policy.get_actions(stack)[0]
+				staging['actions'][e, t] = action
+				staging['rewards'][e, t] = sim.progress(action)
+		conn.send(len(episodes))
+
+	del staging
+	for shm in shms.values():
+		shm.close()
@@ -0,0 +1,164 @@
+import copy
+import hashlib
+import json
+import os
+from math import comb
+import numpy as np
+
+# Initial car placement. The simulators place cars one by one with a few uniform (row, lane)
+# draws, as they always did, falling back to a uniform draw among the free slots computed by
+# freeSlots, which has the same distribution but never stalls on dense roads. If the road
+# jams (cars placed so far leave no free slot although the road could hold all of them), the
+# whole road is redrawn with drawConfiguration instead.
+
+PLACEMENT_TRIES = 16
+
+class RoadJammed(Exception):
+	pass
+
+def freeSlots(occupied, carHeight):
+	# occupied: [..., rows, lanes] bool grid. Returns [..., rows - carHeight, lanes], True where a
+	# car can start at that row, i.e. rows [start - carHeight, start + 2 * carHeight) are empty
+	rows = occupied.shape[-2]
+	counts = np.zeros(occupied.shape[:-2] + (rows + 1, occupied.shape[-1]), dtype=int)
+	np.cumsum(occupied, axis=-2, out=counts[..., 1:, :])
+	starts = np.arange(rows - carHeight)
+	low = np.maximum(starts - carHeight, 0)
+	high = np.minimum(starts + 2 * carHeight, rows)
+	return counts[..., high, :] == counts[..., low, :]
+
+def drawFreeSlot(occupied, carHeight, rng):
+	# Uniform (row, lane) among the free slots of a [rows, lanes] occupied grid
+	free = np.flatnonzero(freeSlots(occupied, carHeight))
+	if len(free) == 0:
+		raise RoadJammed()
+	return divmod(int(free[rng.randint(len(free))]), occupied.shape[1])
+
+def _ways(length, count, spacing):
+	# Number of ways to place count cars at distinct starts in range(length), spacing apart
+	if count == 0:
+		return 1
+	free = length - (count - 1) * (spacing - 1)
+	return comb(free, count) if free >= count else 0
+
+def _drawInterval(length, count, spacing, rng):
+	# count sorted starts in range(length), spacing apart, uniform over all such placements
+	free = length - (count - 1) * (spacing - 1)
+	return np.sort(rng.choice(free, count, replace=False)) + np.arange(count) * (spacing - 1)
+
+def drawConfiguration(numCars, numLanes, gridRows, carHeight, egoRow, egoLane, rng):
+	# Draw a [numCars, 2] (row, lane) placement uniformly among all valid ones: cars (and the
+	# ego car) on the same lane start at least 2 * carHeight rows apart. Lanes are split into
+	# intervals of possible starts, the ego lane into the parts below and above the ego car.
+	spacing, length = 2 * carHeight, gridRows - carHeight
+	intervals = []
+	for lane in range(numLanes):
+		if lane == egoLane:
+			intervals.append((lane, 0, max(min(egoRow - spacing + 1, length), 0)))
+			intervals.append((lane, egoRow + spacing, max(length - egoRow - spacing, 0)))
+		else:
+			intervals.append((lane, 0, length))
+	# ways[j][n]: placements of n cars on intervals j..
+	ways = [[0] * (numCars + 1) for _ in range(len(intervals) + 1)]
+	ways[-1][0] = 1
+	for j in range(len(intervals) - 1, -1, -1):
+		w = [_ways(intervals[j][2], k, spacing) for k in range(numCars + 1)]
+		for n in range(numCars + 1):
+			ways[j][n] = sum(w[k] * ways[j + 1][n - k] for k in range(n + 1))
+	if ways[0][numCars] == 0:
+		raise ValueError('{} cars do not fit on {} lanes of {} rows'.format(numCars, numLanes, gridRows))
+
+	carsPos = np.empty((numCars, 2), dtype=int)
+	n = numCars
+	for j, (lane, start, size) in enumerate(intervals):
+		# number of cars on this interval, with probability proportional to the placements it allows
+		u = rng.random_sample() * ways[j][n]
+		k = 0
+		while True:
+			u -= _ways(size, k, spacing) * ways[j + 1][n - k]
+			if u < 0 or k == n:
+				break
+			k += 1
+		placed = numCars - n
+		carsPos[placed:placed + k, 0] = start + _drawInterval(size, k, spacing, rng)
+		carsPos[placed:placed + k, 1] = lane
+		n -= k
+	return carsPos[rng.permutation(numCars)]
+
+def drawRingConfiguration(numCars, numLanes, roadRows, carHeight, egoRow, egoLane, rng):
+	# Draw a [numCars, 2] (row, lane) placement on a ring road of roadRows rows, for roads too long
+	# for drawConfiguration. Cars are spread over the lanes multinomially, up to what each lane
+	# holds, then placed uniformly on their lane as in drawConfiguration, 2 * carHeight rows apart
+	# from each other and from the ego car all around the ring. Rows are in range(roadRows).
+	spacing = 2 * carHeight
+	firsts = np.zeros(numLanes, dtype=int)
+	lengths = np.full(numLanes, roadRows - spacing + 1)
+	firsts[egoLane] = egoRow + spacing
+	lengths[egoLane] = roadRows - 2 * spacing + 1
+	capacity = np.maximum((lengths - 1) // spacing + 1, 0)
+	if numCars > capacity.sum():
+		raise ValueError('{} cars do not fit on {} lanes of {} rows'.format(numCars, numLanes, roadRows))
+	counts = np.minimum(rng.multinomial(numCars, np.full(numLanes, 1.0 / numLanes)), capacity)
+	# cars drawn beyond a lane's capacity go to lanes with room
+	for _ in range(numCars - counts.sum()):
+		lane = rng.choice(np.flatnonzero(counts < capacity))
+		counts[lane] += 1
+
+	carsPos = np.empty((numCars, 2), dtype=int)
+	placed = 0
+	for lane in range(numLanes):
+		k = counts[lane]
+		carsPos[placed:placed + k, 0] = (firsts[lane] + _drawInterval(lengths[lane], k, spacing, rng)) % roadRows
+		carsPos[placed:placed + k, 1] = lane
+		placed += k
+	return carsPos[rng.permutation(numCars)]
+
+class ScenarioBank(object):
+	"""
+	Precomputed initial car positions, an int16 [size, numCars, 2] array of (row, lane) kept in
+	a .npy file and memory-mapped. The file name is a hash of the config fields that affect
+	placement, the bank size and the seed, so a bank is generated once per road layout and
+	shared by every run and process using it.
+	"""
+	KEYS = ('numCars', 'numLanes', 'canvasHeight', 'gridHeight', 'carHeightGrid', 'egoCarPos')
+
+	def __init__(self, config):
+		self.path = os.path.join(config.scenarioBankDir, 'scenarios_{}.npy'.format(self.key(config)))
+		if not os.path.exists(self.path):
+			self._generate(config)
+		self.carsPos = np.load(self.path, mmap_mode='r')
+
+	@classmethod
+	def key(cls, config):
+		fields = dict((name, getattr(config, name)) for name in cls.KEYS)
+		fields['size'] = config.scenarioBankSize
+		fields['seed'] = config.scenarioBankSeed
+		return hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()[:16]
+
+	def _generate(self, config):
+		# Imported here, the simulator itself loads banks
+		from TrafficSimulator import TrafficSimulator
+		plain = copy.copy(config)
+		plain.scenarioBankSize = 0
+		plain.renderMode = 'none'
+		rngState = np.random.get_state()
+		np.random.seed(config.scenarioBankSeed)
+		sim = TrafficSimulator(plain)
+		carsPos = np.empty((config.scenarioBankSize, config.numCars, 2), dtype=np.int16)
+		for i in range(config.scenarioBankSize):
+			sim.reset()
+			carsPos[i] = sim.carsPos
+		np.random.set_state(rngState)
+
+		if not os.path.exists(config.scenarioBankDir):
+			os.makedirs(config.scenarioBankDir)
+		# write then rename, so concurrent processes never load a partial bank
+		tmp = '{}.{}.tmp.npy'.format(self.path[:-len('.npy')], os.getpid())
+		np.save(tmp, carsPos)
+		os.replace(tmp, self.path)
+
+	def __len__(self):
+		return len(self.carsPos)
+
+	def __getitem__(self, idx):
+		return self.carsPos[idx]
@@ -0,0 +1,40 @@
+import numpy as np
+
+# Picklable policies that map a batch of padded states [B, state_length, state_history] to
+# actions. They draw from np.random, so seeding the process makes them reproducible.
+
+class RandomPolicy(object):
+	def __init__(self, numActions):
+		self.numActions = numActions
+
+	def get_actions(self, states):
+		return np.random.randint(self.numActions, size=len(states))
+
+class ConstantPolicy(object):
+	def __init__(self, action):
+		self.action = action
+
+	def get_actions(self, states):
+		return np.full(len(states), self.action, dtype=int)
+
+class GreedyPolicy(object):
+	# argmax of network.get_q_values, without touching np.random
+	def __init__(self, network):
+		self.network = network
+
+	def get_actions(self, states):
+		return self.network.get_best_actions(states)
+
+class EpsilonGreedyPolicy(object):
+	# Random action with probability eps, otherwise the argmax of network.get_q_values
+	def __init__(self, network, eps, numActions):
+		self.network = network
+		self.eps = eps
+		self.numActions = numActions
+
+	def get_actions(self, states):
+		explore = np.random.random(len(states)) < self.eps
+		randomActions = np.random.randint(self.numActions, size=len(states))
+		if explore.all():
+			return randomActions
+		return np.where(explore, randomActions, np.argmax(self.network.get_q_values(states), axis=1))
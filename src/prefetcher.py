@@ -0,0 +1,42 @@
+import threading
+import queue
+
+class BatchPrefetcher(object):
+	"""
+	Calls sample_fn on a background thread and keeps up to depth of its results in a
+	bounded queue, so the next minibatches are gathered while the current train_op runs.
+	An exception raised by sample_fn is re-raised by the next get().
+	"""
+	def __init__(self, sample_fn, depth):
+		self._sample_fn = sample_fn
+		self._queue = queue.Queue(maxsize=depth)
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self):
+		while not self._stop.is_set():
+			try:
+				item = (self._sample_fn(), None)
+			except Exception as e:
+				item = (None, e)
+			# poll so that close() is noticed while the queue is full
+			while not self._stop.is_set():
+				try:
+					self._queue.put(item, timeout=0.1)
+					break
+				except queue.Full:
+					pass
+			if item[1] is not None:
+				return
+
+	def get(self):
+		batch, error = self._queue.get()
+		if error is not None:
+			raise error
+		return batch
+
+	def close(self):
+		self._stop.set()
+		self._thread.join()
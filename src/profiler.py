@@ -0,0 +1,105 @@
+import csv
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class _NullTimer(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+_NULL_TIMER = _NullTimer()
+
+class Profiler(object):
+	"""
+	Scoped phase timers and event counters, aggregated in memory and written out by flush().
+	Each flush appends one record for the window since the previous flush: seconds and calls
+	per phase, count and rate per counter, and the replay ratio (updates / env_steps) since
+	the start. Records go to a .jsonl file (one object per line) or, for any other extension,
+	a CSV of (step, key, value) rows, and to a TF summary writer if one is attached.
+
+	When disabled, timer() returns a shared no-op context manager and count() returns
+	immediately, so instrumented code pays about one method call per site.
+	"""
+	def __init__(self, enabled=False, path=None):
+		self.enabled = enabled
+		self.path = path
+		self.summary_writer = None # tf.summary.FileWriter, set by the model when available
+		self._lock = threading.Lock()
+		self._times = {}
+		self._calls = {}
+		self._counts = {}
+		self._totals = {}
+		self._window_start = time.time()
+
+	def timer(self, name):
+		if not self.enabled:
+			return _NULL_TIMER
+		return self._timer(name)
+
+	@contextmanager
+	def _timer(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			with self._lock:
+				self._times[name] = self._times.get(name, 0.0) + elapsed
+				self._calls[name] = self._calls.get(name, 0) + 1
+
+	def count(self, name, n=1):
+		if not self.enabled:
+			return
+		with self._lock:
+			self._counts[name] = self._counts.get(name, 0) + n
+			self._totals[name] = self._totals.get(name, 0) + n
+
+	def flush(self, step):
+		# Returns the record of the window ending now, or None when disabled
+		if not self.enabled:
+			return None
+		now = time.time()
+		with self._lock:
+			elapsed = max(now - self._window_start, 1e-9)
+			record = {'step': step, 'elapsed': elapsed}
+			for name in sorted(self._times):
+				record['time/' + name] = self._times[name]
+				record['share/' + name] = self._times[name] / elapsed
+				record['calls/' + name] = self._calls[name]
+			for name in sorted(self._counts):
+				record['count/' + name] = self._counts[name]
+				record['rate/' + name] = self._counts[name] / elapsed
+			if self._totals.get('env_steps', 0) > 0:
+				record['replay_ratio'] = self._totals.get('updates', 0) / float(self._totals['env_steps'])
+			self._times, self._calls, self._counts = {}, {}, {}
+			self._window_start = now
+		self._write(record)
+		return record
+
+	def _write(self, record):
+		if self.path is not None:
+			directory = os.path.dirname(self.path)
+			if directory and not os.path.exists(directory):
+				os.makedirs(directory)
+			with open(self.path, 'a') as f:
+				if self.path.endswith('.jsonl'):
+					f.write(json.dumps(record) + '\n')
+				else:
+					writer = csv.writer(f)
+					for key, value in record.items():
+						if key != 'step':
+							writer.writerow([record['step'], key, value])
+		if self.summary_writer is not None:
+			import tensorflow as tf
+			values = [tf.Summary.Value(tag='profile/' + key, simple_value=float(value))
+				for key, value in record.items() if key != 'step']
+			self.summary_writer.add_summary(tf.Summary(value=values), record['step'])
+			self.summary_writer.flush()
+
+def make_profiler(config):
+	return Profiler(config.profile, config.profile_path)
@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import queue
+import threading
+import zipfile
+import numpy as np
+
+# Renderers receive the simulator grid after every simulated step. The simulators only call
+# them when one is attached, so render mode 'none' costs nothing on the hot path.
+
+class AsciiRenderer(object):
+	# Print the (flipped) grid, at most once every {{interval}} seconds
+	def __init__(self, interval=1.0, stream=None):
+		self.interval = interval
+		self.stream = stream if stream is not None else sys.stdout
+		self._last = None
+
+	def render(self, grid):
+		now = time.time()
+		if self._last is not None and now - self._last < self.interval:
+			return
+		self._last = now
+		self.stream.write(str(np.round(np.flip(grid, axis=0))) + '\n')
+		self.stream.write("=" * 87 + '\n')
+		self.stream.flush()
+
+	def close(self):
+		pass
+
+class RecordRenderer(object):
+	# Frames are copied into a bounded queue and written by a background thread as they arrive,
+	# so the simulator never blocks on I/O and memory stays bounded however long the run. Saved
+	# as a compressed .npz with one array 'frames_<k>' per chunk of chunkFrames frames (see
+	# loadFrames), complete up to the last chunk written if the process dies, or streamed to a
+	# video when the path has a video extension and imageio is installed, speeds up to peak
+	# mapped to 0 .. 255.
+	VIDEO_EXTS = ('.mp4', '.gif', '.avi')
+
+	def __init__(self, path, maxQueue=4096, scale=8, peak=80.0, chunkFrames=256):
+		self.path = path
+		self.scale = scale
+		self.peak = peak
+		self.chunkFrames = chunkFrames
+		self._isVideo = os.path.splitext(path)[1].lower() in self.VIDEO_EXTS
+		self._queue = queue.Queue(maxsize=maxQueue)
+		self._chunk = []
+		self._chunks = 0
+		self._video = None
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def render(self, grid):
+		self._queue.put(grid.astype(np.float16))
+
+	def _run(self):
+		while True:
+			frame = self._queue.get()
+			if frame is None:
+				break
+			if self._isVideo:
+				self._writeImage(frame)
+				continue
+			self._chunk.append(frame)
+			if len(self._chunk) == self.chunkFrames:
+				self._writeChunk()
+		if self._chunk:
+			self._writeChunk()
+		if self._video is not None:
+			self._video.close()
+
+	def _makeDirectory(self):
+		directory = os.path.dirname(self.path)
+		if directory and not os.path.exists(directory):
+			os.makedirs(directory)
+
+	def _writeChunk(self):
+		if self._chunks == 0:
+			self._makeDirectory()
+			if os.path.exists(self.path):
+				os.remove(self.path)
+		# reopened for every chunk, so that the archive's directory always lists the chunks written
+		with zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+			with archive.open('frames_{:06d}.npy'.format(self._chunks), 'w') as f:
+				np.lib.format.write_array(f, np.stack(self._chunk))
+		self._chunks += 1
+		self._chunk = []
+
+	def _writeImage(self, frame):
+		if self._video is None:
+			import imageio
+			self._makeDirectory()
+			self._video = imageio.get_writer(self.path)
+		image = np.clip(np.flip(frame, axis=0).astype(np.float32) / self.peak * 255, 0, 255).astype(np.uint8)
+		self._video.append_data(np.repeat(np.repeat(image, self.scale, axis=0), self.scale, axis=1))
+
+	def close(self):
+		if self._thread.is_alive():
+			self._queue.put(None)
+			self._thread.join()
+
+def makeRenderer(config):
+	mode = config.renderMode
+	if mode == 'none':
+		return None
+	elif mode == 'ascii':
+		return AsciiRenderer(config.renderInterval)
+	elif mode == 'record':
+		return RecordRenderer(config.renderPath, peak=max(config.egoTopSpeed, config.carTopSpeed))
+	raise ValueError("Unknown render mode: {}".format(mode))
+
+# Frames recorded by a RecordRenderer to a .npz, [frames, rows, lanes]
+def loadFrames(path):
+	with np.load(path) as f:
+		return np.concatenate([f[name] for name in sorted(f.files)])
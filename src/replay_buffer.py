@@ -1,37 +1,321 @@
+import os
+import json
+import threading
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from segment_tree import SumSegmentTree, MinSegmentTree
 
 class ReplayBuffer(object):
+	"""
+	Ring buffer storing every observation once. The [state_length, state_history+1] stack
+	of a transition is rebuilt at sample time by gathering its frames by index, with frames
+	from before the start of its episode zeroed (same padding as pad_state).
+	Public methods are thread-safe.
+	The last transition of an episode has no stored next state and is never sampled.
+
+	With config.n_step = n, transition t is sampled with the discounted sum of rewards t ..
+	t+k-1, the state at t+k and the discount gamma^k, where k = n or fewer steps when the
+	episode ends first. Returns and k are computed for whole episodes when they are stored.
+	"""
+	ARRAYS = ('frames', 'actions', 'rewards', 'returns', 'bootstrap', 'episode_start')
+
 	def __init__(self, size, config):
 		self.config = config
 		self.size = size
+		self.n_step = config.n_step
+		# discount of the bootstrapped value, by steps to the bootstrap state
+		self.discounts = config.gamma ** np.arange(config.n_step + 1)
 		self.last_idx = -1
-		self.history_size = 0
+		self.num_in_buffer = 0
+		# store / sample / update_priorities may be called from different threads
+		self.lock = threading.RLock()
 
-		self.states_stack = np.empty([self.size]+[self.config.state_length]+[self.config.state_history+1], dtype=np.float32)
-		self.actions = np.empty([self.size], dtype=np.int32)
-		self.rewards = np.empty([self.size], dtype=np.float32)
+		self.frames = self._array('frames', [self.size, self.config.state_length], self.config.buffer_dtype)
+		self.actions = self._array('actions', [self.size], np.int32)
+		self.rewards = self._array('rewards', [self.size], np.float32)
+		self.returns = self._array('returns', [self.size], np.float32)
+		self.bootstrap = self._array('bootstrap', [self.size], np.int16)
+		self.episode_start = self._array('episode_start', [self.size], bool)
+
+	def _array(self, name, shape, dtype):
+		return np.zeros(shape, dtype=dtype)
 
 	def store(self, states, actions, rewards):
-		for idx in range(len(actions)):
-			self.last_idx += 1
-			if self.last_idx == self.size:
-				self.last_idx = 0
-			self.actions[self.last_idx] = actions[idx]
-			self.rewards[self.last_idx] = rewards[idx]
-			
-			tmp = states[max(idx - self.config.state_history + 1, 0) : (idx + 2)]
-			tmp_state = np.concatenate([np.expand_dims(state, -1) for state in tmp], axis=-1)
-			self.states_stack[self.last_idx] = np.pad(tmp_state, ((0,0),(self.config.state_history+1-tmp_state.shape[-1],0)), 'constant', constant_values=0)
-			self.history_size += 1
+		# One episode: states[t] is observed before actions[t] is taken and rewards[t] received
+		n = len(actions)
+		self.store_episodes(np.asarray(states[:n])[None], np.asarray(actions)[None], np.asarray(rewards)[None])
 
-	def sample(self, batch_size):
-		idx = np.arange(min(self.size, self.history_size))
-		np.random.shuffle(idx)
-		idx_choice = idx[:batch_size]
+	def store_episodes(self, states, actions, rewards):
+		# E episodes of T steps as arrays: states [E, >= T, state_length], actions and rewards [E, T].
+		# Written with one slice copy per array (two when wrapping around). Of a batch larger than
+		# the buffer, only the last size transitions are kept
+		with self.lock:
+			E, T = np.shape(actions)
+			starts = np.zeros((E, T), dtype=bool)
+			starts[:, 0] = True
+			returns, bootstrap = self.nstep_returns(rewards)
+			n = self._put(self.frames, np.asarray(states)[:, :T].reshape(E * T, -1))
+			self._put(self.actions, np.reshape(actions, E * T))
+			self._put(self.rewards, np.reshape(rewards, E * T))
+			self._put(self.returns, returns.reshape(E * T))
+			self._put(self.bootstrap, bootstrap.reshape(E * T))
+			self._put(self.episode_start, starts.reshape(E * T))
+			self.last_idx = (self.last_idx + n) % self.size
+			self.num_in_buffer = min(self.size, self.num_in_buffer + n)
+
+	def _put(self, array, values):
+		# Copy the last size values to the slots after last_idx, returns how many were copied
+		values = values[-self.size:]
+		start = (self.last_idx + 1) % self.size
+		head = min(len(values), self.size - start)
+		array[start:start + head] = values[:head]
+		array[:len(values) - head] = values[head:]
+		return len(values)
+
+	def nstep_returns(self, rewards):
+		# rewards [E, T] -> n-step returns and steps to the bootstrap state, [E, T] each. The last
+		# transition of an episode is never sampled, its reward is left out of all returns
+		E, T = np.shape(rewards)
+		n = self.n_step
+		padded = np.zeros((E, T + n - 1))
+		padded[:, :T - 1] = np.asarray(rewards)[:, :T - 1]
+		returns = sliding_window_view(padded, n, axis=1) @ self.discounts[:n]
+		bootstrap = np.broadcast_to(np.minimum(n, T - 1 - np.arange(T)), (E, T))
+		return returns, bootstrap
+
+	def get_state(self):
+		# Copy of the stored transitions and the write cursor, for checkpoints. Until the buffer
+		# wraps around, only its first num_in_buffer slots are in use
+		with self.lock:
+			n = self.num_in_buffer
+			state = dict((name, getattr(self, name)[:n].copy()) for name in self.ARRAYS)
+			state['last_idx'] = int(self.last_idx)
+			state['num_in_buffer'] = n
+			return state
+
+	def set_state(self, state):
+		with self.lock:
+			n = state['num_in_buffer']
+			for name in self.ARRAYS:
+				array = getattr(self, name)
+				array[:n] = state[name]
+				array[n:] = 0
+			self.last_idx = state['last_idx']
+			self.num_in_buffer = n
 
-		states = self.states_stack[idx_choice][:,:,:-1]
-		states_p = self.states_stack[idx_choice][:,:,1:]
+	def max_sample_age(self):
+		# Transitions more than this many slots before last_idx have lost frames of their history
+		return self.num_in_buffer - self.config.state_history
+
+	def sample_idx(self, batch_size):
+		# Uniform over transitions whose next frame is stored and in the same episode, and whose
+		# history has not been overwritten yet. O(batch_size)
+		max_age = self.max_sample_age()
+		assert max_age >= 1
+		idx = np.empty(batch_size, dtype=np.int64)
+		todo = np.arange(batch_size)
+		while len(todo) > 0:
+			age = np.random.randint(1, max_age + 1, size=len(todo))
+			cand = (self.last_idx - age) % self.size
+			ok = ~self.episode_start[(cand + 1) % self.size]
+			idx[todo[ok]] = cand[ok]
+			todo = todo[~ok]
+		return idx
+
+	def encode_stacks(self, last, length):
+		# Single gather of frames last-length+1 .. last, as [batch, state_length, length]
+		offsets = np.arange(length) - (length - 1)
+		frame_idx = (last[:, None] + offsets) % self.size
+		age = ((self.last_idx - last) % self.size)[:, None] - offsets
+		starts = self.episode_start[frame_idx]
+		# a frame is kept if it is stored and no later frame of the stack starts a new episode
+		later_starts = np.cumsum(starts[:, ::-1], axis=1)[:, ::-1] - starts
+		keep = (later_starts == 0) & (age < self.num_in_buffer)
+		stacks = self.frames[frame_idx].astype(np.float32)
+		stacks *= keep[:, :, None]
+		return np.transpose(stacks, (0, 2, 1))
+
+	def encode_sample(self, idx_choice):
+		history = self.config.state_history
+		bootstrap = self.bootstrap[idx_choice]
+		if self.n_step == 1:
+			# state and next state overlap, one gather for both
+			stacks = self.encode_stacks((idx_choice + 1) % self.size, history + 1)
+			states = stacks[:,:,:-1]
+			states_p = stacks[:,:,1:]
+		else:
+			states = self.encode_stacks(idx_choice, history)
+			states_p = self.encode_stacks((idx_choice + bootstrap) % self.size, history)
 		actions = self.actions[idx_choice]
-		rewards = self.rewards[idx_choice]
+		returns = self.returns[idx_choice]
+		discounts = self.discounts[bootstrap].astype(np.float32)
+
+		return (states, states_p, actions, returns, discounts)
+
+	def sample(self, batch_size):
+		with self.lock:
+			return self.encode_sample(self.sample_idx(batch_size))
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+	"""
+	Proportional prioritized replay: transition i is sampled with probability p_i^alpha / sum_j p_j^alpha,
+	using a sum tree, and comes with its normalized importance-sampling weight (N * P(i))^-beta.
+	New transitions get the max priority seen so far. Transitions that cannot be sampled
+	(last of an episode, or history overwritten) have priority 0.
+	"""
+	def __init__(self, size, config):
+		super(PrioritizedReplayBuffer, self).__init__(size, config)
+		self.alpha = config.prioritized_alpha
+		self.eps = config.prioritized_eps
+		self.max_priority = 1.0
+		self._it_sum = SumSegmentTree(size)
+		self._it_min = MinSegmentTree(size)
+
+	def _set_priorities(self, idx, priorities):
+		self._it_sum[idx] = priorities
+		self._it_min[idx] = np.where(priorities > 0, priorities, np.inf)
+
+	def store_episodes(self, states, actions, rewards):
+		with self.lock:
+			super(PrioritizedReplayBuffer, self).store_episodes(states, actions, rewards)
+			E, T = np.shape(actions)
+			n = min(E * T, self.size)
+			idx = (self.last_idx - n + 1 + np.arange(n)) % self.size
+			priorities = np.full((E, T), self.max_priority ** self.alpha)
+			priorities[:, -1] = 0.0
+			self._set_priorities(idx, priorities.reshape(E * T)[-n:])
+			# the oldest transitions' history has been overwritten, same rule as sample_idx
+			age = np.arange(max(self.max_sample_age(), 0) + 1, self.num_in_buffer)
+			self._set_priorities((self.last_idx - age) % self.size, np.zeros(len(age)))
+
+	def get_state(self):
+		with self.lock:
+			state = super(PrioritizedReplayBuffer, self).get_state()
+			state['it_sum'] = self._it_sum._value.copy()
+			state['it_min'] = self._it_min._value.copy()
+			state['max_priority'] = self.max_priority
+			return state
+
+	def set_state(self, state):
+		with self.lock:
+			super(PrioritizedReplayBuffer, self).set_state(state)
+			self._it_sum._value[:] = state['it_sum']
+			self._it_min._value[:] = state['it_min']
+			self.max_priority = state['max_priority']
+
+	def sample_idx(self, batch_size):
+		total = self._it_sum.sum()
+		if total <= 0:
+			raise ValueError('No transition of the replay buffer can be sampled yet')
+		idx = np.empty(batch_size, dtype=np.int64)
+		todo = np.arange(batch_size)
+		while len(todo) > 0:
+			mass = np.random.random(len(todo)) * total
+			cand = self._it_sum.find_prefixsum_idx(mass)
+			# float rounding can land on an empty leaf, draw again
+			ok = (cand < self.size) & (self._it_sum[np.minimum(cand, self.size - 1)] > 0)
+			idx[todo[ok]] = cand[ok]
+			todo = todo[~ok]
+		return idx
+
+	def sample(self, batch_size, beta):
+		with self.lock:
+			idx = self.sample_idx(batch_size)
+			total = self._it_sum.sum()
+			p_min = self._it_min.min() / total
+			max_weight = (p_min * self.num_in_buffer) ** (-beta)
+			weights = (self._it_sum[idx] / total * self.num_in_buffer) ** (-beta) / max_weight
+			return self.encode_sample(idx) + (weights.astype(np.float32), idx)
+
+	def update_priorities(self, idx, td_errors):
+		with self.lock:
+			priorities = np.abs(td_errors) + self.eps
+			# leave unsampleable slots at 0, in case they were overwritten since sampling
+			self._set_priorities(idx, np.where(self._it_sum[idx] > 0, priorities ** self.alpha, 0.0))
+			self.max_priority = max(self.max_priority, np.max(priorities))
+
+class MemmapReplayBuffer(ReplayBuffer):
+	"""
+	ReplayBuffer whose arrays are .npy files memory-mapped from directory, so it can be larger
+	than RAM and survives the process. The write cursor is kept in meta.json, rewritten
+	atomically after every store, and an existing buffer is reopened as is.
+
+	Its state for checkpoints is only the cursor, after flushing the arrays: set_state moves
+	the cursor back but keeps the arrays on disk, so transitions stored after the checkpoint
+	stay in the slots past the cursor until they are overwritten again.
+	"""
+	def __init__(self, size, config, directory):
+		self.directory = directory
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		meta = self._read_meta()
+		if meta is not None:
+			# stored returns depend on n_step and gamma
+			expected = {'size': size, 'state_length': config.state_length, 'dtype': np.dtype(config.buffer_dtype).name,
+				'n_step': config.n_step, 'gamma': config.gamma}
+			for key, value in expected.items():
+				if meta.get(key) != value:
+					raise ValueError('Replay buffer in {} has {} = {}, expected {}'.format(directory, key, meta.get(key), value))
+		self._reopen = meta is not None
+		super(MemmapReplayBuffer, self).__init__(size, config)
+		if meta is not None:
+			self.last_idx = meta['last_idx']
+			self.num_in_buffer = meta['num_in_buffer']
+
+	def _array(self, name, shape, dtype):
+		path = os.path.join(self.directory, name + '.npy')
+		if self._reopen:
+			return np.load(path, mmap_mode='r+')
+		return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+
+	def _read_meta(self):
+		path = os.path.join(self.directory, 'meta.json')
+		if not os.path.exists(path):
+			return None
+		with open(path) as f:
+			return json.load(f)
+
+	def flush(self):
+		for name in self.ARRAYS:
+			getattr(self, name).flush()
+		meta = {'size': self.size, 'state_length': self.config.state_length,
+			'dtype': self.frames.dtype.name, 'n_step': self.n_step, 'gamma': self.config.gamma,
+			'last_idx': int(self.last_idx), 'num_in_buffer': int(self.num_in_buffer)}
+		tmp = os.path.join(self.directory, 'meta.json.tmp')
+		with open(tmp, 'w') as f:
+			json.dump(meta, f)
+		os.replace(tmp, os.path.join(self.directory, 'meta.json'))
+
+	def store_episodes(self, states, actions, rewards):
+		with self.lock:
+			super(MemmapReplayBuffer, self).store_episodes(states, actions, rewards)
+			self.flush()
+
+	def get_state(self):
+		with self.lock:
+			self.flush()
+			return {'last_idx': int(self.last_idx), 'num_in_buffer': int(self.num_in_buffer)}
+
+	def set_state(self, state):
+		with self.lock:
+			if 'frames' in state:
+				# copied from an in-memory buffer
+				super(MemmapReplayBuffer, self).set_state(state)
+			else:
+				self.last_idx = state['last_idx']
+				self.num_in_buffer = state['num_in_buffer']
+			self.flush()
+
+	def sample_idx(self, batch_size):
+		# sorted indices so that a batch is paged in with mostly sequential reads
+		return np.sort(super(MemmapReplayBuffer, self).sample_idx(batch_size))
 
-		return (states, states_p, actions, rewards)
\ No newline at end of file
+def make_replay_buffer(config):
+	if config.buffer_dir is not None:
+		if config.prioritized_replay:
+			raise ValueError('Prioritized replay keeps its priorities in memory and does not support buffer_dir')
+		return MemmapReplayBuffer(config.buffer_size, config, config.buffer_dir)
+	if config.prioritized_replay:
+		return PrioritizedReplayBuffer(config.buffer_size, config)
+	return ReplayBuffer(config.buffer_size, config)
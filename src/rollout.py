@@ -0,0 +1,42 @@
+import numpy as np
+
+from VecTrafficSimulator import makeBatchSimulator
+
+class BatchRollout(object):
+	"""
+	Runs many episodes in lockstep on a batch simulator (VecTrafficSimulator, or
+	TrafficSimulatorBatch for few roads, see makeBatchSimulator). At every timestep the padded
+	states of all episodes are stacked into one [B, state_length, state_history] batch and
+	actions_fn picks the actions of the whole batch in a single call.
+	"""
+	def __init__(self, config, num_envs, seed=None):
+		self._config = config
+		seed = np.random.randint(2**31 - 1) if seed is None else seed
+		self._sim = makeBatchSimulator(config, num_envs, seed)
+		self.num_envs = num_envs
+
+	# State of the simulator's random generator, the only state kept between runs
+	def get_state(self):
+		return self._sim.rng.get_state()
+
+	def set_state(self, state):
+		self._sim.rng.set_state(state)
+
+	def run(self, T, actions_fn):
+		K = self.num_envs
+		state_length, state_history = self._config.state_length, self._config.state_history
+		states = np.empty((K, T, state_length), dtype=np.float32)
+		actions = np.empty((K, T), dtype=np.int32)
+		rewards = np.empty((K, T), dtype=np.float32)
+		# zero-padded history, same layout as model.pad_state
+		stack = np.zeros((K, state_length, state_history), dtype=np.float32)
+
+		self._sim.reset()
+		for t in range(T):
+			state = self._sim.state()
+			states[:, t] = state
+			stack[:, :, :-1] = stack[:, :, 1:]
+			stack[:, :, -1] = state
+			actions[:, t] = actions_fn(stack)
+			rewards[:, t] = self._sim.step(actions[:, t])
+		return (states, actions, rewards)
@@ -6,8 +6,15 @@ class LinearSchedule(object):
 		self._nsteps = nsteps
 
 	def update(self, t):
-		alpha = 1.0 * t / self._nsteps
-		self._epsilon = max(alpha*self._eps_end+(1-alpha)*self._eps_begin, self._eps_end)
+		# works for increasing schedules too (e.g. the prioritized replay beta)
+		alpha = min(1.0 * t / self._nsteps, 1.0)
+		self._epsilon = alpha*self._eps_end+(1-alpha)*self._eps_begin
 
 	def get_epsilon(self):
-		return self._epsilon
\ No newline at end of file
+		return self._epsilon
+
+	def get_state(self):
+		return {'epsilon': self._epsilon}
+
+	def set_state(self, state):
+		self._epsilon = state['epsilon']
\ No newline at end of file
@@ -0,0 +1,56 @@
+import numpy as np
+
+class SegmentTree(object):
+	"""
+	Array-backed binary segment tree over a power-of-two number of leaves. Updates and
+	queries take a whole batch of indices at once and walk the tree one level at a time,
+	so a batch costs O(batch * log n) with only O(log n) NumPy calls.
+	"""
+	def __init__(self, capacity, operation, neutral_element):
+		self.capacity = 1
+		while self.capacity < capacity:
+			self.capacity *= 2
+		self._operation = operation
+		self._neutral = neutral_element
+		self._value = np.full(2 * self.capacity, neutral_element, dtype=np.float64)
+
+	def __setitem__(self, idx, val):
+		idx = np.atleast_1d(np.asarray(idx, dtype=np.int64)) + self.capacity
+		if len(idx) == 0:
+			return
+		self._value[idx] = val
+		idx = np.unique(idx // 2)
+		while idx[0] >= 1:
+			self._value[idx] = self._operation(self._value[2 * idx], self._value[2 * idx + 1])
+			idx = np.unique(idx // 2)
+
+	def __getitem__(self, idx):
+		return self._value[np.asarray(idx, dtype=np.int64) + self.capacity]
+
+	def reduce(self):
+		return self._value[1]
+
+class SumSegmentTree(SegmentTree):
+	def __init__(self, capacity):
+		super(SumSegmentTree, self).__init__(capacity, np.add, 0.0)
+
+	def sum(self):
+		return self.reduce()
+
+	def find_prefixsum_idx(self, prefixsum):
+		# For each prefixsum, the highest leaf i such that sum(leaves[:i]) <= prefixsum
+		prefixsum = np.array(prefixsum, dtype=np.float64)
+		idx = np.ones(len(prefixsum), dtype=np.int64)
+		while idx[0] < self.capacity:
+			left = self._value[2 * idx]
+			go_right = prefixsum >= left
+			prefixsum -= np.where(go_right, left, 0.0)
+			idx = 2 * idx + go_right
+		return idx - self.capacity
+
+class MinSegmentTree(SegmentTree):
+	def __init__(self, capacity):
+		super(MinSegmentTree, self).__init__(capacity, np.minimum, np.inf)
+
+	def min(self):
+		return self.reduce()
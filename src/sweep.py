@@ -0,0 +1,249 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import numpy as np
+
+from config import Config
+
+# Hyperparameter sweeps over Config fields. A search space maps field names to a list of
+# values, or for random search to a distribution {'uniform': [low, high]}, {'loguniform':
+# [low, high]} or {'randint': [low, high]} (high excluded):
+#
+#   python sweep.py --space '{"lr_begin": [5e-5, 1e-4], "gamma": [0.95, 0.99]}'
+#   python sweep.py --space space.json --random 20 --workers 8
+#
+# Trials run on a process pool, each one pinned to a CPU core of its own. Every result is cached
+# under a hash of the full trial config and of the source files, so rerunning a sweep, or a
+# sweep overlapping an earlier one, only runs the new trials. Trials report intermediate
+# evaluation rewards and stop early when they fall below the median of the other trials at
+# the same step (median stopping rule).
+
+DISTRIBUTIONS = ('uniform', 'loguniform', 'randint')
+
+def grid_trials(space):
+	# Every combination of the listed values, as a list of {field: value}
+	names = sorted(space)
+	for name in names:
+		if not isinstance(space[name], list):
+			raise ValueError('Grid search needs a list of values for {}, got {}'.format(name, space[name]))
+	return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+def _draw(spec, rng):
+	if isinstance(spec, list):
+		return spec[rng.randint(len(spec))]
+	(kind, (low, high)), = spec.items()
+	if kind == 'uniform':
+		return float(rng.uniform(low, high))
+	if kind == 'loguniform':
+		return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+	if kind == 'randint':
+		return int(rng.randint(low, high))
+	raise ValueError('Unknown distribution {}, expected a list or one of {}'.format(kind, DISTRIBUTIONS))
+
+def random_trials(space, num_trials, seed=0):
+	rng = np.random.RandomState(seed)
+	names = sorted(space)
+	return [dict((name, _draw(space[name], rng)) for name in names) for _ in range(num_trials)]
+
+def make_config(overrides):
+	config = Config().update(overrides)
+	# workers of a sweep are daemonic processes, which cannot start pools of their own
+	config.num_workers = 1
+	return config
+
+def code_version(directory=None):
+	# Hash of the .py files next to this one
+	directory = os.path.dirname(os.path.abspath(__file__)) if directory is None else directory
+	digest = hashlib.sha1()
+	for name in sorted(os.listdir(directory)):
+		if name.endswith('.py'):
+			with open(os.path.join(directory, name), 'rb') as f:
+				digest.update(name.encode() + b'\0' + f.read())
+	return digest.hexdigest()
+
+def config_key(config, version):
+	fields = json.dumps(vars(config), sort_keys=True, default=str)
+	return hashlib.sha1((version + fields).encode()).hexdigest()[:16]
+
+def train_dqn(config, report):
+	# Objective of a trial: train a DQN, evaluating its greedy policy every eval_freq steps on
+	# eval_min_episodes episodes, then on N episodes at the end. Returns the final mean reward,
+	# or the last intermediate one when report() stopped the trial
+	import tensorflow as tf
+	from dqn_model import DQN
+	from evaluation import Evaluator
+	tf.reset_default_graph()
+	model = DQN(config)
+	model.initialize()
+	evaluator = Evaluator(config, 1, 0)
+	last = [None]
+	def callback(t, model):
+		last[0] = evaluator.evaluate(model.get_policy(0.0), config.eval_min_episodes, config.T, log_freq=0)['mean']
+		return report(t, last[0])
+	if model.train(callback):
+		return last[0]
+	return evaluator.evaluate(model.get_policy(0.0), config.N, config.T, log_freq=0)['mean']
+
+_worker = {}
+
+def _init_worker(free_cores, history, lock, min_trials):
+	_worker.update(free_cores=free_cores, history=history, lock=lock, min_trials=min_trials)
+
+def _report(trial, step, reward):
+	# Record an intermediate reward, True if the trial should stop
+	trial['reports'].append((step, reward))
+	history, lock = _worker['history'], _worker['lock']
+	if history is None:
+		return False
+	with lock:
+		others = history.get(step, [])
+		history[step] = others + [reward]
+	trial['stopped_early'] = len(others) >= _worker['min_trials'] and reward < np.median(others)
+	return trial['stopped_early']
+
+def _run_trial(args):
+	# Pinned for the trial to a core claimed from the free cores and given back after it, so
+	# running trials never share a core while another is idle
+	free_cores = _worker['free_cores']
+	core = free_cores.get() if free_cores is not None else None
+	try:
+		if core is not None:
+			os.sched_setaffinity(0, [core])
+		return _run_pinned_trial(*args)
+	finally:
+		if core is not None:
+			free_cores.put(core)
+
+def _run_pinned_trial(key, overrides, config, objective, path):
+	np.random.seed(int(key[:8], 16))
+	result = {'key': key, 'overrides': overrides, 'reports': [], 'stopped_early': False}
+	start = time.time()
+	result['reward'] = objective(config, lambda step, reward: _report(result, step, reward))
+	result['seconds'] = time.time() - start
+	# write then rename, an interrupted sweep never leaves a partial result
+	tmp = '{}.{}.tmp'.format(path, os.getpid())
+	with open(tmp, 'w') as f:
+		json.dump(result, f, default=float)
+	os.replace(tmp, path)
+	return result
+
+class SweepRunner(object):
+	"""
+	Runs trials ({field: value} overrides of Config) with objective(config, report) on
+	num_workers processes, each running trial pinned to a core of its own (as long as there
+	are at least num_workers cores). report(step, reward) records an
+	intermediate reward and returns True when the trial should stop (median stopping rule,
+	once min_trials other trials reached that step; prune=False disables it). Results are
+	cached as <directory>/results/<key>.json and each trial writes its model outputs under
+	<directory>/trials/<key>.
+	"""
+	def __init__(self, directory, num_workers=1, objective=train_dqn, prune=True, min_trials=3):
+		self.directory = directory
+		self.num_workers = num_workers
+		self.objective = objective
+		self.prune = prune
+		self.min_trials = min_trials
+		self.version = code_version()
+
+	def _prepare(self, overrides):
+		config = make_config(overrides)
+		key = config_key(config, self.version)
+		# per-trial outputs, after hashing so that they do not change the key
+		trial_dir = os.path.join(self.directory, 'trials', key)
+		config.model_output = trial_dir
+		config.checkpoint_dir = os.path.join(trial_dir, 'checkpoints')
+		config.policy_path = os.path.join(trial_dir, 'policy.npz')
+		config.profile_path = os.path.join(trial_dir, 'profile.jsonl')
+		if config.buffer_dir is not None:
+			config.buffer_dir = os.path.join(trial_dir, 'buffer')
+		config.trace_dir = None
+		return key, config
+
+	def run(self, trials):
+		# Returns the results of all trials, best reward first and trials without a reward last
+		results_dir = os.path.join(self.directory, 'results')
+		if not os.path.exists(results_dir):
+			os.makedirs(results_dir)
+		results, todo = {}, {}
+		for overrides in trials:
+			key, config = self._prepare(overrides)
+			path = os.path.join(results_dir, key + '.json')
+			if os.path.exists(path):
+				with open(path) as f:
+					results[key] = json.load(f)
+			elif key not in todo:
+				todo[key] = (key, overrides, config, self.objective, path)
+		print('{} trials, {} cached, {} to run'.format(len(trials), len(results), len(todo)))
+
+		if todo:
+			self._run(list(todo.values()), list(results.values()), results)
+		ranked = sorted(results.values(), key=lambda result: float('inf') if result['reward'] is None else -result['reward'])
+		with open(os.path.join(self.directory, 'summary.json'), 'w') as f:
+			json.dump(ranked, f, indent=2, default=float)
+		return ranked
+
+	def _run(self, tasks, cached, results):
+		# spawn, so that workers never inherit a forked TensorFlow runtime
+		ctx = mp.get_context('spawn')
+		manager = ctx.Manager()
+		history, lock = None, manager.Lock()
+		if self.prune:
+			# cached trials count as the other trials of the stopping rule too
+			steps = {}
+			for result in cached:
+				for step, reward in result['reports']:
+					steps.setdefault(step, []).append(reward)
+			history = manager.dict(steps)
+		free_cores = None
+		if hasattr(os, 'sched_setaffinity'):
+			# one slot per worker, on distinct cores unless there are more workers than cores
+			cores = sorted(os.sched_getaffinity(0))
+			free_cores = manager.Queue()
+			for i in range(self.num_workers):
+				free_cores.put(cores[i % len(cores)])
+		pool = ctx.Pool(self.num_workers, initializer=_init_worker,
+			initargs=(free_cores, history, lock, self.min_trials), maxtasksperchild=1)
+		try:
+			for i, result in enumerate(pool.imap_unordered(_run_trial, tasks)):
+				results[result['key']] = result
+				sys.stdout.write('Trial {}/{} {} \t reward {} {}\n'.format(i + 1, len(tasks), result['overrides'],
+					result['reward'], '(stopped early)' if result['stopped_early'] else ''))
+				sys.stdout.flush()
+		finally:
+			pool.terminate()
+			pool.join()
+			manager.shutdown()
+
+def format_result(result):
+	# Reward and overrides of a trial, 'none' when its objective returned no reward
+	reward = '{:>10}'.format('none') if result['reward'] is None else '{:10.4f}'.format(result['reward'])
+	return '{} {}'.format(reward, result['overrides'])
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Hyperparameter sweep over Config fields')
+	parser.add_argument('--space', required=True, help='search space as JSON, or a JSON file')
+	parser.add_argument('--random', type=int, default=0, help='number of random trials, grid search if 0')
+	parser.add_argument('--seed', type=int, default=0, help='seed of the random search')
+	parser.add_argument('--workers', type=int, default=1, help='trials run in parallel, one core each')
+	parser.add_argument('--dir', default='../outputs/sweep', help='results cache and trial outputs')
+	parser.add_argument('--min-trials', type=int, default=3, help='other trials needed at a step before stopping one early')
+	parser.add_argument('--no-prune', action='store_true', help='never stop trials early')
+	args = parser.parse_args(argv)
+
+	if os.path.exists(args.space):
+		with open(args.space) as f:
+			space = json.load(f)
+	else:
+		space = json.loads(args.space)
+	trials = random_trials(space, args.random, args.seed) if args.random > 0 else grid_trials(space)
+	runner = SweepRunner(args.dir, args.workers, prune=not args.no_prune, min_trials=args.min_trials)
+	for result in runner.run(trials)[:10]:
+		print(format_result(result))
+
+if __name__ == '__main__':
+	main()
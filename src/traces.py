@@ -0,0 +1,232 @@
+import json
+import os
+import numpy as np
+
+from lane_index import LaneIndex
+from observation import ObservationBuilder
+
+# Episode traces. A trace directory holds trace.json, the road layout the episodes were
+# simulated on, and chunk-<n> directories of up to trace_chunk_episodes episodes of T steps.
+# Every column of a chunk is one .npy file, [episodes, T, ...], so chunks are memory-mapped
+# and read a column at a time. Step t holds the state observed before action t, the action,
+# the random actions of the other cars drawn by that progress() call, and its reward.
+COLUMNS = (
+	('ego_speed_frac', (), np.float32),
+	('ego_pos', (2,), np.int16),
+	('speed_history', ('actionSpeedHistory',), np.float32), # oldest first
+	('cars_pos', ('numCars', 2), np.int16),
+	('cars_speed_frac', ('numCars',), np.float32),
+	('car_actions', ('numCars',), np.uint8),
+	('actions', (), np.uint8),
+	('rewards', (), np.float32),
+)
+META_KEYS = ('numCars', 'numLanes', 'canvasHeight', 'gridHeight', 'carHeightGrid', 'decisionFreq',
+	'speedScaling', 'egoTopSpeed', 'carTopSpeed', 'actionSpeedHistory', 'T')
+
+def _meta(config):
+	return dict((key, getattr(config, key)) for key in META_KEYS)
+
+def _check_meta(directory, config):
+	with open(os.path.join(directory, 'trace.json')) as f:
+		meta = json.load(f)
+	for key, value in _meta(config).items():
+		if meta[key] != value:
+			raise ValueError('Trace in {} has {} = {}, expected {}'.format(directory, key, meta[key], value))
+
+def _chunks(directory):
+	names = [name for name in os.listdir(directory) if name.startswith('chunk-') and '.' not in name]
+	return [os.path.join(directory, name) for name in sorted(names)]
+
+class TraceWriter(object):
+	"""
+	Records episodes into a trace directory, appending to the chunks already there. Per step,
+	call observe(sim) before sim.progress() and step(sim, action, reward) after it. Episodes
+	are buffered until a chunk is full, then the chunk is written to a temporary directory and
+	renamed, so readers only ever see complete chunks. One writer per directory.
+	"""
+	def __init__(self, directory, config, chunk_episodes=100):
+		self.directory = directory
+		self.chunk_episodes = chunk_episodes
+		self.T = config.T
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		if os.path.exists(os.path.join(directory, 'trace.json')):
+			_check_meta(directory, config)
+		else:
+			with open(os.path.join(directory, 'trace.json'), 'w') as f:
+				json.dump(_meta(config), f, indent=2, sort_keys=True)
+		self._chunk = len(_chunks(directory))
+		self._columns = {}
+		for name, shape, dtype in COLUMNS:
+			shape = tuple(getattr(config, dim) if isinstance(dim, str) else dim for dim in shape)
+			self._columns[name] = np.zeros((chunk_episodes, self.T) + shape, dtype=dtype)
+		self._episode = 0
+		self._t = 0
+
+	def observe(self, sim):
+		e, t, columns = self._episode, self._t, self._columns
+		columns['ego_speed_frac'][e, t] = sim.EgoCarSpeedFrac
+		columns['ego_pos'][e, t] = sim.EgoCarPos
+		head = sim.speedHead
+		history = columns['speed_history'][e, t]
+		history[:len(history) - head] = sim.speedHistory[head:]
+		history[len(history) - head:] = sim.speedHistory[:head]
+		columns['cars_pos'][e, t] = sim.carsPos
+		columns['cars_speed_frac'][e, t] = sim.carsSpeedFrac
+
+	def step(self, sim, action, reward):
+		e, t, columns = self._episode, self._t, self._columns
+		columns['car_actions'][e, t] = sim.carAction
+		columns['actions'][e, t] = action
+		columns['rewards'][e, t] = reward
+		self._t += 1
+		if self._t == self.T:
+			self._t = 0
+			self._episode += 1
+			if self._episode == self.chunk_episodes:
+				self.flush()
+
+	def flush(self):
+		# Write the complete episodes buffered so far as a chunk
+		if self._episode == 0:
+			return
+		path = os.path.join(self.directory, 'chunk-{:06d}'.format(self._chunk))
+		tmp = '{}.tmp-{}'.format(path, os.getpid())
+		os.makedirs(tmp)
+		for name, column in self._columns.items():
+			np.save(os.path.join(tmp, name + '.npy'), column[:self._episode])
+		os.rename(tmp, path)
+		self._chunk += 1
+		self._episode = 0
+
+	def close(self):
+		# An episode in progress is dropped
+		self._t = 0
+		self.flush()
+
+class ReplayedState(object):
+	"""
+	Simulator state at one step of a traced episode, with the attributes ObservationBuilder
+	and the renderers read from a TrafficSimulator. The lane index is only built when used, with
+	cars on the same row ordered by id, so of two overlapping cars lidar may see the other one.
+	"""
+	def __init__(self, episode, t, config):
+		h = config.actionSpeedHistory
+		self.EgoCarTopSpeed = config.egoTopSpeed
+		self.EgoCarSpeedFrac = float(episode['ego_speed_frac'][t])
+		self.EgoCarPos = [int(x) for x in episode['ego_pos'][t]]
+		self.carsTopSpeed = np.full(config.numCars, config.carTopSpeed)
+		self.carsSpeedFrac = np.asarray(episode['cars_speed_frac'][t], dtype=np.float64)
+		self.carsPos = np.asarray(episode['cars_pos'][t], dtype=int)
+		self.carAction = np.asarray(episode['car_actions'][t], dtype=int)
+		# histories as ring arrays with the oldest entry at head 0
+		actions = episode['actions']
+		self.actionHistory = np.zeros(h)
+		self.actionHistory[max(h - t, 0):] = actions[max(t - h, 0):t]
+		self.speedHistory = np.array(episode['speed_history'][t], dtype=np.float64)
+		self.actionHead = 0
+		self.speedHead = 0
+		self.egoID = config.numCars
+		self._layout = (config.numLanes, config.canvasHeight // config.gridHeight, config.carHeightGrid)
+		self._index = None
+
+	@property
+	def index(self):
+		# Cars only, speeds are read from carsSpeedFrac
+		if self._index is None:
+			numLanes, gridRows, carHeight = self._layout
+			self._index = LaneIndex(numLanes, gridRows, carHeight)
+			for carID, (row, lane) in enumerate(self.carsPos):
+				self._index.insert(carID, lane, row)
+			self._index.insert(self.egoID, self.EgoCarPos[1], self.EgoCarPos[0])
+		return self._index
+
+	@property
+	def grid(self):
+		# Dense speed grid, written in car order with the ego car last (overlaps differ from the simulator's)
+		numLanes, gridRows, carHeight = self._layout
+		grid = np.zeros((gridRows, numLanes))
+		speeds = self.carsTopSpeed * self.carsSpeedFrac
+		for (row, lane), speed in zip(self.carsPos, speeds):
+			grid[max(row, 0):max(row + carHeight, 0), lane] = speed
+		row, lane = self.EgoCarPos
+		grid[row:row + carHeight, lane] = self.EgoCarTopSpeed * self.EgoCarSpeedFrac
+		return grid
+
+def replay(episode, config):
+	# ReplayedState of every step of an episode (dict of columns [T, ...]), without simulating
+	for t in range(len(episode['actions'])):
+		yield ReplayedState(episode, t, config)
+
+def observations(episode, config, builder=None):
+	# [T, state_length] float32 states of an episode, as TrafficSimulator.state() returned them.
+	# The vector feature is rebuilt with a few array operations for the whole episode, other
+	# features go through ObservationBuilder one step at a time
+	T = len(episode['actions'])
+	if list(config.observationFeatures) != ['vector']:
+		builder = ObservationBuilder(config) if builder is None else builder
+		states = np.empty((T, builder.length), dtype=np.float32)
+		for t, state in enumerate(replay(episode, config)):
+			states[t] = builder.write(state, np.empty(builder.length))
+		return states
+	h, n = config.actionSpeedHistory, config.numCars
+	states = np.empty((T, 3 + 2 * h + 3 * n), dtype=np.float32)
+	states[:, 0] = config.egoTopSpeed * episode['ego_speed_frac'].astype(np.float64)
+	states[:, 1:3] = episode['ego_pos']
+	# actions t - h .. t - 1, zeros before the episode
+	padded = np.concatenate([np.zeros(h), episode['actions']])
+	states[:, 3:3 + h] = np.lib.stride_tricks.sliding_window_view(padded, h)[:T]
+	states[:, 3 + h:3 + 2 * h] = episode['speed_history']
+	states[:, 3 + 2 * h:3 + 2 * h + n] = config.carTopSpeed * episode['cars_speed_frac'].astype(np.float64)
+	states[:, 3 + 2 * h + n:] = episode['cars_pos'].reshape(T, 2 * n)
+	return states
+
+class TraceReader(object):
+	# Memory-mapped access to the chunks of a trace directory, checked against config
+	def __init__(self, directory, config):
+		_check_meta(directory, config)
+		self.directory = directory
+		self.chunks = _chunks(directory)
+
+	def chunk(self, i):
+		# dict of memory-mapped [episodes, T, ...] columns
+		return dict((name, np.load(os.path.join(self.chunks[i], name + '.npy'), mmap_mode='r'))
+			for name, _, _ in COLUMNS)
+
+	def episodes(self, chunk):
+		columns = self.chunk(chunk)
+		for e in range(len(columns['actions'])):
+			yield dict((name, column[e]) for name, column in columns.items())
+
+class TraceStream(object):
+	"""
+	Endless stream of the episodes of a trace directory, for offline training. Every pass
+	visits the chunks in a new random order, and the episodes of a chunk in random order,
+	with one memory-mapped chunk open at a time, so memory stays bounded whatever the size of
+	the trace. fill() stores the next episodes into a replay buffer, which then holds a moving
+	window of the trace. Chunks written while streaming are picked up by the next pass.
+	"""
+	def __init__(self, directory, config, seed=None):
+		self._config = config
+		self._reader = TraceReader(directory, config)
+		self._builder = ObservationBuilder(config)
+		self._rng = np.random.RandomState(seed)
+		self._episodes = self._stream()
+
+	def _stream(self):
+		while True:
+			self._reader.chunks = _chunks(self._reader.directory)
+			if len(self._reader.chunks) == 0:
+				raise ValueError('No trace chunks in {}'.format(self._reader.directory))
+			for chunk in self._rng.permutation(len(self._reader.chunks)):
+				columns = self._reader.chunk(chunk)
+				for e in self._rng.permutation(len(columns['actions'])):
+					yield dict((name, np.asarray(column[e])) for name, column in columns.items())
+
+	def next_episode(self):
+		return next(self._episodes)
+
+	def fill(self, buffer, num_episodes):
+		for _ in range(num_episodes):
+			episode = self.next_episode()
+			buffer.store(observations(episode, self._config, self._builder), episode['actions'], episode['rewards'])
@@ -0,0 +1,57 @@
+from actor_learner import ActorLearner
+from config import Config
+from policies import RandomPolicy
+from profiler import Profiler
+from replay_buffer import make_replay_buffer
+from schedule import LinearSchedule
+
+class FakeModel(object):
+	# what ActorLearner uses of a model, recording the counters at every train_step
+	def __init__(self, config):
+		self._config = config
+		self._bf = make_replay_buffer(config)
+		self._profiler = Profiler()
+		self._total_loss = 0.0
+		self._lr_schedule = LinearSchedule(1e-3, 1e-4, 100)
+		self._eps_schedule = LinearSchedule(1.0, 0.1, 100)
+		self._beta_schedule = LinearSchedule(0.4, 1.0, 100)
+		self.learner = None
+		self.steps = []
+		self.policies = 0
+
+	def get_policy(self):
+		self.policies += 1
+		return RandomPolicy(self._config.numActions)
+
+	def train_step(self, t, batch_size, lr):
+		self._bf.sample(batch_size)
+		self.steps.append((t, self.learner.updates, self.learner.env_steps, self._bf.num_in_buffer))
+		self._total_loss += 1.0
+
+def make_config(**overrides):
+	config = Config().update({'T': 10, 'num_workers': 1, 'replay_ratio': 0.5, 'actor_round': 2,
+		'actor_max_ahead': 60, 'actor_refresh_freq': 10, 'print_freq': 1000, 'profile_freq': 1000,
+		'batch_size': 8, 'buffer_size': 1000})
+	return config.update(overrides)
+
+def test_learner_keeps_the_replay_ratio():
+	config = make_config()
+	model = FakeModel(config)
+	learner = model.learner = ActorLearner(model)
+	assert not learner.run(40)
+	assert [step[0] for step in model.steps] == list(range(1, 41))
+	for t, updates, env_steps, num_in_buffer in model.steps:
+		assert num_in_buffer > config.batch_size
+		assert updates < config.replay_ratio * env_steps
+	# the actors stop a round past actor_max_ahead
+	assert learner.env_steps - learner.updates / config.replay_ratio < config.actor_max_ahead + config.actor_round * config.T
+	assert model.policies == 1 + 40 // config.actor_refresh_freq
+
+def test_callback_stops_training():
+	config = make_config(eval_freq=5)
+	model = FakeModel(config)
+	model.learner = ActorLearner(model)
+	calls = []
+	assert model.learner.run(100, start=10, callback=lambda t, m: calls.append(t) or t >= 20)
+	assert calls == [15, 20]
+	assert model.steps[-1][:2] == (20, 9)
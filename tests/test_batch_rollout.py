@@ -0,0 +1,42 @@
+import numpy as np
+
+from config import Config
+from model_base import model
+from rollout import BatchRollout
+
+class FirstActionModel(model):
+	# greedy action from the first features of the newest state, recording every batch
+	def __init__(self, config):
+		super(FirstActionModel, self).__init__(config)
+		self.batches = []
+
+	def get_best_actions(self, states):
+		self.batches.append(states.copy())
+		return np.argmax(states[:, :self._config.numActions, -1], axis=1)
+
+def test_stacked_histories_match_pad_state():
+	config = Config().update({'state_history': 3})
+	padder = model(config)
+	stacks = []
+	def actions_fn(stack):
+		stacks.append(stack.copy())
+		return np.random.randint(config.numActions, size=len(stack))
+	states, actions, rewards = BatchRollout(config, 4, seed=0).run(6, actions_fn)
+	assert states.shape == (4, 6, config.state_length) and actions.shape == rewards.shape == (4, 6)
+	for t, stack in enumerate(stacks):
+		for e in range(4):
+			history = list(states[e, max(0, t - 2):t + 1])
+			np.testing.assert_array_equal(stack[e], padder.pad_state(history, 3)[0])
+
+def test_one_inference_call_per_timestep():
+	config = Config().update({'rollout_batch': 4, 'T': 5})
+	m = FirstActionModel(config)
+	states, rewards, actions = m.simulate_episodes(10, 5, 0.0)
+	assert states.shape == (10, 5, config.state_length) and rewards.shape == actions.shape == (10, 5)
+	# chunks of 4, 4 and 2 episodes
+	assert [len(batch) for batch in m.batches] == [4] * 5 + [4] * 5 + [2] * 5
+	np.testing.assert_array_equal(actions, np.argmax(states[:, :, :config.numActions], axis=2))
+	# fully exploring batches never run the network
+	m.batches = []
+	m.simulate_episodes(4, 5, 1.0)
+	assert m.batches == []
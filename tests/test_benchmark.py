@@ -0,0 +1,32 @@
+import json
+import pytest
+
+import benchmark
+
+def test_compare_flags_slowdowns(capsys):
+	baseline = {'a': 100.0, 'b': 100.0, 'c': 100.0, 'old': 1.0}
+	results = {'a': 95.0, 'b': 80.0, 'c': 150.0, 'new': 1.0}
+	assert benchmark.compare(results, baseline, 0.1) == ['b']
+	assert 'REGRESSION' in capsys.readouterr().out
+
+def test_run_reports_rates():
+	report = benchmark.run(['state', 'numpy_q'], 0.01, quick=True)
+	results = report['results']
+	assert 'state/state_per_s' in results and 'numpy_q/load_per_s' in results
+	assert len([key for key in results if key.startswith('numpy_q/batch=')]) == 3
+	assert all(rate > 0 for rate in results.values())
+	assert report['meta']['min_time'] == 0.01
+
+def test_main_exits_on_regression(tmp_path):
+	out = str(tmp_path / 'baseline.json')
+	benchmark.main(['--suites', 'state', '--min-time', '0.01', '--out', out])
+	with open(out) as f:
+		report = json.load(f)
+	# a baseline no run can reach
+	for key in report['results']:
+		report['results'][key] *= 1e6
+	with open(out, 'w') as f:
+		json.dump(report, f)
+	with pytest.raises(SystemExit) as exit:
+		benchmark.main(['--suites', 'state', '--min-time', '0.01', '--compare', out])
+	assert exit.value.code == 1
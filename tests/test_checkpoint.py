@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pytest
+
+from checkpoint import CheckpointManager
+from config import Config
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, MemmapReplayBuffer
+
+def random_episodes(config, E, T, seed=0):
+	rng = np.random.RandomState(seed)
+	states = rng.random_sample((E, T, config.state_length)).astype(np.float32)
+	actions = rng.randint(config.numActions, size=(E, T))
+	rewards = rng.random_sample((E, T)).astype(np.float32)
+	return states, actions, rewards
+
+def test_checkpoint_round_trip(tmpdir):
+	manager = CheckpointManager(str(tmpdir), keep=2)
+	for step in range(1, 5):
+		manager.save(step, {'variables': {'w': np.arange(step)}, 'buffer': np.zeros(1000), 't': step})
+	manager.wait()
+	assert manager.steps() == [3, 4]
+	assert manager.load()['t'] == 4
+	state = manager.load(3, keys=['variables'])
+	assert list(state) == ['variables']
+	np.testing.assert_array_equal(state['variables']['w'], np.arange(3))
+	assert not [name for name in os.listdir(str(tmpdir)) if name.endswith('.tmp')]
+	manager.close()
+
+def test_checkpoint_without_any(tmpdir):
+	assert CheckpointManager(str(tmpdir.join('none'))).load() is None
+
+def test_checkpoint_error_is_raised_by_wait(tmpdir):
+	manager = CheckpointManager(str(tmpdir))
+	manager.save(1, {'f': lambda: None}) # not picklable
+	with pytest.raises(Exception):
+		manager.wait()
+	manager.save(2, {'t': 2})
+	manager.close()
+	assert manager.steps() == [2]
+
+@pytest.mark.parametrize('cls', [ReplayBuffer, PrioritizedReplayBuffer])
+def test_buffer_state_round_trip(cls):
+	config = Config().update({'state_history': 2})
+	buffer = cls(50, config)
+	buffer.store_episodes(*random_episodes(config, 3, 10))
+	state = buffer.get_state()
+	restored = cls(50, config)
+	restored.store_episodes(*random_episodes(config, 4, 10, seed=1))
+	restored.set_state(state)
+	assert (restored.last_idx, restored.num_in_buffer) == (buffer.last_idx, buffer.num_in_buffer)
+	for name in cls.ARRAYS:
+		np.testing.assert_array_equal(getattr(restored, name), getattr(buffer, name))
+	if cls is PrioritizedReplayBuffer:
+		np.testing.assert_array_equal(restored._it_sum._value, buffer._it_sum._value)
+
+def test_memmap_buffer_reopens(tmpdir):
+	config = Config().update({'state_history': 2})
+	buffer = MemmapReplayBuffer(50, config, str(tmpdir))
+	buffer.store_episodes(*random_episodes(config, 3, 10))
+	reopened = MemmapReplayBuffer(50, config, str(tmpdir))
+	assert (reopened.last_idx, reopened.num_in_buffer) == (buffer.last_idx, buffer.num_in_buffer)
+	np.testing.assert_array_equal(reopened.frames, buffer.frames)
+	with pytest.raises(ValueError):
+		MemmapReplayBuffer(60, config, str(tmpdir))
+
+def test_memmap_buffer_state_is_its_cursor(tmpdir):
+	# a resume with buffer_dir moves the cursor back, the transitions stored since stay on disk
+	config = Config().update({'state_history': 2})
+	buffer = MemmapReplayBuffer(50, config, str(tmpdir))
+	buffer.store_episodes(*random_episodes(config, 3, 10))
+	state = buffer.get_state()
+	assert state == {'last_idx': buffer.last_idx, 'num_in_buffer': 30}
+	later = random_episodes(config, 1, 10, seed=1)
+	buffer.store_episodes(*later)
+	buffer.set_state(state)
+	assert buffer.num_in_buffer == 30
+	np.testing.assert_array_equal(buffer.frames[30:40], later[0][0])
+	# an in-memory buffer's state is copied into the arrays
+	memory = ReplayBuffer(50, config)
+	memory.store_episodes(*random_episodes(config, 2, 10, seed=2))
+	buffer.set_state(memory.get_state())
+	np.testing.assert_array_equal(buffer.frames, memory.frames)
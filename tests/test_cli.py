@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+import cli
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+def config_of(argv):
+	return cli.make_config(cli.make_parser().parse_args(['simulate'] + argv))
+
+def test_config_files_then_set_flags(tmp_path):
+	first, second = tmp_path / 'a.json', tmp_path / 'b.json'
+	first.write_text(json.dumps({'numCars': 10, 'gamma': 0.9}))
+	second.write_text(json.dumps({'numCars': 12}))
+	config = config_of(['--config', str(first), '--config', str(second), '--set', 'gamma=0.5',
+		'--set', 'hidden_size=[16, 8]', '--set', 'renderMode=none', '--set', 'nsteps_train=100'])
+	assert (config.numCars, config.gamma, config.hidden_size, config.renderMode) == (12, 0.5, [16, 8], 'none')
+	# derived fields follow the overrides
+	assert config.lr_nsteps == 50
+	assert config.state_length == 1 + 2 + 2 * config.actionSpeedHistory + 3 * 12
+
+def test_bad_overrides():
+	with pytest.raises(ValueError):
+		config_of(['--set', 'numCars'])
+	with pytest.raises(ValueError):
+		config_of(['--set', 'noSuchField=1'])
+	with pytest.raises(SystemExit):
+		cli.main(['simulate', '--quick'])
+
+def test_simulate(capsys):
+	cli.main(['simulate', '--episodes', '2', '--steps', '3', '--seed', '0'])
+	out = capsys.readouterr().out
+	assert out.startswith('Startup ')
+	assert 'Mean reward over 2 episodes' in out and '6 steps in' in out
+
+def test_simulator_commands_do_not_import_tensorflow():
+	code = 'import sys, cli; cli.main(sys.argv[1:]); print("tensorflow" in sys.modules)'
+	for argv in (['simulate', '--startup-only'], ['eval', '--policy', 'random', '--startup-only']):
+		out = subprocess.check_output([sys.executable, '-c', code] + argv, cwd=SRC, universal_newlines=True)
+		assert out.splitlines()[-1] == 'False'
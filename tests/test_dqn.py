@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from config import Config
+from dqn_model import DQN
+from numpy_q import NumpyQNetwork
+
+def make_model(tmp_path):
+	tf.reset_default_graph()
+	config = Config().update({'checkpoint_dir': str(tmp_path / 'checkpoints'), 'buffer_size': 1000})
+	np.random.seed(0)
+	model = DQN(config)
+	model.initialize()
+	states = np.random.random((10, config.T, config.state_length)).astype(np.float32)
+	actions = np.random.randint(config.numActions, size=(10, config.T))
+	rewards = np.random.random((10, config.T)).astype(np.float32)
+	model._bf.store_episodes(states, actions, rewards)
+	# moves the batch norm moving statistics away from their initial values
+	for t in range(1, 21):
+		model.train_step(t, config.batch_size, config.lr_begin)
+	return model
+
+def random_states(config, n):
+	return np.random.random((n, config.state_length, config.state_history)).astype(np.float32)
+
+def test_inference_matches_numpy_policy(tmp_path):
+	model = make_model(tmp_path)
+	states = random_states(model._config, 64)
+	q = model.get_q_values(states)
+	# no dropout in inference mode
+	np.testing.assert_array_equal(q, model.get_q_values(states))
+	np.testing.assert_allclose(q, model.get_numpy_network().get_q_values(states), rtol=1e-4, atol=1e-4)
+	np.testing.assert_array_equal(model.get_best_actions(states), model.get_policy(0.0).get_actions(states))
+
+def test_export_matches_tf_q_values(tmp_path):
+	model = make_model(tmp_path)
+	path = model.export(str(tmp_path / 'policy.npz'))
+	states = random_states(model._config, 64)
+	np.testing.assert_allclose(NumpyQNetwork.load(path).get_q_values(states), model.get_q_values(states), rtol=1e-4, atol=1e-4)
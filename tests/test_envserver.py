@@ -0,0 +1,80 @@
+import asyncio
+import os
+import threading
+import time
+import numpy as np
+import pytest
+
+from config import Config
+from envserver import EnvServer, EnvClient
+from VecTrafficSimulator import makeBatchSimulator
+
+NUM_ENVS = 4
+
+@pytest.fixture
+def address(tmp_path):
+	address = str(tmp_path / 'envserver.sock')
+	server = EnvServer(Config(), NUM_ENVS, seed=0, batch_wait=0.001)
+	loop = asyncio.new_event_loop()
+	task = loop.create_task(server.serve(address))
+	def run():
+		try:
+			loop.run_until_complete(task)
+		except asyncio.CancelledError:
+			pass
+	thread = threading.Thread(target=run)
+	thread.daemon = True
+	thread.start()
+	deadline = time.time() + 10
+	while not os.path.exists(address) and time.time() < deadline:
+		time.sleep(0.01)
+	yield address
+	loop.call_soon_threadsafe(task.cancel)
+	thread.join(10)
+
+def test_steps_match_local_simulator(address):
+	config = Config()
+	local = makeBatchSimulator(config, NUM_ENVS, 0)
+	client = EnvClient(address)
+	assert client.info() == [NUM_ENVS, config.state_length, config.numActions, NUM_ENVS]
+	ids = client.acquire(NUM_ENVS)
+	np.testing.assert_array_equal(np.sort(ids), np.arange(NUM_ENVS))
+	local.reset(ids)
+	np.testing.assert_allclose(client.reset(ids), local.state(ids), rtol=1e-6)
+	for t in range(5):
+		actions = (np.arange(NUM_ENVS) + t) % config.numActions
+		rewards, states = client.step(ids, actions)
+		np.testing.assert_allclose(rewards, local.step(actions, ids), rtol=1e-6)
+		np.testing.assert_allclose(states, local.state(ids), rtol=1e-6)
+	np.testing.assert_array_equal(client.state(ids), states)
+	client.close()
+
+def test_protocol_errors(address):
+	client = EnvClient(address)
+	other = EnvClient(address)
+	ids = client.acquire(2)
+	for call in (lambda: client.step([NUM_ENVS], [0]),
+			lambda: client.step(ids[:1], [9]),
+			lambda: client.step([ids[0], ids[0]], [0, 0]),
+			lambda: other.reset(ids),
+			lambda: client.step([], []),
+			lambda: client.reset([]),
+			lambda: client.acquire(NUM_ENVS)):
+		with pytest.raises(ValueError):
+			call()
+	# the connection stays usable after an error
+	rewards, states = client.step(ids, [0, 0])
+	assert rewards.shape == (2,)
+	client.close()
+	other.close()
+
+def test_roads_released_on_disconnect(address):
+	client = EnvClient(address)
+	client.acquire(3)
+	client.close()
+	other = EnvClient(address)
+	deadline = time.time() + 10
+	while other.info()[3] < NUM_ENVS and time.time() < deadline:
+		time.sleep(0.01)
+	assert other.info()[3] == NUM_ENVS
+	other.close()
@@ -0,0 +1,32 @@
+import numpy as np
+
+from config import Config
+from evaluation import Evaluator
+from policies import ConstantPolicy, RandomPolicy
+
+def make_config():
+	return Config().update({'T': 10})
+
+def test_rewards_do_not_depend_on_workers():
+	config = make_config()
+	inline = Evaluator(config, 1, seed=5).evaluate(RandomPolicy(config.numActions), 6, 10, log_freq=0)
+	pooled = Evaluator(config, 2, seed=5).evaluate(RandomPolicy(config.numActions), 6, 10, log_freq=0)
+	assert inline['rewards'] == pooled['rewards']
+	assert inline['n'] == 6 and not inline['stopped_early']
+	assert inline['mean'] == np.mean(inline['rewards'])
+
+def test_stats():
+	evaluator = Evaluator(make_config(), confidence=0.95)
+	stats = evaluator.stats([1.0, 2.0, 3.0, 4.0])
+	assert stats['n'] == 4 and stats['mean'] == 2.5
+	np.testing.assert_allclose(stats['ci'], 1.959964 * np.std([1, 2, 3, 4], ddof=1) / 2, rtol=1e-6)
+	assert evaluator.stats([1.0])['ci'] == float('inf')
+
+def test_stops_once_the_interval_is_narrow():
+	config = make_config()
+	evaluator = Evaluator(config, 1, seed=1, min_episodes=5, ci_width=1e9)
+	result = evaluator.evaluate(ConstantPolicy(0), 50, 10, log_freq=0)
+	assert result['n'] == 5 and result['stopped_early']
+	# the same prefix as a full run
+	full = Evaluator(config, 1, seed=1).evaluate(ConstantPolicy(0), 8, 10, log_freq=0)
+	assert full['rewards'][:5] == result['rewards']
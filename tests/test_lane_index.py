@@ -0,0 +1,60 @@
+import numpy as np
+
+from lane_index import LaneIndex
+
+ROWS, LANES, HEIGHT = 30, 3, 4
+
+def test_cells_match_dense_grid():
+	# random writes, including negative and out of range slices, read back as from the grid
+	rng = np.random.RandomState(0)
+	index = LaneIndex(LANES, ROWS, HEIGHT)
+	grid = np.zeros((ROWS, LANES))
+	for _ in range(2000):
+		lane = rng.randint(LANES)
+		start = rng.randint(-ROWS - 5, ROWS + 5)
+		stop = start + rng.randint(0, 8)
+		if rng.rand() < 0.6:
+			speed = 0.0 if rng.rand() < 0.3 else float(rng.randint(1, 4))
+			index.fill(lane, start, stop, speed)
+			grid[start:stop, lane] = speed
+		column = grid[start:stop, lane]
+		assert index.maxSpeed(lane, start, stop) == (column.max() if len(column) else 0.0)
+		assert index.occupied(lane, start, stop) == (np.sum(column) != 0)
+		assert index.holds(lane, start, stop, 2.0) == bool(np.all(column == 2.0))
+		np.testing.assert_array_equal(index.toGrid(), grid)
+	np.testing.assert_array_equal(index.toGrid(np.empty((10, LANES), np.float32), first=15), grid[15:25])
+
+def test_car_queries_match_sorted_rows():
+	rng = np.random.RandomState(1)
+	index = LaneIndex(LANES, ROWS, HEIGHT)
+	cars = {}
+	for carID in range(12):
+		cars[carID] = (rng.randint(LANES), rng.randint(-HEIGHT, ROWS))
+		index.insert(carID, *cars[carID])
+	for _ in range(500):
+		carID = rng.randint(12)
+		lane, row = cars[carID]
+		cars[carID] = (rng.randint(LANES), row + rng.randint(-3, 4))
+		index.move(carID, lane, row, *cars[carID])
+		lane, row = rng.randint(LANES), rng.randint(-HEIGHT, ROWS)
+		rows = sorted((r, i) for i, (l, r) in cars.items() if l == lane)
+		ahead = [r for r, i in rows if r > row]
+		behind = [r for r, i in rows if r < row]
+		leader, follower = index.leader(lane, row), index.follower(lane, row)
+		assert (leader and leader[1]) == (ahead[0] if ahead else None)
+		assert (follower and follower[1]) == (behind[-1] if behind else None)
+		assert index.lowest(lane) == (rows[0][0] if rows else None)
+		assert index.highest(lane) == (rows[-1][0] if rows else None)
+		assert index.gap(lane, row) == (ahead[0] - row - HEIGHT if ahead else np.inf)
+
+def test_snapshot_restores_repeatedly():
+	index = LaneIndex(LANES, ROWS, HEIGHT)
+	index.insert(0, 1, 5)
+	index.fill(1, 5, 9, 3.0)
+	state = index.snapshot()
+	for _ in range(2):
+		index.move(0, 1, 5, 2, 7)
+		index.fill(1, 5, 9, 0.0)
+		index.restore(state)
+		assert index.leader(1, 0) == (0, 5)
+		assert index.maxSpeed(1, 0, ROWS) == 3.0
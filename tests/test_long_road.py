@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from config import Config
+from LongRoadSimulator import LaneFrames, LongRoadSimulator
+
+def make_config(**overrides):
+	config = Config().update({'observationFeatures': ['grid', 'lidar'], 'longRoadRows': 5000, 'longRoadCars': 1000})
+	return config.update(overrides)
+
+def test_lane_frames_match_rows():
+	# cars of one lane as plain rows on the ring, moved and taken by brute force
+	rng = np.random.RandomState(0)
+	roadRows, height = 300, 4
+	frames = LaneFrames(1, roadRows, height)
+	rows = dict(enumerate(rng.choice(roadRows, 40, replace=False).astype(float)))
+	frames.load(np.array([[row, 0] for carID, row in sorted(rows.items())]))
+	for _ in range(200):
+		shift = rng.uniform(0, 50)
+		frames.advance(shift)
+		rows = dict((carID, (row + shift) % roadRows) for carID, row in rows.items())
+		start = rng.randint(0, roadRows)
+		stop = start + rng.randint(1, 60)
+		inside = lambda row: start <= row < stop or start <= row + roadRows < stop
+		touching = lambda row: any(inside(cell) for cell in np.arange(row, row + height) % roadRows)
+		assert frames.occupied(0, start, stop) == any(touching(int(row)) for row in rows.values())
+		if rng.rand() < 0.3:
+			taken = frames.take(0, start, stop)
+			assert sorted(carID for carID, row in taken) == sorted(carID for carID, row in rows.items() if inside(row))
+			for carID, row in taken:
+				assert start <= row < stop
+				np.testing.assert_allclose(row % roadRows, rows.pop(carID))
+				# put back half of them somewhere else
+				if carID % 2 == 0:
+					rows[carID] = float(rng.randint(roadRows))
+					frames.insert(carID, 0, rows[carID])
+		assert len(frames) == len(rows)
+
+def test_cars_are_conserved():
+	config = make_config()
+	np.random.seed(0)
+	sim = LongRoadSimulator(config)
+	assert len(sim.frames) + len(sim.active) == config.longRoadCars
+	for _ in range(100):
+		sim.progress(np.random.randint(config.numActions))
+		assert len(sim.frames) + len(sim.active) == config.longRoadCars
+		assert all(0 <= car.row < sim.windowRows for car in sim.active.values())
+		state = sim.state()
+		assert state.shape == (config.state_length,) and np.isfinite(state).all()
+		occupied, speeds = sim.window()
+		assert occupied.shape == speeds.shape == (sim.gridRows, config.numLanes)
+		np.testing.assert_array_equal(occupied, speeds != 0)
+
+def test_rejected_configs():
+	with pytest.raises(ValueError):
+		LongRoadSimulator(make_config(observationFeatures=['vector']))
+	with pytest.raises(ValueError):
+		LongRoadSimulator(make_config(longRoadRows=100, longRoadCars=5))
+	with pytest.raises(ValueError):
+		LongRoadSimulator(make_config(longRoadRows=1000, longRoadCars=1000))
@@ -0,0 +1,46 @@
+import numpy as np
+
+from numpy_q import NumpyQNetwork
+from policies import GreedyPolicy
+
+def random_layers(rng, sizes):
+	layers = []
+	for i, (a, b) in enumerate(zip(sizes, sizes[1:])):
+		layer = {'weights': rng.randn(a, b).astype(np.float32)}
+		if i < len(sizes) - 2:
+			# batch normalized, no biases as in DQN.get_q_values_op
+			layer['beta'] = rng.randn(b).astype(np.float32)
+			layer['moving_mean'] = rng.randn(b).astype(np.float32)
+			layer['moving_variance'] = rng.random_sample(b).astype(np.float32) + 0.5
+		else:
+			layer['biases'] = rng.randn(b).astype(np.float32)
+		layers.append(layer)
+	return layers
+
+def unfolded_q_values(layers, states, bn_epsilon=0.001):
+	# dense, batch norm on the moving statistics, ReLU, no dropout
+	x = states.reshape(len(states), -1).astype(np.float64)
+	for i, layer in enumerate(layers):
+		x = x.dot(layer['weights']) + layer.get('biases', 0.0)
+		if 'moving_mean' in layer:
+			x = (x - layer['moving_mean']) / np.sqrt(layer['moving_variance'] + bn_epsilon) + layer['beta']
+		if i < len(layers) - 1:
+			x = np.maximum(x, 0)
+	return x
+
+def test_folded_matches_unfolded():
+	rng = np.random.RandomState(0)
+	layers = random_layers(rng, [73, 128, 64, 32, 5])
+	network = NumpyQNetwork.from_layers(layers)
+	states = rng.random_sample((100, 73, 1)).astype(np.float32)
+	np.testing.assert_allclose(network.get_q_values(states), unfolded_q_values(layers, states), rtol=1e-4, atol=1e-4)
+
+def test_save_load(tmp_path):
+	rng = np.random.RandomState(1)
+	network = NumpyQNetwork.from_layers(random_layers(rng, [10, 8, 3]))
+	path = str(tmp_path / 'policy.npz')
+	network.save(path)
+	loaded = NumpyQNetwork.load(path)
+	states = rng.random_sample((20, 10, 1))
+	np.testing.assert_array_equal(loaded.get_q_values(states), network.get_q_values(states))
+	np.testing.assert_array_equal(GreedyPolicy(loaded).get_actions(states), np.argmax(network.get_q_values(states), axis=1))
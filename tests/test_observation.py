@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from config import Config
+from observation import observationLength
+from TrafficSimulator import TrafficSimulator
+
+def vector(sim):
+	# layout of the original TrafficSimulator.state, histories oldest first
+	return np.concatenate([[sim.EgoCarTopSpeed * sim.EgoCarSpeedFrac], sim.EgoCarPos,
+		np.roll(sim.actionHistory, -sim.actionHead), np.roll(sim.speedHistory, -sim.speedHead),
+		sim.carsTopSpeed * sim.carsSpeedFrac, sim.carsPos.ravel()])
+
+def cars(sim):
+	# (row, lane, speed) of every car, the ego car last
+	rows = [(int(row), int(lane), speed) for (row, lane), speed in zip(sim.carsPos, sim.carsTopSpeed * sim.carsSpeedFrac)]
+	return rows + [(sim.EgoCarPos[0], sim.EgoCarPos[1], sim.EgoCarTopSpeed * sim.EgoCarSpeedFrac)]
+
+def grid(sim, config):
+	# car cells pooled with loops
+	gridRows = config.canvasHeight // config.gridHeight
+	poolRows, lanes = config.observationGridRows, config.numLanes
+	poolSize = np.bincount(np.arange(gridRows) * poolRows // gridRows, minlength=poolRows)
+	counts, sums = np.zeros((poolRows, lanes)), np.zeros((poolRows, lanes))
+	for row, lane, speed in cars(sim):
+		for cell in range(row, row + config.carHeightGrid):
+			if 0 <= cell < gridRows:
+				counts[cell * poolRows // gridRows, lane] += 1
+				sums[cell * poolRows // gridRows, lane] += speed
+	return np.concatenate([(counts / poolSize[:, None]).ravel(), (sums / np.maximum(counts, 1)).ravel()])
+
+def check_lidar(values, sim, config):
+	# gaps to the nearest cars ahead and behind in each lane, and the speed of one of them
+	gridRows = config.canvasHeight // config.gridHeight
+	L, egoRow = config.numLanes, sim.EgoCarPos[0]
+	for lane in range(L):
+		others = [(row, speed) for row, carLane, speed in cars(sim)[:-1] if carLane == lane]
+		for block, nearby, nearest in ((0, [car for car in others if car[0] >= egoRow], min),
+				(2 * L, [car for car in others if car[0] < egoRow], max)):
+			if not nearby:
+				assert (values[block + lane], values[block + L + lane]) == (gridRows, 0.0)
+				continue
+			row = nearest(nearby)[0]
+			assert values[block + lane] == abs(row - egoRow) - config.carHeightGrid
+			assert values[block + L + lane] in [speed for carRow, speed in nearby if carRow == row]
+
+@pytest.mark.parametrize('features', [['vector'], ['grid'], ['lidar'], ['lidar', 'vector', 'grid']])
+def test_features_match_reference(features):
+	config = Config().update({'observationFeatures': features, 'observationGridRows': 9})
+	assert config.state_length == observationLength(config)
+	np.random.seed(0)
+	sim = TrafficSimulator(config)
+	out = np.empty(config.state_length)
+	for t in range(200):
+		state = sim.state()
+		offset = 0
+		for feature in features:
+			if feature == 'lidar':
+				check_lidar(state[offset:offset + 4 * config.numLanes], sim, config)
+				offset += 4 * config.numLanes
+				continue
+			expected = vector(sim) if feature == 'vector' else grid(sim, config)
+			np.testing.assert_allclose(state[offset:offset + len(expected)], expected, rtol=1e-12)
+			offset += len(expected)
+		assert offset == len(state)
+		# written in place into a preallocated buffer
+		assert sim.state(out=out) is out
+		np.testing.assert_array_equal(out, state)
+		sim.progress(np.random.randint(config.numActions))
+
+def test_unknown_feature():
+	with pytest.raises(ValueError):
+		Config().update({'observationFeatures': ['camera']})
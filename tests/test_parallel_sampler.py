@@ -0,0 +1,42 @@
+import numpy as np
+
+from config import Config
+from parallel_sampler import ParallelSampler
+from policies import RandomPolicy
+from TrafficSimulator import TrafficSimulator
+
+def serial_episodes(config, seed, num_episodes, num_workers, policy):
+	# episodes of the first round, each worker's run in a process of its own
+	states = np.empty((num_episodes, config.T, config.state_length), dtype=np.float32)
+	actions = np.empty((num_episodes, config.T), dtype=np.int32)
+	rewards = np.empty((num_episodes, config.T), dtype=np.float32)
+	for worker_id in range(num_workers):
+		sim = TrafficSimulator(config)
+		np.random.seed([seed, 1, worker_id])
+		for e in range(worker_id, num_episodes, num_workers):
+			sim.reset()
+			for t in range(config.T):
+				states[e, t] = sim.state()
+				actions[e, t] = policy.get_actions(states[e:e + 1, t, :, None])[0]
+				rewards[e, t] = sim.progress(actions[e, t])
+	return states, actions, rewards
+
+def test_matches_serial_and_repeats():
+	config = Config().update({'T': 15})
+	policy = RandomPolicy(config.numActions)
+	expected = serial_episodes(config, 7, 5, 2, policy)
+	samplers = [ParallelSampler(config, 2, 8, seed=7) for _ in range(2)]
+	try:
+		for sampler in samplers:
+			for got, want in zip(sampler.sample(policy, 5), expected):
+				np.testing.assert_array_equal(got, want)
+		# the next round differs, the sampler's state replays it
+		state = samplers[0].get_state()
+		second = [array.copy() for array in samplers[0].sample(policy, 5)]
+		assert not np.array_equal(second[0], expected[0])
+		samplers[1].set_state(state)
+		for got, want in zip(samplers[1].sample(policy, 5), second):
+			np.testing.assert_array_equal(got, want)
+	finally:
+		for sampler in samplers:
+			sampler.close()
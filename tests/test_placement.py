@@ -0,0 +1,83 @@
+import collections
+import itertools
+import os
+import numpy as np
+import pytest
+
+from config import Config
+from placement import freeSlots, drawConfiguration, drawRingConfiguration, ScenarioBank
+from TrafficSimulator import TrafficSimulator
+
+def spaced(rows, spacing):
+	rows = sorted(rows)
+	return all(b - a >= spacing for a, b in zip(rows, rows[1:]))
+
+def valid(carsPos, egoRow, egoLane, carHeight):
+	lanes = collections.defaultdict(list, {egoLane: [egoRow]})
+	for row, lane in carsPos:
+		lanes[lane].append(row)
+	return all(spaced(rows, 2 * carHeight) for rows in lanes.values())
+
+def test_free_slots_match_brute_force():
+	rng = np.random.RandomState(0)
+	occupied = rng.random_sample((3, 20, 4)) < 0.1
+	free = freeSlots(occupied, 2)
+	assert free.shape == (3, 18, 4)
+	for b, start, lane in itertools.product(range(3), range(18), range(4)):
+		assert free[b, start, lane] == (not occupied[b, max(start - 2, 0):start + 4, lane].any())
+
+def test_configuration_is_uniform():
+	# every valid placement of 2 cars on 2 lanes of 7 rows, around an ego car at row 2 of lane 0
+	starts = list(itertools.product(range(6), range(2)))
+	placements = [frozenset(cars) for cars in itertools.combinations(starts, 2) if valid(cars, 2, 0, 1)]
+	rng = np.random.RandomState(0)
+	counts = collections.Counter()
+	for _ in range(20000):
+		carsPos = drawConfiguration(2, 2, 7, 1, 2, 0, rng)
+		counts[frozenset(map(tuple, carsPos))] += 1
+	assert set(counts) == set(placements)
+	expected = 20000.0 / len(placements)
+	assert all(abs(count - expected) < 5 * np.sqrt(expected) for count in counts.values())
+
+def test_configuration_infeasible():
+	with pytest.raises(ValueError):
+		drawConfiguration(10, 2, 20, 2, 5, 0, np.random.RandomState(0))
+
+def test_ring_configuration_is_spaced_all_around():
+	rng = np.random.RandomState(1)
+	for _ in range(200):
+		carsPos = drawRingConfiguration(30, 3, 200, 4, 10, 1, rng)
+		assert carsPos[:, 0].min() >= 0 and carsPos[:, 0].max() < 200
+		for lane in range(3):
+			rows = sorted(carsPos[carsPos[:, 1] == lane, 0].tolist() + ([10] if lane == 1 else []))
+			assert spaced(rows + [rows[0] + 200], 8)
+
+def test_dense_roads_reset_to_valid_placements():
+	config = Config().update({'numCars': 22, 'numLanes': 3})
+	np.random.seed(0)
+	sim = TrafficSimulator(config)
+	for _ in range(50):
+		sim.reset()
+		assert valid(sim.carsPos.tolist(), sim.EgoCarPos[0], sim.EgoCarPos[1], config.carHeightGrid)
+
+def test_scenario_bank(tmp_path):
+	config = Config().update({'scenarioBankSize': 20, 'scenarioBankDir': str(tmp_path)})
+	np.random.seed(3)
+	state = np.random.get_state()[1].copy()
+	ScenarioBank(config)
+	# generating the bank leaves np.random where it was
+	np.testing.assert_array_equal(np.random.get_state()[1], state)
+	assert len(os.listdir(str(tmp_path))) == 1
+	sim = TrafficSimulator(config)
+	bank = np.asarray(sim.scenarios.carsPos)
+	assert bank.shape == (20, config.numCars, 2)
+	for carsPos in bank:
+		assert valid(carsPos.tolist(), sim.EgoCarPos[0], sim.EgoCarPos[1], config.carHeightGrid)
+	for _ in range(10):
+		sim.reset()
+		assert any(np.array_equal(sim.carsPos, carsPos) for carsPos in bank)
+	# loaded, not generated again, by the next simulator
+	mtime = os.path.getmtime(sim.scenarios.path)
+	np.testing.assert_array_equal(TrafficSimulator(config).scenarios.carsPos, bank)
+	assert os.path.getmtime(sim.scenarios.path) == mtime
+	assert ScenarioBank.key(config) != ScenarioBank.key(Config().update({'scenarioBankSize': 20, 'numCars': 10}))
@@ -0,0 +1,35 @@
+import itertools
+import threading
+import pytest
+
+from prefetcher import BatchPrefetcher
+
+def test_batches_in_order_and_bounded():
+	counter = itertools.count()
+	calls = []
+	def sample():
+		calls.append(None)
+		return next(counter)
+	prefetcher = BatchPrefetcher(sample, depth=3)
+	assert [prefetcher.get() for _ in range(10)] == list(range(10))
+	prefetcher.close()
+	# at most depth batches waiting, plus the one that was being put when close() was called
+	assert len(calls) <= 10 + 3 + 1
+
+def test_error_is_raised_by_get():
+	def sample():
+		raise RuntimeError('no batch')
+	prefetcher = BatchPrefetcher(sample, depth=2)
+	with pytest.raises(RuntimeError):
+		prefetcher.get()
+	prefetcher.close()
+
+def test_close_with_full_queue():
+	started = threading.Event()
+	def sample():
+		started.set()
+		return 0
+	prefetcher = BatchPrefetcher(sample, depth=1)
+	started.wait()
+	prefetcher.close()
+	assert not prefetcher._thread.is_alive()
@@ -0,0 +1,46 @@
+import csv
+import json
+import time
+
+from profiler import Profiler
+
+def test_disabled_profiler_records_nothing(tmp_path):
+	path = tmp_path / 'profile.jsonl'
+	profiler = Profiler(False, str(path))
+	with profiler.timer('env'):
+		pass
+	profiler.count('env_steps', 10)
+	assert profiler.flush(1) is None
+	assert not path.exists()
+
+def test_windows_of_timers_and_counters(tmp_path):
+	path = tmp_path / 'profile.jsonl'
+	profiler = Profiler(True, str(path))
+	for _ in range(3):
+		with profiler.timer('env'):
+			time.sleep(0.01)
+	profiler.count('env_steps', 30)
+	profiler.count('updates', 3)
+	first = profiler.flush(10)
+	assert first['step'] == 10 and first['calls/env'] == 3
+	assert first['time/env'] >= 0.03 and 0 < first['share/env'] <= 1
+	assert first['count/env_steps'] == 30 and first['rate/env_steps'] > 0
+	assert first['replay_ratio'] == 0.1
+	# the next window starts empty, the replay ratio is over all windows
+	profiler.count('env_steps', 10)
+	second = profiler.flush(20)
+	assert 'time/env' not in second and second['count/env_steps'] == 10
+	assert second['replay_ratio'] == 3 / 40.0
+	records = [json.loads(line) for line in path.read_text().splitlines()]
+	assert records == [first, second]
+
+def test_csv_rows(tmp_path):
+	path = tmp_path / 'profile.csv'
+	profiler = Profiler(True, str(path))
+	profiler.count('updates')
+	record = profiler.flush(5)
+	with open(str(path)) as f:
+		rows = list(csv.reader(f))
+	assert len(rows) == len(record) - 1
+	assert all(row[0] == '5' for row in rows)
+	assert ['5', 'count/updates', '1'] in rows
@@ -0,0 +1,57 @@
+import io
+import os
+import time
+import zipfile
+import numpy as np
+
+from config import Config
+from renderer import AsciiRenderer, RecordRenderer, loadFrames
+from TrafficSimulator import TrafficSimulator
+
+def random_grids(n, seed=0):
+	return np.random.RandomState(seed).random_sample((n, 70, 7)) * 80
+
+def test_record_frames(tmp_path):
+	path = str(tmp_path / 'out' / 'frames.npz')
+	renderer = RecordRenderer(path, chunkFrames=16)
+	grids = random_grids(40)
+	for grid in grids:
+		renderer.render(grid)
+	renderer.close()
+	np.testing.assert_array_equal(loadFrames(path), grids.astype(np.float16))
+
+def test_chunks_written_while_recording(tmp_path):
+	path = str(tmp_path / 'frames.npz')
+	renderer = RecordRenderer(path, chunkFrames=16)
+	grids = random_grids(40)
+	for grid in grids:
+		renderer.render(grid)
+	# two full chunks are on disk before close, the last 8 frames are not
+	deadline = time.time() + 10
+	while time.time() < deadline:
+		if os.path.exists(path) and len(zipfile.ZipFile(path).namelist()) == 2:
+			break
+		time.sleep(0.01)
+	np.testing.assert_array_equal(loadFrames(path), grids[:32].astype(np.float16))
+	renderer.close()
+	assert len(loadFrames(path)) == 40
+
+def test_simulator_records_every_substep(tmp_path):
+	path = str(tmp_path / 'frames.npz')
+	config = Config().update({'renderMode': 'record', 'renderPath': path})
+	sim = TrafficSimulator(config)
+	for t in range(3):
+		sim.progress(0)
+	grid = sim.grid
+	sim.close()
+	frames = loadFrames(path)
+	assert len(frames) == 3 * config.decisionFreq
+	np.testing.assert_array_equal(frames[-1], grid.astype(np.float16))
+
+def test_ascii_interval():
+	stream = io.StringIO()
+	renderer = AsciiRenderer(interval=60.0, stream=stream)
+	renderer.render(np.zeros((3, 2)))
+	renderer.render(np.ones((3, 2)))
+	# the second frame came within the interval
+	assert stream.getvalue().count('=' * 87) == 1
@@ -0,0 +1,168 @@
+import numpy as np
+import pytest
+
+from config import Config
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer, MemmapReplayBuffer, make_replay_buffer
+
+def make_config(**overrides):
+	return Config().update(overrides)
+
+def random_episodes(config, E, T, seed=0):
+	rng = np.random.RandomState(seed)
+	states = rng.random_sample((E, T, config.state_length)).astype(np.float32)
+	actions = rng.randint(config.numActions, size=(E, T))
+	rewards = rng.random_sample((E, T)).astype(np.float32)
+	return states, actions, rewards
+
+def ring(buffer, name):
+	# array of a buffer from its oldest to its newest slot
+	return np.roll(getattr(buffer, name), -(buffer.last_idx + 1), axis=0)
+
+def test_store_episodes_matches_store():
+	config = make_config(state_history=2, n_step=3)
+	states, actions, rewards = random_episodes(config, 7, 10)
+	bulk = ReplayBuffer(50, config)
+	bulk.store_episodes(states, actions, rewards)
+	single = ReplayBuffer(50, config)
+	for e in range(7):
+		single.store(states[e], actions[e], rewards[e])
+	assert bulk.num_in_buffer == single.num_in_buffer == 50
+	for name in ReplayBuffer.ARRAYS:
+		np.testing.assert_array_equal(ring(bulk, name), ring(single, name))
+
+def test_store_episodes_larger_than_buffer():
+	config = make_config(state_history=2)
+	states, actions, rewards = random_episodes(config, 8, 10)
+	buffer = ReplayBuffer(50, config)
+	buffer.store_episodes(states, actions, rewards)
+	assert buffer.num_in_buffer == 50
+	# the last 50 of the 80 transitions, oldest first
+	np.testing.assert_array_equal(ring(buffer, 'frames'), states.reshape(80, -1)[30:])
+	np.testing.assert_array_equal(ring(buffer, 'actions'), actions.reshape(80)[30:])
+	np.testing.assert_array_equal(ring(buffer, 'episode_start'), np.tile(np.arange(10) == 0, 5))
+	states_, states_p, _, _, _ = buffer.sample(32)
+	assert states_.shape == states_p.shape == (32, config.state_length, 2)
+
+def test_nstep_returns():
+	config = make_config(n_step=2, gamma=0.5)
+	buffer = ReplayBuffer(10, config)
+	returns, bootstrap = buffer.nstep_returns(np.array([[1.0, 2.0, 4.0, 8.0]]))
+	# the reward of the last step is never part of a return
+	np.testing.assert_allclose(returns, [[2.0, 4.0, 4.0, 0.0]])
+	np.testing.assert_array_equal(bootstrap, [[2, 2, 1, 0]])
+
+def test_sample_stays_in_episode():
+	config = make_config(state_history=3)
+	states, actions, rewards = random_episodes(config, 6, 5)
+	buffer = ReplayBuffer(20, config)
+	buffer.store_episodes(states, actions, rewards)
+	np.random.seed(0)
+	idx = buffer.sample_idx(1000)
+	age = (buffer.last_idx - idx) % buffer.size
+	assert age.min() >= 1 and age.max() <= buffer.num_in_buffer - config.state_history
+	# the last step of an episode has no next state
+	assert not buffer.episode_start[(idx + 1) % buffer.size].any()
+	stacks = buffer.encode_stacks(idx, config.state_history)
+	for i, stack in zip(idx, stacks):
+		# frames from before the start of the episode of frame i are zeroed
+		started = False
+		for k in range(config.state_history):
+			slot = (i - k) % buffer.size
+			expected = 0.0 if started else buffer.frames[slot]
+			np.testing.assert_array_equal(stack[:, -1 - k], expected)
+			started = started or buffer.episode_start[slot]
+
+def sampleable(buffer):
+	# slots the uniform buffer can sample, by its rule
+	age = np.arange(1, buffer.max_sample_age() + 1)
+	slots = (buffer.last_idx - age) % buffer.size
+	return set(slots[~buffer.episode_start[(slots + 1) % buffer.size]].tolist())
+
+def test_prioritized_samples_same_transitions_as_uniform():
+	config = make_config(state_history=3)
+	buffer = PrioritizedReplayBuffer(37, config)
+	for seed in range(12):
+		buffer.store_episodes(*random_episodes(config, 2, 5, seed))
+		if buffer.max_sample_age() >= 1:
+			assert set(np.flatnonzero(buffer._it_sum[np.arange(37)] > 0).tolist()) == sampleable(buffer)
+
+def test_prioritized_sample_weights():
+	config = make_config(state_history=2, prioritized_alpha=1.0)
+	buffer = PrioritizedReplayBuffer(40, config)
+	buffer.store_episodes(*random_episodes(config, 4, 10))
+	np.random.seed(0)
+	idx = buffer.sample_idx(100)
+	buffer.update_priorities(idx, np.arange(100) % 7)
+	samples = buffer.sample(256, beta=1.0)
+	weights, idx = samples[-2:]
+	assert set(idx.tolist()) <= sampleable(buffer)
+	assert weights.max() <= 1.0
+	# weights are inversely proportional to the priorities
+	np.testing.assert_allclose(weights * buffer._it_sum[idx], (weights * buffer._it_sum[idx])[0], rtol=1e-5)
+
+def test_prioritized_nothing_to_sample():
+	config = make_config()
+	buffer = PrioritizedReplayBuffer(10, config)
+	# episodes of one step have no next state
+	buffer.store_episodes(*random_episodes(config, 5, 1))
+	with pytest.raises(ValueError):
+		buffer.sample(4, beta=0.4)
+
+def padded(frames, history):
+	# the last history frames as [state_length, history], zero-padded in front like pad_state
+	stack = np.zeros((frames.shape[-1], history), dtype=np.float32)
+	frames = frames[-history:]
+	stack[:, history - len(frames):] = frames.T
+	return stack
+
+@pytest.mark.parametrize('n_step, dtype', [(1, 'float32'), (3, 'float32'), (1, 'float16')])
+def test_encode_sample_matches_padded_episodes(n_step, dtype):
+	config = make_config(state_history=3, n_step=n_step, gamma=0.5, buffer_dtype=dtype)
+	states, actions, rewards = random_episodes(config, 9, 6)
+	buffer = ReplayBuffer(40, config)
+	for e in range(9):
+		buffer.store(states[e], actions[e], rewards[e])
+	assert buffer.frames.dtype == np.dtype(dtype)
+	stored = states.astype(dtype).astype(np.float32)
+	idx = np.array(sorted(sampleable(buffer)))
+	batch_states, batch_states_p, batch_actions, returns, discounts = buffer.encode_sample(idx)
+	# the last 40 of the 54 transitions are stored, the oldest in the slot after last_idx
+	first = (buffer.last_idx + 1) % 40
+	for i, slot in enumerate(idx):
+		e, t = divmod((slot - first) % 40 + 14, 6)
+		k = min(n_step, 5 - t)
+		np.testing.assert_array_equal(batch_states[i], padded(stored[e, :t + 1], 3))
+		np.testing.assert_array_equal(batch_states_p[i], padded(stored[e, :t + k + 1], 3))
+		assert batch_actions[i] == actions[e, t]
+		np.testing.assert_allclose(returns[i], np.sum(rewards[e, t:t + k] * 0.5 ** np.arange(k)), rtol=1e-6)
+		assert discounts[i] == 0.5 ** k
+
+def test_memmap_matches_in_memory(tmp_path):
+	config = make_config(state_history=2, n_step=2)
+	memory = ReplayBuffer(30, config)
+	disk = MemmapReplayBuffer(30, config, str(tmp_path))
+	for seed in range(5):
+		episodes = random_episodes(config, 2, 4, seed)
+		memory.store_episodes(*episodes)
+		disk.store_episodes(*episodes)
+	for name in ReplayBuffer.ARRAYS:
+		np.testing.assert_array_equal(getattr(disk, name), getattr(memory, name))
+	np.random.seed(0)
+	idx = disk.sample_idx(64)
+	assert np.all(np.diff(idx) >= 0)
+	for got, want in zip(disk.encode_sample(idx), memory.encode_sample(idx)):
+		np.testing.assert_array_equal(got, want)
+	# reopened by another buffer, e.g. after a restart
+	del disk
+	reopened = MemmapReplayBuffer(30, config, str(tmp_path))
+	assert (reopened.last_idx, reopened.num_in_buffer) == (memory.last_idx, memory.num_in_buffer)
+	np.testing.assert_array_equal(reopened.returns, memory.returns)
+	with pytest.raises(ValueError):
+		MemmapReplayBuffer(30, make_config(state_history=2, n_step=3), str(tmp_path))
+
+def test_make_replay_buffer(tmp_path):
+	assert type(make_replay_buffer(make_config())) is ReplayBuffer
+	assert type(make_replay_buffer(make_config(prioritized_replay=True))) is PrioritizedReplayBuffer
+	assert type(make_replay_buffer(make_config(buffer_dir=str(tmp_path)))) is MemmapReplayBuffer
+	with pytest.raises(ValueError):
+		make_replay_buffer(make_config(buffer_dir=str(tmp_path), prioritized_replay=True))
@@ -0,0 +1,38 @@
+import numpy as np
+
+from config import Config
+from LongRoadSimulator import LongRoadSimulator
+from TrafficSimulator import TrafficSimulator
+
+def long_road_config():
+	return Config().update({'observationFeatures': ['grid', 'lidar'], 'longRoadRows': 20000, 'longRoadCars': 4000})
+
+def run(sim, start, stop):
+	return [(sim.progress(t % 5), sim.state().tolist()) for t in range(start, stop)]
+
+def check_snapshot(make):
+	# taking a snapshot leaves the episode unchanged, and restoring it with rng repeats the rest
+	np.random.seed(3)
+	reference = run(make(), 0, 60)
+	np.random.seed(3)
+	sim = make()
+	first = run(sim, 0, 20)
+	at = sim.state().tolist()
+	snap = sim.snapshot(rng=True)
+	plain = sim.snapshot()
+	assert first + run(sim, 20, 60) == reference
+	for _ in range(2):
+		sim.restore(snap)
+		assert run(sim, 20, 60) == reference[20:]
+	# without rng, only the road is restored
+	sim.restore(plain)
+	assert sim.state().tolist() == at
+
+def test_traffic_simulator_snapshot():
+	check_snapshot(lambda: TrafficSimulator(Config()))
+
+def test_traffic_simulator_snapshot_own_rng():
+	check_snapshot(lambda: TrafficSimulator(Config(), np.random.RandomState(np.random.PCG64(3))))
+
+def test_long_road_snapshot():
+	check_snapshot(lambda: LongRoadSimulator(long_road_config()))
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from config import Config
+from TrafficSimulator import TrafficSimulator
+
+def episode(config, seed, steps):
+	np.random.seed(seed)
+	sim = TrafficSimulator(config)
+	actions = np.random.RandomState(seed).randint(config.numActions, size=steps)
+	trace = []
+	for action in actions:
+		reward = sim.progress(action)
+		trace.append((reward, sim.state(), sim.grid, sim.carsPos.copy(), sim.carsSpeedFrac.copy()))
+	return trace
+
+@pytest.mark.parametrize('overrides', [{}, {'decisionFreq': 20}, {'numCars': 30, 'numLanes': 4}, {'numCars': 8, 'canvasHeight': 1400}])
+def test_adaptive_substeps_match_fixed(overrides):
+	fixed = Config().update(overrides)
+	adaptive = Config().update(dict(overrides, adaptiveSubsteps=True))
+	for seed in range(3):
+		for step, (a, b) in enumerate(zip(episode(fixed, seed, 60), episode(adaptive, seed, 60))):
+			for x, y in zip(a, b):
+				np.testing.assert_array_equal(x, y, err_msg='seed {} step {}'.format(seed, step))
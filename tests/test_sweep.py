@@ -0,0 +1,45 @@
+import numpy as np
+
+from sweep import SweepRunner, format_result, grid_trials, random_trials
+
+def objective(config, report):
+	# best at gamma = 0.9, no reward at all for gamma = 0.5
+	if config.gamma == 0.5:
+		return None
+	for step in (1, 2, 3):
+		reward = -abs(config.gamma - 0.9) * step
+		if report(step, reward):
+			break
+	return reward
+
+def test_grid_trials():
+	assert grid_trials({'gamma': [0.9, 0.99], 'n_step': [1, 3]}) == [
+		{'gamma': 0.9, 'n_step': 1}, {'gamma': 0.9, 'n_step': 3}, {'gamma': 0.99, 'n_step': 1}, {'gamma': 0.99, 'n_step': 3}]
+
+def test_random_trials():
+	space = {'lr_begin': {'loguniform': [1e-5, 1e-3]}, 'numCars': {'randint': [5, 20]}, 'hidden_size': [[64], [128]]}
+	trials = random_trials(space, 20, seed=1)
+	assert trials == random_trials(space, 20, seed=1)
+	for trial in trials:
+		assert 1e-5 <= trial['lr_begin'] <= 1e-3
+		assert 5 <= trial['numCars'] < 20
+		assert trial['hidden_size'] in ([64], [128])
+
+def test_run_ranks_and_caches(tmp_path, capsys):
+	runner = SweepRunner(str(tmp_path), 2, objective, prune=False)
+	ranked = runner.run(grid_trials({'gamma': [0.5, 0.8, 0.9, 0.95]}))
+	assert [result['overrides']['gamma'] for result in ranked] == [0.9, 0.95, 0.8, 0.5]
+	np.testing.assert_allclose(ranked[1]['reward'], -0.15)
+	assert format_result(ranked[-1]).split()[0] == 'none'
+	rerun = runner.run(grid_trials({'gamma': [0.8, 0.9]}))
+	assert '2 trials, 2 cached, 0 to run' in capsys.readouterr().out
+	assert [result['key'] for result in rerun] == [result['key'] for result in ranked[:3:2]]
+
+def test_median_stopping(tmp_path):
+	runner = SweepRunner(str(tmp_path), 1, objective, min_trials=2)
+	runner.run(grid_trials({'gamma': [0.85, 0.9, 0.95]}))
+	# the cached trials count as the other trials of the stopping rule
+	ranked = runner.run(grid_trials({'gamma': [0.85, 0.9, 0.95, 0.1]}))
+	worst = ranked[-1]
+	assert worst['overrides'] == {'gamma': 0.1}
+	assert worst['stopped_early'] and len(worst['reports']) == 1
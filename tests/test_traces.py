@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from config import Config
+from replay_buffer import ReplayBuffer
+from traces import TraceReader, TraceStream, TraceWriter, observations
+from TrafficSimulator import TrafficSimulator
+
+def record(directory, config, num_episodes):
+	# episodes of random actions, recorded as model.simulate_an_episode does, and their states
+	writer = TraceWriter(directory, config, config.trace_chunk_episodes)
+	sim = TrafficSimulator(config)
+	states = np.empty((num_episodes, config.T, config.state_length), dtype=np.float32)
+	for e in range(num_episodes):
+		sim.reset()
+		for t in range(config.T):
+			states[e, t] = sim.state()
+			action = np.random.randint(config.numActions)
+			writer.observe(sim)
+			writer.step(sim, action, sim.progress(action))
+	writer.close()
+	return states
+
+@pytest.mark.parametrize('features', [['vector'], ['grid', 'vector']])
+def test_observations_match_the_simulator(tmp_path, features):
+	config = Config().update({'T': 12, 'trace_chunk_episodes': 3, 'observationFeatures': features})
+	np.random.seed(0)
+	states = record(str(tmp_path), config, 7)
+	reader = TraceReader(str(tmp_path), config)
+	assert len(reader.chunks) == 3
+	episodes = [episode for chunk in range(3) for episode in reader.episodes(chunk)]
+	assert len(episodes) == 7
+	for e, episode in enumerate(episodes):
+		# speed fractions are stored as float32
+		np.testing.assert_allclose(observations(episode, config), states[e], rtol=1e-6)
+
+def test_writer_appends_and_checks_the_layout(tmp_path):
+	config = Config().update({'T': 5, 'trace_chunk_episodes': 2})
+	record(str(tmp_path), config, 2)
+	record(str(tmp_path), config, 3)
+	assert [len(list(TraceReader(str(tmp_path), config).episodes(i))) for i in range(3)] == [2, 2, 1]
+	with pytest.raises(ValueError):
+		TraceWriter(str(tmp_path), Config().update({'T': 6}))
+	with pytest.raises(ValueError):
+		TraceReader(str(tmp_path), Config().update({'T': 5, 'numCars': 10}))
+
+def test_stream_visits_every_episode_once_per_pass(tmp_path):
+	config = Config().update({'T': 6, 'trace_chunk_episodes': 4})
+	np.random.seed(1)
+	states = record(str(tmp_path), config, 10)
+	stream = TraceStream(str(tmp_path), config, seed=0)
+	for _ in range(2):
+		seen = [stream.next_episode() for _ in range(10)]
+		firsts = sorted(observations(episode, config)[0].tolist() for episode in seen)
+		assert firsts == sorted(states[:, 0].tolist())
+	buffer = ReplayBuffer(100, config)
+	stream.fill(buffer, 3)
+	assert buffer.num_in_buffer == 18
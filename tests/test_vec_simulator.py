@@ -0,0 +1,53 @@
+import numpy as np
+
+from config import Config
+from rollout import BatchRollout
+from VecTrafficSimulator import VecTrafficSimulator, TrafficSimulatorBatch, makeBatchSimulator
+
+def test_vec_matches_scalar():
+	# From the same cars and random stream, one road of VecTrafficSimulator steps as TrafficSimulator
+	config = Config()
+	for seed in range(3):
+		scalar = TrafficSimulatorBatch(config, 1, seed)
+		vec = VecTrafficSimulator(config, 1, seed)
+		vec.grid[:] = 0.0
+		vec.initEgoCar(np.arange(1))
+		vec.initCarsFrom(np.arange(1), scalar.sims[0].carsPos[None])
+		vec.rng.seed(seed)
+		scalar.rng.seed(seed)
+		for t in range(50):
+			actions = [t % 5]
+			np.testing.assert_allclose(scalar.step(actions), vec.step(actions))
+			np.testing.assert_allclose(scalar.state(), vec.state())
+
+def test_make_batch_simulator():
+	config = Config()
+	assert isinstance(makeBatchSimulator(config, 4), TrafficSimulatorBatch)
+	assert isinstance(makeBatchSimulator(config, VecTrafficSimulator.EFFICIENT_ENVS), VecTrafficSimulator)
+	grid = Config().update({'observationFeatures': ['grid']})
+	assert isinstance(makeBatchSimulator(grid, VecTrafficSimulator.EFFICIENT_ENVS), TrafficSimulatorBatch)
+
+def test_batch_subset():
+	config = Config()
+	sim = TrafficSimulatorBatch(config, 3, seed=0)
+	before = sim.state()
+	rewards = sim.step([3, 4], envIds=[2, 0])
+	assert rewards.shape == (2,)
+	after = sim.state()
+	np.testing.assert_array_equal(after[1], before[1])
+	out = np.empty((2, config.state_length), dtype=np.float32)
+	sim.state([0, 2], out=out)
+	np.testing.assert_allclose(out, after[[0, 2]], rtol=1e-6)
+
+def test_rollout_repeats_from_its_state():
+	config = Config()
+	for K in (2, VecTrafficSimulator.EFFICIENT_ENVS):
+		rollout = BatchRollout(config, K, seed=1)
+		actions_fn = lambda states: np.arange(len(states)) % 5
+		state = rollout.get_state()
+		first = rollout.run(5, actions_fn)
+		rollout.set_state(state)
+		second = rollout.run(5, actions_fn)
+		for a, b in zip(first, second):
+			np.testing.assert_array_equal(a, b)
+		assert first[0].shape == (K, 5, config.state_length)